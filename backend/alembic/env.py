@@ -10,6 +10,8 @@ from alembic import context
 from apps.user.models import User
 from apps.product.models import Product, Category
 from apps.bulk_request.models import BulkRequest, BulkRequestPledge
+from apps.seller.models import SellerProductRollup, SellerPledgeRollup
+from apps.common.models import IdempotencyKey
 
 # this is the Alembic Config object, which provides
 # access to the values within the .ini file in use.
@@ -26,6 +28,17 @@ if config.config_file_name is not None:
 # target_metadata = mymodel.Base.metadata
 target_metadata = Base.metadata
 
+
+def include_object(object, name, type_, reflected, compare_to):
+    # backfill_progress is managed by apps.common.migrations, and the
+    # bulk_request_location R*Tree (with its shadow tables) by raw DDL
+    if type_ == "table" and (
+        name == "backfill_progress" or name.startswith("bulk_request_location")
+    ):
+        return False
+    return True
+
+
 # other values from the config, defined by the needs of env.py,
 # can be acquired:
 # my_important_option = config.get_main_option("my_important_option")
@@ -48,6 +61,7 @@ def run_migrations_offline() -> None:
     context.configure(
         url=url,
         target_metadata=target_metadata,
+        include_object=include_object,
         literal_binds=True,
         dialect_opts={"paramstyle": "named"},
     )
@@ -70,7 +84,11 @@ def run_migrations_online() -> None:
     )
 
     with connectable.connect() as connection:
-        context.configure(connection=connection, target_metadata=target_metadata)
+        context.configure(
+            connection=connection,
+            target_metadata=target_metadata,
+            include_object=include_object,
+        )
 
         with context.begin_transaction():
             context.run_migrations()
@@ -0,0 +1,32 @@
+"""Record the owner and lease of running idempotency keys
+
+Revision ID: 0c6e8a2f4b91
+Revises: f7b3c5d18a42
+Create Date: 2026-10-19 23:12:48.604117+00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0c6e8a2f4b91'
+down_revision: Union[str, None] = 'f7b3c5d18a42'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('idempotency_key', sa.Column('owner_pid', sa.Integer(), nullable=True))
+    op.add_column(
+        'idempotency_key', sa.Column('heartbeat_at', sa.DateTime(timezone=True), nullable=True)
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('idempotency_key', 'heartbeat_at')
+    op.drop_column('idempotency_key', 'owner_pid')
@@ -0,0 +1,85 @@
+"""Add archive tables for products, bulk requests and pledges
+
+Revision ID: 3f9c2a7d1e54
+Revises: 67bd71084a8d
+Create Date: 2026-10-19 09:12:41.204518+00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3f9c2a7d1e54'
+down_revision: Union[str, None] = '67bd71084a8d'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('product_archive',
+    sa.Column('id', sa.Integer(), autoincrement=False, nullable=False),
+    sa.Column('name', sa.String(length=100), nullable=False),
+    sa.Column('description', sa.Text(), nullable=True),
+    sa.Column('price', sa.Float(), nullable=False),
+    sa.Column('photo_url', sa.String(length=255), nullable=True),
+    sa.Column('is_active', sa.Boolean(), nullable=False),
+    sa.Column('category_id', sa.Integer(), nullable=True),
+    sa.Column('product_owner_id', sa.Integer(), nullable=True),
+    sa.Column('created_at', sa.DateTime(timezone=True), nullable=True),
+    sa.Column('updated_at', sa.DateTime(timezone=True), nullable=True),
+    sa.Column('archived_at', sa.DateTime(timezone=True), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_product_archive_product_owner_id'), 'product_archive', ['product_owner_id'], unique=False)
+    op.create_table('bulk_request_archive',
+    sa.Column('id', sa.Integer(), autoincrement=False, nullable=False),
+    sa.Column('title', sa.String(length=255), nullable=False),
+    sa.Column('description', sa.Text(), nullable=True),
+    sa.Column('product_name', sa.String(length=255), nullable=False),
+    sa.Column('category_id', sa.Integer(), nullable=True),
+    sa.Column('quantity_needed', sa.Float(), nullable=False),
+    sa.Column('unit', sa.String(length=50), nullable=False),
+    sa.Column('max_price_per_unit', sa.Float(), nullable=True),
+    sa.Column('total_budget', sa.Float(), nullable=True),
+    sa.Column('delivery_deadline', sa.DateTime(timezone=True), nullable=False),
+    sa.Column('delivery_location', sa.String(length=500), nullable=False),
+    sa.Column('delivery_instructions', sa.Text(), nullable=True),
+    sa.Column('status', sa.Enum('OPEN', 'PARTIALLY_FILLED', 'FULLY_FILLED', 'CLOSED', 'EXPIRED', name='bulkrequeststatus'), nullable=False),
+    sa.Column('quantity_pledged', sa.Float(), nullable=False),
+    sa.Column('buyer_id', sa.Integer(), nullable=False),
+    sa.Column('created_at', sa.DateTime(timezone=True), nullable=False),
+    sa.Column('updated_at', sa.DateTime(timezone=True), nullable=False),
+    sa.Column('archived_at', sa.DateTime(timezone=True), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_bulk_request_archive_buyer_id'), 'bulk_request_archive', ['buyer_id'], unique=False)
+    op.create_table('bulk_request_pledge_archive',
+    sa.Column('archive_id', sa.Integer(), autoincrement=True, nullable=False),
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('quantity_pledged', sa.Float(), nullable=False),
+    sa.Column('price_per_unit', sa.Float(), nullable=False),
+    sa.Column('estimated_delivery_date', sa.DateTime(timezone=True), nullable=False),
+    sa.Column('delivery_notes', sa.Text(), nullable=True),
+    sa.Column('status', sa.Enum('PENDING', 'ACCEPTED', 'REJECTED', 'FULFILLED', 'CANCELLED', name='pledgestatus'), nullable=False),
+    sa.Column('bulk_request_id', sa.Integer(), nullable=False),
+    sa.Column('farmer_id', sa.Integer(), nullable=False),
+    sa.Column('created_at', sa.DateTime(timezone=True), nullable=False),
+    sa.Column('updated_at', sa.DateTime(timezone=True), nullable=False),
+    sa.Column('archived_at', sa.DateTime(timezone=True), nullable=False),
+    sa.PrimaryKeyConstraint('archive_id')
+    )
+    op.create_index(op.f('ix_bulk_request_pledge_archive_bulk_request_id'), 'bulk_request_pledge_archive', ['bulk_request_id'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f('ix_bulk_request_pledge_archive_bulk_request_id'), table_name='bulk_request_pledge_archive')
+    op.drop_table('bulk_request_pledge_archive')
+    op.drop_index(op.f('ix_bulk_request_archive_buyer_id'), table_name='bulk_request_archive')
+    op.drop_table('bulk_request_archive')
+    op.drop_index(op.f('ix_product_archive_product_owner_id'), table_name='product_archive')
+    op.drop_table('product_archive')
@@ -0,0 +1,107 @@
+"""Geocode bulk request delivery locations and index them in an R*Tree
+
+Revision ID: 8b41d6e07c2a
+Revises: 3f9c2a7d1e54
+Create Date: 2026-10-19 11:02:17.583920+00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+from apps.common.geo import geocode
+from apps.common.migrations import Backfill, reset_backfill, run_backfill
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8b41d6e07c2a'
+down_revision: Union[str, None] = '3f9c2a7d1e54'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+LOCATION_INDEX_DDL = [
+    """
+    CREATE VIRTUAL TABLE bulk_request_location
+    USING rtree(id, min_lat, max_lat, min_lon, max_lon)
+    """,
+    """
+    CREATE TRIGGER bulk_request_location_insert
+    AFTER INSERT ON bulk_request
+    WHEN new.delivery_lat IS NOT NULL AND new.delivery_lon IS NOT NULL
+    BEGIN
+        INSERT INTO bulk_request_location
+        VALUES (new.id, new.delivery_lat, new.delivery_lat, new.delivery_lon, new.delivery_lon);
+    END
+    """,
+    """
+    CREATE TRIGGER bulk_request_location_update
+    AFTER UPDATE OF delivery_lat, delivery_lon ON bulk_request
+    BEGIN
+        DELETE FROM bulk_request_location WHERE id = old.id;
+        INSERT INTO bulk_request_location
+        SELECT new.id, new.delivery_lat, new.delivery_lat, new.delivery_lon, new.delivery_lon
+        WHERE new.delivery_lat IS NOT NULL AND new.delivery_lon IS NOT NULL;
+    END
+    """,
+    """
+    CREATE TRIGGER bulk_request_location_delete
+    AFTER DELETE ON bulk_request
+    BEGIN
+        DELETE FROM bulk_request_location WHERE id = old.id;
+    END
+    """,
+]
+
+
+def geocode_row(row):
+    point = geocode(row.delivery_location)
+    if point is None:
+        return None
+    return {'delivery_lat': point[0], 'delivery_lon': point[1]}
+
+
+def geocode_backfill(table_name: str) -> Backfill:
+    table = sa.table(
+        table_name,
+        sa.column('id', sa.Integer),
+        sa.column('delivery_location', sa.String),
+        sa.column('delivery_lat', sa.Float),
+        sa.column('delivery_lon', sa.Float),
+    )
+    return Backfill(
+        f'{table_name}_geocode',
+        table,
+        where=table.c.delivery_lat.is_(None),
+        compute=geocode_row,
+    )
+
+
+# Geocode the existing rows; the update trigger fills the R*Tree
+BULK_REQUEST_GEOCODE = geocode_backfill('bulk_request')
+BULK_REQUEST_ARCHIVE_GEOCODE = geocode_backfill('bulk_request_archive')
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    for table_name in ('bulk_request', 'bulk_request_archive'):
+        op.add_column(table_name, sa.Column('delivery_lat', sa.Float(), nullable=True))
+        op.add_column(table_name, sa.Column('delivery_lon', sa.Float(), nullable=True))
+    for statement in LOCATION_INDEX_DDL:
+        op.execute(statement)
+
+    run_backfill(BULK_REQUEST_GEOCODE)
+    run_backfill(BULK_REQUEST_ARCHIVE_GEOCODE)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    reset_backfill(BULK_REQUEST_ARCHIVE_GEOCODE)
+    reset_backfill(BULK_REQUEST_GEOCODE)
+    op.execute("DROP TRIGGER IF EXISTS bulk_request_location_delete")
+    op.execute("DROP TRIGGER IF EXISTS bulk_request_location_update")
+    op.execute("DROP TRIGGER IF EXISTS bulk_request_location_insert")
+    op.execute("DROP TABLE IF EXISTS bulk_request_location")
+    for table_name in ('bulk_request_archive', 'bulk_request'):
+        op.drop_column(table_name, 'delivery_lon')
+        op.drop_column(table_name, 'delivery_lat')
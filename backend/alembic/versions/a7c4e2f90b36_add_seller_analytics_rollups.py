@@ -0,0 +1,142 @@
+"""Add seller analytics rollup tables and the triggers maintaining them
+
+Revision ID: a7c4e2f90b36
+Revises: 5e0d8c3b9a17
+Create Date: 2026-10-19 15:21:48.630127+00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a7c4e2f90b36'
+down_revision: Union[str, None] = '5e0d8c3b9a17'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+PRICE_BUCKET_WIDTH = 5
+
+
+def add_product(row, sign):
+    return f"""
+        INSERT INTO seller_product_rollup
+            (seller_id, period, category_id, is_active, price_bucket, product_count)
+        SELECT {row}.product_owner_id,
+               date(coalesce({row}.created_at, '1970-01-01')),
+               coalesce({row}.category_id, 0),
+               {row}.is_active,
+               CAST({row}.price / {PRICE_BUCKET_WIDTH} AS INTEGER),
+               {sign}
+        WHERE {row}.product_owner_id IS NOT NULL
+        ON CONFLICT (seller_id, period, category_id, is_active, price_bucket)
+        DO UPDATE SET product_count = product_count + excluded.product_count;
+    """
+
+
+def add_pledge(row, sign):
+    return f"""
+        INSERT INTO seller_pledge_rollup
+            (seller_id, period, status, pledge_count, quantity, amount)
+        VALUES ({row}.farmer_id,
+                date({row}.created_at),
+                {row}.status,
+                {sign},
+                {sign} * {row}.quantity_pledged,
+                {sign} * {row}.quantity_pledged * {row}.price_per_unit)
+        ON CONFLICT (seller_id, period, status)
+        DO UPDATE SET pledge_count = pledge_count + excluded.pledge_count,
+                      quantity = quantity + excluded.quantity,
+                      amount = amount + excluded.amount;
+    """
+
+
+PRODUCT_COLUMNS = "product_owner_id, created_at, category_id, is_active, price"
+PLEDGE_COLUMNS = "farmer_id, created_at, status, quantity_pledged, price_per_unit"
+TRIGGERS = [
+    ('product', add_product, PRODUCT_COLUMNS),
+    ('product_archive', add_product, PRODUCT_COLUMNS),
+    ('bulk_request_pledge', add_pledge, PLEDGE_COLUMNS),
+    ('bulk_request_pledge_archive', add_pledge, PLEDGE_COLUMNS),
+]
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('seller_product_rollup',
+    sa.Column('seller_id', sa.Integer(), autoincrement=False, nullable=False),
+    sa.Column('period', sa.String(length=10), nullable=False),
+    sa.Column('category_id', sa.Integer(), autoincrement=False, nullable=False),
+    sa.Column('is_active', sa.Boolean(), nullable=False),
+    sa.Column('price_bucket', sa.Integer(), autoincrement=False, nullable=False),
+    sa.Column('product_count', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('seller_id', 'period', 'category_id', 'is_active', 'price_bucket')
+    )
+    op.create_table('seller_pledge_rollup',
+    sa.Column('seller_id', sa.Integer(), autoincrement=False, nullable=False),
+    sa.Column('period', sa.String(length=10), nullable=False),
+    sa.Column('status', sa.String(length=20), nullable=False),
+    sa.Column('pledge_count', sa.Integer(), nullable=False),
+    sa.Column('quantity', sa.Float(), nullable=False),
+    sa.Column('amount', sa.Float(), nullable=False),
+    sa.PrimaryKeyConstraint('seller_id', 'period', 'status')
+    )
+
+    # Existing rows, live and archived, in one pass; the triggers take over
+    # from here within the same transaction
+    op.execute(f"""
+        INSERT INTO seller_product_rollup
+            (seller_id, period, category_id, is_active, price_bucket, product_count)
+        SELECT product_owner_id, date(coalesce(created_at, '1970-01-01')),
+               coalesce(category_id, 0), is_active,
+               CAST(price / {PRICE_BUCKET_WIDTH} AS INTEGER), count(*)
+        FROM (
+            SELECT product_owner_id, created_at, category_id, is_active, price FROM product
+            UNION ALL
+            SELECT product_owner_id, created_at, category_id, is_active, price FROM product_archive
+        )
+        WHERE product_owner_id IS NOT NULL
+        GROUP BY 1, 2, 3, 4, 5
+    """)
+    op.execute("""
+        INSERT INTO seller_pledge_rollup
+            (seller_id, period, status, pledge_count, quantity, amount)
+        SELECT farmer_id, date(created_at), status, count(*),
+               sum(quantity_pledged), sum(quantity_pledged * price_per_unit)
+        FROM (
+            SELECT farmer_id, created_at, status, quantity_pledged, price_per_unit
+            FROM bulk_request_pledge
+            UNION ALL
+            SELECT farmer_id, created_at, status, quantity_pledged, price_per_unit
+            FROM bulk_request_pledge_archive
+        )
+        GROUP BY 1, 2, 3
+    """)
+
+    for table_name, add, columns in TRIGGERS:
+        op.execute(f"""
+            CREATE TRIGGER {table_name}_rollup_insert
+            AFTER INSERT ON {table_name}
+            BEGIN {add("new", 1)} END
+        """)
+        op.execute(f"""
+            CREATE TRIGGER {table_name}_rollup_update
+            AFTER UPDATE OF {columns} ON {table_name}
+            BEGIN {add("old", -1)} {add("new", 1)} END
+        """)
+        op.execute(f"""
+            CREATE TRIGGER {table_name}_rollup_delete
+            AFTER DELETE ON {table_name}
+            BEGIN {add("old", -1)} END
+        """)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    for table_name, _, _ in TRIGGERS:
+        for event in ('insert', 'update', 'delete'):
+            op.execute(f"DROP TRIGGER IF EXISTS {table_name}_rollup_{event}")
+    op.drop_table('seller_pledge_rollup')
+    op.drop_table('seller_product_rollup')
@@ -0,0 +1,54 @@
+"""Unique product names per owner and bulk request titles per buyer
+
+Revision ID: c2d9f4a61e83
+Revises: a7c4e2f90b36
+Create Date: 2026-10-19 14:20:08.316402+00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c2d9f4a61e83'
+down_revision: Union[str, None] = 'a7c4e2f90b36'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# (index, table, owner column, name column)
+UNIQUE_NAMES = [
+    ('uq_product_owner_name', 'product', 'product_owner_id', 'name'),
+    ('uq_bulk_request_buyer_title', 'bulk_request', 'buyer_id', 'title'),
+]
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    connection = op.get_bind()
+    for index_name, table_name, owner, name in UNIQUE_NAMES:
+        # Earlier check-then-insert races left duplicates behind. The oldest
+        # row keeps its name; the others get their id appended, so no row or
+        # pledge is lost and the owner can tell them apart.
+        renamed = connection.execute(sa.text(
+            f"""
+            UPDATE {table_name}
+            SET {name} = {name} || ' (' || id || ')'
+            WHERE {owner} IS NOT NULL
+              AND id NOT IN (
+                  SELECT min(id) FROM {table_name}
+                  WHERE {owner} IS NOT NULL
+                  GROUP BY {owner}, {name}
+              )
+            """
+        )).rowcount
+        if renamed:
+            print(f"Renamed {renamed} duplicate {table_name} rows.")
+        op.create_index(index_name, table_name, [owner, name], unique=True)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    for index_name, table_name, _, _ in reversed(UNIQUE_NAMES):
+        op.drop_index(index_name, table_name=table_name)
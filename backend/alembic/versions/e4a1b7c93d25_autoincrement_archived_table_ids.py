@@ -0,0 +1,78 @@
+"""Never reuse ids of archived products, bulk requests and pledges
+
+Revision ID: e4a1b7c93d25
+Revises: c2d9f4a61e83
+Create Date: 2026-10-19 18:42:10.527316+00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e4a1b7c93d25'
+down_revision: Union[str, None] = 'c2d9f4a61e83'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# (live table, archive table keeping its ids)
+ARCHIVED_TABLES = [
+    ('product', 'product_archive'),
+    ('bulk_request', 'bulk_request_archive'),
+    ('bulk_request_pledge', 'bulk_request_pledge_archive'),
+]
+
+
+def rebuild(table_name: str, autoincrement: bool) -> None:
+    """
+    SQLite cannot add AUTOINCREMENT to an existing table, so the table is
+    rebuilt. Its indexes are carried over by batch mode; its triggers (R*Tree
+    and seller rollups) are dropped with the old table and created again.
+    """
+    connection = op.get_bind()
+    triggers = connection.execute(
+        sa.text(
+            "SELECT sql FROM sqlite_master WHERE type = 'trigger' AND tbl_name = :name"
+        ),
+        {'name': table_name},
+    ).scalars().all()
+    with op.batch_alter_table(
+        table_name,
+        recreate='always',
+        table_kwargs={'sqlite_autoincrement': autoincrement},
+    ):
+        pass
+    for statement in triggers:
+        op.execute(statement)
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    connection = op.get_bind()
+    for table_name, archive_name in ARCHIVED_TABLES:
+        rebuild(table_name, autoincrement=True)
+        # Start the sequence above every id in use or archived
+        connection.execute(
+            sa.text("DELETE FROM sqlite_sequence WHERE name = :name"),
+            {'name': table_name},
+        )
+        connection.execute(
+            sa.text(
+                f"""
+                INSERT INTO sqlite_sequence (name, seq)
+                SELECT :name, max(
+                    (SELECT coalesce(max(id), 0) FROM {table_name}),
+                    (SELECT coalesce(max(id), 0) FROM {archive_name})
+                )
+                """
+            ),
+            {'name': table_name},
+        )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    for table_name, _ in reversed(ARCHIVED_TABLES):
+        rebuild(table_name, autoincrement=False)
@@ -0,0 +1,42 @@
+"""Keep Idempotency-Key values shared by all workers
+
+Revision ID: f7b3c5d18a42
+Revises: e4a1b7c93d25
+Create Date: 2026-10-19 21:05:37.183264+00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f7b3c5d18a42'
+down_revision: Union[str, None] = 'e4a1b7c93d25'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        'idempotency_key',
+        sa.Column('scope', sa.String(length=100), nullable=False),
+        sa.Column('key', sa.String(length=255), nullable=False),
+        sa.Column('fingerprint', sa.String(length=64), nullable=False),
+        sa.Column('status_code', sa.Integer(), nullable=True),
+        sa.Column('media_type', sa.String(length=100), nullable=True),
+        sa.Column('body', sa.LargeBinary(), nullable=True),
+        sa.Column('created_at', sa.DateTime(timezone=True), nullable=False),
+        sa.PrimaryKeyConstraint('scope', 'key'),
+    )
+    op.create_index(
+        op.f('ix_idempotency_key_created_at'), 'idempotency_key', ['created_at'], unique=False
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f('ix_idempotency_key_created_at'), table_name='idempotency_key')
+    op.drop_table('idempotency_key')
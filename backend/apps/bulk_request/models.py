@@ -1,6 +1,7 @@
 from typing import TYPE_CHECKING
 from datetime import datetime, timezone
 from sqlalchemy import String, Integer, Float, Boolean, ForeignKey, Text, DateTime, Enum
+from sqlalchemy import DDL, Index, column, event, table
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 from typing import Optional, List
 import enum
@@ -29,6 +30,12 @@ class PledgeStatus(enum.Enum):
 
 class BulkRequest(BaseDatabaseModel):
     __tablename__ = "bulk_request"
+    __table_args__ = (
+        # One live bulk request per title and buyer; creates insert against it
+        Index("uq_bulk_request_buyer_title", "buyer_id", "title", unique=True),
+        # Ids of archived bulk requests are never handed out again
+        {"sqlite_autoincrement": True},
+    )
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
     title: Mapped[str] = mapped_column(String(255), nullable=False)
@@ -47,6 +54,9 @@ class BulkRequest(BaseDatabaseModel):
         DateTime(timezone=True), nullable=False
     )
     delivery_location: Mapped[str] = mapped_column(String(500), nullable=False)
+    # Geocoded from delivery_location, NULL when the place is not known
+    delivery_lat: Mapped[Optional[float]] = mapped_column(Float, nullable=True)
+    delivery_lon: Mapped[Optional[float]] = mapped_column(Float, nullable=True)
     delivery_instructions: Mapped[Optional[str]] = mapped_column(Text, nullable=True)
     status: Mapped[BulkRequestStatus] = mapped_column(
         Enum(BulkRequestStatus), default=BulkRequestStatus.OPEN, nullable=False
@@ -83,8 +93,67 @@ class BulkRequest(BaseDatabaseModel):
         return self.quantity_pledged >= self.quantity_needed
 
 
+# SQLite R*Tree over the delivery coordinates of live bulk requests, kept in
+# sync by triggers. Radius searches probe it with a bounding box.
+bulk_request_location = table(
+    "bulk_request_location",
+    column("id"),
+    column("min_lat"),
+    column("max_lat"),
+    column("min_lon"),
+    column("max_lon"),
+)
+
+BULK_REQUEST_LOCATION_DDL = [
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS bulk_request_location
+    USING rtree(id, min_lat, max_lat, min_lon, max_lon)
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS bulk_request_location_insert
+    AFTER INSERT ON bulk_request
+    WHEN new.delivery_lat IS NOT NULL AND new.delivery_lon IS NOT NULL
+    BEGIN
+        INSERT INTO bulk_request_location
+        VALUES (new.id, new.delivery_lat, new.delivery_lat, new.delivery_lon, new.delivery_lon);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS bulk_request_location_update
+    AFTER UPDATE OF delivery_lat, delivery_lon ON bulk_request
+    BEGIN
+        DELETE FROM bulk_request_location WHERE id = old.id;
+        INSERT INTO bulk_request_location
+        SELECT new.id, new.delivery_lat, new.delivery_lat, new.delivery_lon, new.delivery_lon
+        WHERE new.delivery_lat IS NOT NULL AND new.delivery_lon IS NOT NULL;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS bulk_request_location_delete
+    AFTER DELETE ON bulk_request
+    BEGIN
+        DELETE FROM bulk_request_location WHERE id = old.id;
+    END
+    """,
+]
+
+for _statement in BULK_REQUEST_LOCATION_DDL:
+    event.listen(
+        BulkRequest.__table__,
+        "after_create",
+        DDL(_statement).execute_if(dialect="sqlite"),
+    )
+event.listen(
+    BulkRequest.__table__,
+    "after_drop",
+    DDL("DROP TABLE IF EXISTS bulk_request_location").execute_if(dialect="sqlite"),
+)
+
+
 class BulkRequestPledge(BaseDatabaseModel):
     __tablename__ = "bulk_request_pledge"
+    # Ids of archived pledges are never handed out again
+    __table_args__ = {"sqlite_autoincrement": True}
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
     quantity_pledged: Mapped[float] = mapped_column(Float, nullable=False)
@@ -120,3 +189,67 @@ class BulkRequestPledge(BaseDatabaseModel):
     def total_amount(self) -> float:
         """Calculate total amount for this pledge"""
         return self.quantity_pledged * self.price_per_unit
+
+
+class BulkRequestArchive(BaseDatabaseModel):
+    """
+    Cold storage for closed, expired and fully filled bulk requests, moved
+    out of `bulk_request` by the archiver. Rows keep their bulk request id.
+    """
+
+    __tablename__ = "bulk_request_archive"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=False)
+    title: Mapped[str] = mapped_column(String(255), nullable=False)
+    description: Mapped[Optional[str]] = mapped_column(Text, nullable=True)
+    product_name: Mapped[str] = mapped_column(String(255), nullable=False)
+    category_id: Mapped[Optional[int]] = mapped_column(Integer, nullable=True)
+    quantity_needed: Mapped[float] = mapped_column(Float, nullable=False)
+    unit: Mapped[str] = mapped_column(String(50), nullable=False)
+    max_price_per_unit: Mapped[Optional[float]] = mapped_column(Float, nullable=True)
+    total_budget: Mapped[Optional[float]] = mapped_column(Float, nullable=True)
+    delivery_deadline: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True), nullable=False
+    )
+    delivery_location: Mapped[str] = mapped_column(String(500), nullable=False)
+    delivery_lat: Mapped[Optional[float]] = mapped_column(Float, nullable=True)
+    delivery_lon: Mapped[Optional[float]] = mapped_column(Float, nullable=True)
+    delivery_instructions: Mapped[Optional[str]] = mapped_column(Text, nullable=True)
+    status: Mapped[BulkRequestStatus] = mapped_column(
+        Enum(BulkRequestStatus), nullable=False
+    )
+    quantity_pledged: Mapped[float] = mapped_column(Float, nullable=False)
+    buyer_id: Mapped[int] = mapped_column(Integer, nullable=False, index=True)
+    created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=False)
+    updated_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=False)
+    archived_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True), nullable=False
+    )
+
+
+class BulkRequestPledgeArchive(BaseDatabaseModel):
+    """
+    Pledges of archived bulk requests. Pledge ids are kept in `id`; the
+    archive has its own key because SQLite may hand a freed pledge id out again.
+    """
+
+    __tablename__ = "bulk_request_pledge_archive"
+
+    archive_id: Mapped[int] = mapped_column(
+        Integer, primary_key=True, autoincrement=True
+    )
+    id: Mapped[int] = mapped_column(Integer, nullable=False)
+    quantity_pledged: Mapped[float] = mapped_column(Float, nullable=False)
+    price_per_unit: Mapped[float] = mapped_column(Float, nullable=False)
+    estimated_delivery_date: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True), nullable=False
+    )
+    delivery_notes: Mapped[Optional[str]] = mapped_column(Text, nullable=True)
+    status: Mapped[PledgeStatus] = mapped_column(Enum(PledgeStatus), nullable=False)
+    bulk_request_id: Mapped[int] = mapped_column(Integer, nullable=False, index=True)
+    farmer_id: Mapped[int] = mapped_column(Integer, nullable=False)
+    created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=False)
+    updated_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=False)
+    archived_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True), nullable=False
+    )
@@ -1,22 +1,28 @@
-from fastapi import APIRouter, Request, HTTPException, Depends
+from typing import Optional
+from fastapi import APIRouter, Request, HTTPException, Depends, Header
 from apps.bulk_request.schemas import (
     BulkRequestCreate,
     BulkRequestListQueryParams,
 )
 from apps.user.models import UserTypeEnum
 from apps.common.database import get_db
+from apps.common.replicas import get_read_db
 from apps.bulk_request.views import (
     get_bulk_requests_view,
     create_bulk_request_view,
+    restore_bulk_request_view,
 )
 from apps.common.custom_response import CustomJSONResponse
 from apps.common.auth import is_authenticated
+from apps.common.idempotency import IDEMPOTENCY_KEY_MAX_LENGTH, idempotent
+from apps.common.profiling import ProfiledRoute
 
 
 router = APIRouter(
     prefix="/bulk-request",
     tags=["bulk-request"],
     responses={404: {"description": "Not found"}},
+    route_class=ProfiledRoute,
 )
 
 
@@ -24,7 +30,7 @@ router = APIRouter(
 def get_bulk_requests_route(
     request: Request,
     query_params: BulkRequestListQueryParams = Depends(),
-    db=Depends(get_db),
+    db=Depends(get_read_db),
     is_authenticated=Depends(is_authenticated),
 ) -> CustomJSONResponse:
     """
@@ -49,10 +55,14 @@ def create_bulk_request_route(
     bulk_request: BulkRequestCreate,
     db=Depends(get_db),
     is_authenticated=Depends(is_authenticated),
+    idempotency_key: Optional[str] = Header(
+        None, alias="Idempotency-Key", max_length=IDEMPOTENCY_KEY_MAX_LENGTH
+    ),
 ) -> CustomJSONResponse:
     """
     Create a new bulk request.
     Only business users can create bulk requests.
+    A retry with the same Idempotency-Key returns the original response.
     """
     try:
         print("IN CREATE BULK REQUEST ROUTE")
@@ -65,8 +75,33 @@ def create_bulk_request_route(
                 status_code=403,
                 detail="Only business users can create bulk requests",
             )
-        return create_bulk_request_view(bulk_request, db, user_id)
+        return idempotent(
+            ("bulk_request", user_id),
+            idempotency_key,
+            bulk_request.model_dump_json().encode(),
+            lambda: create_bulk_request_view(bulk_request, db, user_id),
+            db_session=db,
+        )
 
     except Exception as e:
         print(f"Error in create_bulk_request_route: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.post("/{bulk_request_id}/restore")
+def restore_bulk_request_route(
+    request: Request,
+    bulk_request_id: int,
+    db=Depends(get_db),
+    is_authenticated=Depends(is_authenticated),
+) -> CustomJSONResponse:
+    """
+    Restore an archived bulk request of the authenticated buyer.
+    """
+    try:
+        user_id = request.state.user_id
+        return restore_bulk_request_view(bulk_request_id, db, user_id)
+
+    except Exception as e:
+        print(f"Error in restore_bulk_request_route: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
@@ -0,0 +1,30 @@
+from datetime import datetime
+from typing import NamedTuple, Optional
+
+from apps.bulk_request.models import BulkRequestStatus
+
+
+class BulkRequestRow(NamedTuple):
+    """
+    A bulk request as listed by the API, read straight from a Core result row.
+    """
+
+    id: int
+    title: str
+    description: Optional[str]
+    product_name: str
+    category_id: Optional[int]
+    quantity_needed: float
+    unit: str
+    max_price_per_unit: Optional[float]
+    total_budget: Optional[float]
+    delivery_deadline: datetime
+    delivery_location: str
+    delivery_lat: Optional[float]
+    delivery_lon: Optional[float]
+    delivery_instructions: Optional[str]
+    status: BulkRequestStatus
+    quantity_pledged: float
+    buyer_id: int
+    created_at: datetime
+    updated_at: datetime
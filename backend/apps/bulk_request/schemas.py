@@ -1,13 +1,23 @@
-from typing import Annotated, Optional, Literal
+from typing import Annotated, Optional, Literal, Tuple
 from pydantic import BaseModel, conint, Field
 from datetime import datetime
 from apps.bulk_request.models import BulkRequestStatus
+from apps.common.fieldsets import parse_fieldset
+from apps.bulk_request.rows import BulkRequestRow
+from config import BULK_REQUEST_MAX_RADIUS_KM
+
+# Fields of a serialized bulk request, as accepted by `fields=`
+BULK_REQUEST_FIELDS = BulkRequestRow._fields
 
 
 class BulkRequestListQueryParams(BaseModel):
     page: Annotated[int, conint(gt=0)] = 1
     limit: Annotated[int, conint(gt=0)] = 10
     search: str | None = None
+    search_mode: Literal["substring", "fuzzy"] = Field(
+        "substring",
+        description="fuzzy matches misspelled product names and titles by trigram similarity",
+    )
     category_id: Optional[int] = None
     status: Optional[BulkRequestStatus] = None
     min_quantity: Optional[float] = None
@@ -15,9 +25,75 @@ class BulkRequestListQueryParams(BaseModel):
     min_price: Optional[float] = None
     max_price: Optional[float] = None
     sort_by: Optional[
-        Literal["title", "quantity_needed", "delivery_deadline", "created_at"]
-    ] = "created_at"
-    sort_order: Optional[Literal["asc", "desc"]] = "desc"
+        Literal[
+            "title",
+            "quantity_needed",
+            "delivery_deadline",
+            "created_at",
+            "distance",
+            "relevance",
+        ]
+    ] = Field(
+        None,
+        description="Defaults to created_at, distance for radius searches or relevance for fuzzy searches",
+    )
+    sort_order: Optional[Literal["asc", "desc"]] = Field(
+        None, description="Defaults to desc, or asc when sorting by distance or relevance"
+    )
+    fields: Optional[str] = Field(
+        None,
+        description="Comma-separated bulk request fields to return, e.g. title,status",
+    )
+    include_archived: bool = Field(
+        False, description="Also list archived (finished) bulk requests"
+    )
+    near_lat: Optional[float] = Field(None, ge=-90, le=90)
+    near_lon: Optional[float] = Field(None, ge=-180, le=180)
+    radius_km: Optional[float] = Field(
+        None,
+        gt=0,
+        le=BULK_REQUEST_MAX_RADIUS_KM,
+        description="Only bulk requests delivered within this distance of near_lat/near_lon",
+    )
+
+    def field_list(self) -> Optional[tuple]:
+        """
+        The requested fieldset, or None for every field. Raises ValueError for
+        unknown field names.
+        """
+        return parse_fieldset(self.fields, BULK_REQUEST_FIELDS)
+
+    def near(self) -> Optional[Tuple[float, float, float]]:
+        """
+        (near_lat, near_lon, radius_km), or None without a radius search.
+        Raises ValueError unless all three are given together.
+        """
+        values = (self.near_lat, self.near_lon, self.radius_km)
+        if all(value is None for value in values):
+            return None
+        if any(value is None for value in values):
+            raise ValueError("near_lat, near_lon and radius_km must be given together")
+        return values
+
+    def fuzzy(self) -> bool:
+        return self.search_mode == "fuzzy" and bool(self.search)
+
+    def sorting(self) -> Tuple[str, str]:
+        """
+        The (sort_by, sort_order) to list with. Radius searches default to
+        nearest first, fuzzy searches to best match first.
+        """
+        if self.radius_km is not None:
+            default = "distance"
+        elif self.fuzzy():
+            default = "relevance"
+        else:
+            default = "created_at"
+        sort_by = self.sort_by or default
+        sort_order = self.sort_order or (
+            "asc" if sort_by in ("distance", "relevance") else "desc"
+        )
+        return sort_by, sort_order
 
 
 class BulkRequestCreate(BaseModel):
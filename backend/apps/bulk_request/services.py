@@ -1,9 +1,215 @@
-from typing import Union, Optional
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+from typing import Union, Optional, Sequence, Tuple
 from fastapi import HTTPException
-from sqlalchemy import select, func, or_, asc, desc
+from sqlalchemy import (
+    String,
+    select,
+    func,
+    or_,
+    and_,
+    asc,
+    desc,
+    bindparam,
+    cast,
+    union_all,
+    update,
+)
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
-from apps.bulk_request.models import BulkRequest, BulkRequestPledge, BulkRequestStatus
+from apps.common.archive import archive_in_batches, archive_scheduler, move_rows
+from apps.common.geo import bounding_box, geocode
+from apps.common.metrics import register_metrics
+from apps.common.replicas import record_write
+from apps.common.statements import FilterSet, id_list, in_id_list
+from apps.common.writer import execute_write
+from apps.search.services import fuzzy_search, index_bulk_request
+from apps.bulk_request.models import (
+    BulkRequest,
+    BulkRequestArchive,
+    BulkRequestPledge,
+    BulkRequestPledgeArchive,
+    BulkRequestStatus,
+    bulk_request_location,
+)
+from apps.bulk_request.rows import BulkRequestRow
 from apps.bulk_request.schemas import BulkRequestCreate
+from config import ARCHIVE_BATCH_SIZE, BULK_REQUEST_ARCHIVE_AFTER_DAYS
+
+
+def _distance_to_near(columns):
+    return func.distance_km(
+        columns.delivery_lat,
+        columns.delivery_lon,
+        bindparam("near_lat"),
+        bindparam("near_lon"),
+    )
+
+
+def _near_filter(columns, location_index=None):
+    """
+    Bulk requests within radius_km of (near_lat, near_lon): a bounding box
+    probe, through the R*Tree when `location_index` is given, then the exact
+    distance for the rows inside the box.
+    """
+    if location_index is not None:
+        in_box = columns.id.in_(
+            select(location_index.c.id).where(
+                location_index.c.max_lat >= bindparam("near_min_lat"),
+                location_index.c.min_lat <= bindparam("near_max_lat"),
+                location_index.c.max_lon >= bindparam("near_min_lon"),
+                location_index.c.min_lon <= bindparam("near_max_lon"),
+            )
+        )
+    else:
+        in_box = and_(
+            columns.delivery_lat.between(
+                bindparam("near_min_lat"), bindparam("near_max_lat")
+            ),
+            columns.delivery_lon.between(
+                bindparam("near_min_lon"), bindparam("near_max_lon")
+            ),
+        )
+    return and_(in_box, _distance_to_near(columns) <= bindparam("radius_km"))
+
+
+def _near_params(near: Optional[Tuple[float, float, float]]) -> Optional[dict]:
+    if near is None:
+        return None
+    lat, lon, radius_km = near
+    min_lat, max_lat, min_lon, max_lon = bounding_box(lat, lon, radius_km)
+    return {
+        "near_lat": lat,
+        "near_lon": lon,
+        "radius_km": radius_km,
+        "near_min_lat": min_lat,
+        "near_max_lat": max_lat,
+        "near_min_lon": min_lon,
+        "near_max_lon": max_lon,
+    }
+
+
+def _fuzzy_params(bulk_request_ids: Optional[list]) -> Optional[dict]:
+    """
+    Bound parameters of the fuzzy filter: the matching ids (see id_list),
+    and the same ids as ",12,5," so relevance sorting can order by position
+    in the string.
+    """
+    if bulk_request_ids is None:
+        return None
+    return {
+        "fuzzy_ids": id_list(bulk_request_ids),
+        "fuzzy_rank": ","
+        + ",".join(str(bulk_request_id) for bulk_request_id in bulk_request_ids)
+        + ",",
+    }
+
+
+def _bulk_request_filter_set(columns, location_index=None) -> FilterSet:
+    """
+    The bulk request listing filters over `columns`, the bulk_request table
+    or the union of live and archived bulk requests. The R*Tree
+    `location_index` only covers live bulk requests.
+    """
+    return FilterSet(
+        [
+            (
+                "search",
+                or_(
+                    func.lower(columns.title).like(bindparam("search")),
+                    func.lower(columns.description).like(bindparam("search")),
+                    func.lower(columns.product_name).like(bindparam("search")),
+                ),
+            ),
+            ("fuzzy", in_id_list(columns.id, "fuzzy_ids")),
+            ("buyer_id", columns.buyer_id == bindparam("buyer_id")),
+            ("category_id", columns.category_id == bindparam("category_id")),
+            ("status", columns.status == bindparam("status")),
+            ("min_quantity", columns.quantity_needed >= bindparam("min_quantity")),
+            ("max_quantity", columns.quantity_needed <= bindparam("max_quantity")),
+            ("min_price", columns.max_price_per_unit >= bindparam("min_price")),
+            ("max_price", columns.max_price_per_unit <= bindparam("max_price")),
+            ("near", _near_filter(columns, location_index)),
+        ]
+    )
+
+
+bulk_request_table = BulkRequest.__table__
+bulk_request_archive_table = BulkRequestArchive.__table__
+pledge_table = BulkRequestPledge.__table__
+pledge_archive_table = BulkRequestPledgeArchive.__table__
+bulk_request_filters = _bulk_request_filter_set(
+    bulk_request_table.c, bulk_request_location
+)
+
+# Live and archived bulk requests, for listings with include_archived
+bulk_requests_with_archive = union_all(
+    select(*bulk_request_table.c),
+    select(
+        *[bulk_request_archive_table.c[column.name] for column in bulk_request_table.c]
+    ),
+).subquery("bulk_request_with_archive")
+bulk_requests_with_archive_filters = _bulk_request_filter_set(
+    bulk_requests_with_archive.c
+)
+
+BULK_REQUEST_SORT_COLUMNS = ("title", "quantity_needed", "delivery_deadline", "created_at")
+# Only with a near= filter
+DISTANCE_SORT = "distance"
+# Only with a fuzzy search
+RELEVANCE_SORT = "relevance"
+
+# Bulk requests in these states no longer change and are archived
+FINISHED_BULK_REQUEST_STATUSES = (
+    BulkRequestStatus.CLOSED,
+    BulkRequestStatus.EXPIRED,
+    BulkRequestStatus.FULLY_FILLED,
+)
+
+
+@lru_cache(maxsize=512)
+def _bulk_request_listing_statements(
+    shape: int,
+    sort_by: str,
+    sort_order: str,
+    fields: Optional[Tuple[str, ...]],
+    include_archived: bool = False,
+):
+    """
+    Build the count and page statements for one filter shape, sort and
+    fieldset. Cached, so only the bound parameters change between calls.
+    With `include_archived` they read the union of live and archived requests.
+    """
+    if include_archived:
+        source, filters = bulk_requests_with_archive, bulk_requests_with_archive_filters
+    else:
+        source, filters = bulk_request_table, bulk_request_filters
+    columns = [source.c[field] for field in fields or BulkRequestRow._fields]
+    stmt = filters.apply(select(*columns), shape)
+
+    if sort_by == DISTANCE_SORT:
+        sort_column = _distance_to_near(source.c)
+    elif sort_by == RELEVANCE_SORT:
+        # Fuzzy matches come best first in fuzzy_rank
+        sort_column = func.instr(
+            bindparam("fuzzy_rank"), "," + cast(source.c.id, String) + ","
+        )
+    else:
+        sort_column = source.c[sort_by]
+    order = desc(sort_column) if sort_order == "desc" else asc(sort_column)
+    page_stmt = (
+        stmt.order_by(order).offset(bindparam("offset")).limit(bindparam("limit"))
+    )
+
+    count_stmt = filters.apply(select(func.count()).select_from(source), shape)
+    return count_stmt, page_stmt
+
+
+register_metrics(
+    "bulk_request_listing_statements",
+    lambda: _bulk_request_listing_statements.cache_info()._asdict(),
+)
 
 
 def get_all_bulk_requests(
@@ -11,6 +217,7 @@ def get_all_bulk_requests(
     page: int = 1,
     limit: int = 10,
     search: Union[str, None] = None,
+    search_mode: str = "substring",
     category_id: Optional[int] = None,
     status: Optional[str] = None,
     min_quantity: Optional[float] = None,
@@ -20,66 +227,75 @@ def get_all_bulk_requests(
     sort_by: Optional[str] = "created_at",
     sort_order: Optional[str] = "desc",
     buyer_id: Optional[int] = None,
+    fields: Optional[Sequence[str]] = None,
+    include_archived: bool = False,
+    near: Optional[Tuple[float, float, float]] = None,
 ) -> dict:
     """
     Fetch bulk requests from the database with pagination, filtering, and sorting.
+    Bulk requests are returned as BulkRequestRow tuples read from Core rows,
+    without building ORM entities. With `fields`, only those columns are
+    selected and row mappings are returned instead. Archived bulk requests are
+    only listed with `include_archived`. `near` is (lat, lon, radius_km) and
+    keeps the bulk requests delivered within that radius; sort_by="distance"
+    orders them by distance. With search_mode="fuzzy" the search matches
+    product names and titles by trigram similarity, and sort_by="relevance"
+    lists the closest matches first.
     """
     try:
-        offset = (page - 1) * limit
-        stmt = select(BulkRequest)
-
-        # Apply filters
-        if search:
-            search_pattern = f"%{search.lower()}%"
-            stmt = stmt.where(
-                or_(
-                    func.lower(BulkRequest.title).like(search_pattern),
-                    func.lower(BulkRequest.description).like(search_pattern),
-                    func.lower(BulkRequest.product_name).like(search_pattern),
-                )
-            )
-
-        if buyer_id is not None:
-            stmt = stmt.where(BulkRequest.buyer_id == buyer_id)
-
-        if category_id is not None:
-            stmt = stmt.where(BulkRequest.category_id == category_id)
         print("*" * 80)
         print(f"Status: {status}")
         print("*" * 80)
-        if status is not None:
-            stmt = stmt.where(BulkRequest.status == status)
-
-        if min_quantity is not None:
-            stmt = stmt.where(BulkRequest.quantity_needed >= min_quantity)
-
-        if max_quantity is not None:
-            stmt = stmt.where(BulkRequest.quantity_needed <= max_quantity)
-
-        if min_price is not None:
-            stmt = stmt.where(BulkRequest.max_price_per_unit >= min_price)
-
-        if max_price is not None:
-            stmt = stmt.where(BulkRequest.max_price_per_unit <= max_price)
-
-        # Apply sorting
-        sort_column = getattr(BulkRequest, sort_by, BulkRequest.created_at)
-        if sort_order == "desc":
-            stmt = stmt.order_by(desc(sort_column))
-        else:
-            stmt = stmt.order_by(asc(sort_column))
+        fuzzy_ids = None
+        if search and search_mode == "fuzzy":
+            # Candidates come from the trigram index instead of a LIKE scan
+            fuzzy_ids = [
+                bulk_request_id
+                for bulk_request_id, _ in fuzzy_search(db_session, "bulk_request", search)
+            ]
+            search = None
+        shape, params = bulk_request_filters.shape(
+            {
+                "search": f"%{search.lower()}%" if search else None,
+                "fuzzy": _fuzzy_params(fuzzy_ids),
+                "buyer_id": buyer_id,
+                "category_id": category_id,
+                "status": status,
+                "min_quantity": min_quantity,
+                "max_quantity": max_quantity,
+                "min_price": min_price,
+                "max_price": max_price,
+                "near": _near_params(near),
+            }
+        )
+        if (sort_by == DISTANCE_SORT and near is None) or (
+            sort_by == RELEVANCE_SORT and fuzzy_ids is None
+        ):
+            sort_by = "created_at"
+        count_stmt, page_stmt = _bulk_request_listing_statements(
+            shape,
+            sort_by
+            if sort_by in BULK_REQUEST_SORT_COLUMNS
+            or sort_by in (DISTANCE_SORT, RELEVANCE_SORT)
+            else "created_at",
+            "desc" if sort_order == "desc" else "asc",
+            tuple(fields) if fields else None,
+            include_archived,
+        )
 
         # Get total count for pagination
-        count_stmt = select(func.count()).select_from(stmt.subquery())
-        total_count = db_session.execute(count_stmt).scalar()
+        total_count = db_session.execute(count_stmt, params).scalar()
         total_count = total_count or 0  # If it's None, set it to 0
 
         # Apply pagination
-        stmt = stmt.offset(offset).limit(limit)
+        params = {**params, "offset": (page - 1) * limit, "limit": limit}
 
         # Execute query
-        result = db_session.execute(stmt)
-        bulk_requests = result.scalars().all()
+        result = db_session.execute(page_stmt, params)
+        if fields:
+            bulk_requests = result.mappings().all()
+        else:
+            bulk_requests = [BulkRequestRow._make(row) for row in result]
 
         return {
             "success": True,
@@ -102,51 +318,134 @@ def create_bulk_request(
     db_session: Session, bulk_request_data: BulkRequestCreate, buyer_id: int
 ):
     """
-    Create a new bulk request.
+    Create a new bulk request with a single INSERT ... ON CONFLICT DO NOTHING
+    RETURNING statement. Fails cleanly if the buyer already has a bulk
+    request with the same title (uq_bulk_request_buyer_title).
     """
-    try:
-        bulk_request = BulkRequest(
-            title=bulk_request_data.title,
-            description=bulk_request_data.description,
-            product_name=bulk_request_data.product_name,
-            category_id=bulk_request_data.category_id,
-            quantity_needed=bulk_request_data.quantity_needed,
-            unit=bulk_request_data.unit,
-            max_price_per_unit=bulk_request_data.max_price_per_unit,
-            total_budget=bulk_request_data.total_budget,
-            delivery_deadline=bulk_request_data.delivery_deadline,
-            delivery_location=bulk_request_data.delivery_location,
-            delivery_instructions=bulk_request_data.delivery_instructions,
-            buyer_id=buyer_id,
-            status=BulkRequestStatus.OPEN,
-        )
+    point = geocode(bulk_request_data.delivery_location)
 
-        db_session.add(bulk_request)
-        db_session.commit()
-        db_session.refresh(bulk_request)
+    def insert_bulk_request(session: Session) -> Optional[BulkRequest]:
+        bulk_request = session.execute(
+            insert(BulkRequest)
+            .values(
+                title=bulk_request_data.title,
+                description=bulk_request_data.description,
+                product_name=bulk_request_data.product_name,
+                category_id=bulk_request_data.category_id,
+                quantity_needed=bulk_request_data.quantity_needed,
+                unit=bulk_request_data.unit,
+                max_price_per_unit=bulk_request_data.max_price_per_unit,
+                total_budget=bulk_request_data.total_budget,
+                delivery_deadline=bulk_request_data.delivery_deadline,
+                delivery_location=bulk_request_data.delivery_location,
+                delivery_lat=point[0] if point else None,
+                delivery_lon=point[1] if point else None,
+                delivery_instructions=bulk_request_data.delivery_instructions,
+                buyer_id=buyer_id,
+                status=BulkRequestStatus.OPEN,
+            )
+            .on_conflict_do_nothing(index_elements=["buyer_id", "title"])
+            .returning(BulkRequest)
+        ).scalar_one_or_none()
+        if bulk_request is not None:
+            # Detached, the RETURNING values stay loaded past the commit
+            session.expunge(bulk_request)
+        return bulk_request
+
+    try:
+        bulk_request = execute_write(db_session, insert_bulk_request)
+        if bulk_request is None:
+            return {
+                "success": False,
+                "error": "A bulk request with this title already exists for this user",
+            }
+        record_write(buyer_id)
+        index_bulk_request(bulk_request)
 
         return {"success": True, "bulk_request": bulk_request}
 
     except Exception as e:
-        db_session.rollback()
         raise HTTPException(
             status_code=500, detail=f"Error creating bulk request: {str(e)}"
         )
 
 
-def bulk_request_exists_for_user(db_session: Session, buyer_id: int, title: str):
+def archive_finished_bulk_requests(
+    db_session: Session,
+    older_than_days: float = BULK_REQUEST_ARCHIVE_AFTER_DAYS,
+    batch_size: int = ARCHIVE_BATCH_SIZE,
+) -> int:
+    """
+    Move closed, expired and fully filled bulk requests that have not changed
+    for `older_than_days`, with their pledges, into the archive tables.
+    Returns the number of bulk requests moved.
+    """
+    cutoff = datetime.now(timezone.utc) - timedelta(days=older_than_days)
+    condition = and_(
+        bulk_request_table.c.status.in_(FINISHED_BULK_REQUEST_STATUSES),
+        bulk_request_table.c.updated_at < cutoff,
+    )
+    moved = archive_in_batches(
+        db_session,
+        bulk_request_table,
+        bulk_request_archive_table,
+        condition,
+        batch_size,
+        children=[(pledge_table, pledge_archive_table, "bulk_request_id")],
+    )
+    if moved:
+        print(f"Archived {moved} finished bulk requests.")
+    return moved
+
+
+archive_scheduler.register(
+    "bulk_requests",
+    archive_finished_bulk_requests,
+    [bulk_request_table, bulk_request_archive_table, pledge_table, pledge_archive_table],
+)
+
+
+def restore_bulk_request(db_session: Session, bulk_request_id: int, buyer_id: int):
     """
-    Check if a bulk request with the same title exists for a user.
+    Move an archived bulk request and its pledges back into the live tables.
+    Returns None if the buyer has no archived bulk request with this id.
     """
     try:
-        stmt = select(BulkRequest).where(
-            BulkRequest.buyer_id == buyer_id, BulkRequest.title == title
-        )
-        result = db_session.execute(stmt)
-        bulk_request = result.scalar_one_or_none()
-        return bulk_request is not None
+        archived = db_session.execute(
+            select(bulk_request_archive_table.c.id).where(
+                bulk_request_archive_table.c.id == bulk_request_id,
+                bulk_request_archive_table.c.buyer_id == buyer_id,
+            )
+        ).first()
+        if archived is None:
+            return None
 
+        move_rows(
+            db_session,
+            bulk_request_archive_table,
+            bulk_request_table,
+            [bulk_request_id],
+            children=[(pledge_archive_table, pledge_table, "bulk_request_id")],
+        )
+        # A fresh updated_at keeps the archiver from taking it straight back
+        db_session.execute(
+            update(bulk_request_table)
+            .where(bulk_request_table.c.id == bulk_request_id)
+            .values(updated_at=datetime.now(timezone.utc))
+        )
+        db_session.commit()
+        record_write(buyer_id)
+        bulk_request = db_session.get(BulkRequest, bulk_request_id)
+        index_bulk_request(bulk_request)
+        return bulk_request
+    except IntegrityError:
+        db_session.rollback()
+        raise HTTPException(
+            status_code=409,
+            detail=f"A live bulk request or pledge conflicts with bulk request {bulk_request_id}.",
+        )
     except Exception as e:
+        db_session.rollback()
         raise HTTPException(
-            status_code=500, detail=f"Error checking bulk request existence: {str(e)}"
+            status_code=500, detail=f"Error restoring bulk request: {str(e)}"
         )
@@ -0,0 +1,394 @@
+from datetime import datetime, timedelta, timezone
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, delete, select
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from main import app
+from apps.bulk_request.models import (
+    BulkRequest,
+    BulkRequestArchive,
+    BulkRequestPledge,
+    BulkRequestPledgeArchive,
+    BulkRequestStatus,
+    PledgeStatus,
+)
+from apps.bulk_request.services import archive_finished_bulk_requests
+from apps.common.database import get_db, Base
+from apps.common.replicas import get_read_db
+from apps.user.models import User, UserTypeEnum
+from apps.user.services import create_access_token
+
+SQLALCHEMY_DATABASE_URL = "sqlite:///./test_bulk_requests.db"
+engine = create_engine(
+    SQLALCHEMY_DATABASE_URL,
+    connect_args={"check_same_thread": False},
+    poolclass=StaticPool,
+)
+TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+
+def override_get_db():
+    """Override database dependency for testing."""
+    try:
+        db = TestingSessionLocal()
+        yield db
+    finally:
+        db.close()
+
+
+app.dependency_overrides[get_db] = override_get_db
+app.dependency_overrides[get_read_db] = override_get_db
+
+client = TestClient(app)
+
+
+def auth_headers(user) -> dict:
+    token = create_access_token(
+        {
+            "user_id": user.id,
+            "username": user.username,
+            "user_type": user.user_type.value,
+        }
+    )
+    return {"Authorization": f"Bearer {token}"}
+
+
+@pytest.fixture(scope="module")
+def users():
+    """A buyer, a second buyer and a farmer pledging to their requests."""
+    Base.metadata.create_all(bind=engine)
+    db = TestingSessionLocal()
+    try:
+        buyer = User(
+            username="canteenbuyer",
+            email="canteenbuyer@example.com",
+            hashed_password="x",
+            user_type=UserTypeEnum.business,
+        )
+        other_buyer = User(
+            username="hotelbuyer",
+            email="hotelbuyer@example.com",
+            hashed_password="x",
+            user_type=UserTypeEnum.business,
+        )
+        farmer = User(
+            username="pledgefarmer",
+            email="pledgefarmer@example.com",
+            hashed_password="x",
+            user_type=UserTypeEnum.seller,
+        )
+        db.add_all([buyer, other_buyer, farmer])
+        db.commit()
+        for user in (buyer, other_buyer, farmer):
+            db.refresh(user)
+        yield buyer, other_buyer, farmer
+    finally:
+        db.close()
+        Base.metadata.drop_all(bind=engine)
+
+
+@pytest.fixture
+def clean_tables(users):
+    """Start each test without bulk requests or pledges."""
+    db = TestingSessionLocal()
+    try:
+        for model in (
+            BulkRequestPledge,
+            BulkRequestPledgeArchive,
+            BulkRequest,
+            BulkRequestArchive,
+        ):
+            db.execute(delete(model))
+        db.commit()
+    finally:
+        db.close()
+    return users
+
+
+def add_bulk_request(buyer, title, status=BulkRequestStatus.OPEN, age_days=0, **values):
+    db = TestingSessionLocal()
+    try:
+        changed_at = datetime.now(timezone.utc) - timedelta(days=age_days)
+        bulk_request = BulkRequest(
+            title=title,
+            product_name=values.pop("product_name", "Potatoes"),
+            quantity_needed=values.pop("quantity_needed", 500),
+            unit="kg",
+            delivery_deadline=datetime.now(timezone.utc) + timedelta(days=30),
+            delivery_location=values.pop("delivery_location", "Dublin"),
+            status=status,
+            buyer_id=buyer.id,
+            created_at=changed_at,
+            updated_at=changed_at,
+            **values,
+        )
+        db.add(bulk_request)
+        db.commit()
+        return bulk_request.id
+    finally:
+        db.close()
+
+
+def add_pledge(bulk_request_id, farmer, quantity=50):
+    db = TestingSessionLocal()
+    try:
+        pledge = BulkRequestPledge(
+            quantity_pledged=quantity,
+            price_per_unit=0.8,
+            estimated_delivery_date=datetime.now(timezone.utc) + timedelta(days=7),
+            status=PledgeStatus.ACCEPTED,
+            bulk_request_id=bulk_request_id,
+            farmer_id=farmer.id,
+        )
+        db.add(pledge)
+        db.commit()
+        return pledge.id
+    finally:
+        db.close()
+
+
+def archive_finished() -> int:
+    db = TestingSessionLocal()
+    try:
+        return archive_finished_bulk_requests(db, older_than_days=1)
+    finally:
+        db.close()
+
+
+def restore(bulk_request_id, user):
+    return client.post(
+        f"/api/bulk-request/{bulk_request_id}/restore", headers=auth_headers(user)
+    )
+
+
+def pledge_ids(model, bulk_request_id) -> list:
+    db = TestingSessionLocal()
+    try:
+        return sorted(
+            db.execute(
+                select(model.id).where(model.bulk_request_id == bulk_request_id)
+            ).scalars()
+        )
+    finally:
+        db.close()
+
+
+@pytest.fixture
+def archived_bulk_request(clean_tables):
+    """A closed bulk request with two pledges, untouched for a week, archived."""
+    buyer, _, farmer = clean_tables
+    bulk_request_id = add_bulk_request(
+        buyer, "Potatoes for the winter menu", BulkRequestStatus.CLOSED, age_days=7
+    )
+    pledges = [add_pledge(bulk_request_id, farmer), add_pledge(bulk_request_id, farmer)]
+    assert archive_finished() == 1
+    return bulk_request_id, pledges
+
+
+class TestBulkRequestArchive:
+    """Test archiving finished bulk requests out of the live tables."""
+
+    def test_archive_moves_pledges(self, clean_tables):
+        buyer, _, farmer = clean_tables
+        closed_id = add_bulk_request(
+            buyer, "Closed potatoes", BulkRequestStatus.CLOSED, age_days=7
+        )
+        recent_id = add_bulk_request(
+            buyer, "Recently closed potatoes", BulkRequestStatus.CLOSED
+        )
+        open_id = add_bulk_request(buyer, "Open potatoes", age_days=7)
+        closed_pledges = [add_pledge(closed_id, farmer), add_pledge(closed_id, farmer)]
+        open_pledge = add_pledge(open_id, farmer)
+
+        assert archive_finished() == 1
+
+        db = TestingSessionLocal()
+        try:
+            assert db.get(BulkRequest, closed_id) is None
+            assert db.get(BulkRequestArchive, closed_id).archived_at is not None
+            assert db.get(BulkRequest, recent_id) is not None
+            assert db.get(BulkRequest, open_id) is not None
+        finally:
+            db.close()
+        assert pledge_ids(BulkRequestPledge, closed_id) == []
+        assert pledge_ids(BulkRequestPledgeArchive, closed_id) == closed_pledges
+        assert pledge_ids(BulkRequestPledge, open_id) == [open_pledge]
+
+    def test_listing_includes_archived_on_request(self, archived_bulk_request, users):
+        buyer = users[0]
+        url = "/api/bulk-request?search=winter menu"
+        response = client.get(url, headers=auth_headers(buyer))
+        assert response.status_code == 200
+        assert response.json()["data"]["data"] == []
+
+        response = client.get(f"{url}&include_archived=true", headers=auth_headers(buyer))
+        assert response.status_code == 200
+        titles = [row["title"] for row in response.json()["data"]["data"]]
+        assert titles == ["Potatoes for the winter menu"]
+        assert response.json()["data"]["pagination"]["total"] == 1
+
+    def test_restore_bulk_request(self, archived_bulk_request, users):
+        bulk_request_id, pledges = archived_bulk_request
+        response = restore(bulk_request_id, users[0])
+        assert response.status_code == 200
+        assert response.json()["data"]["data"]["id"] == bulk_request_id
+
+        db = TestingSessionLocal()
+        try:
+            assert db.get(BulkRequestArchive, bulk_request_id) is None
+            restored = db.get(BulkRequest, bulk_request_id)
+            assert restored.title == "Potatoes for the winter menu"
+            # Fresh, so the next archiver run leaves it alone
+            assert restored.updated_at.replace(tzinfo=timezone.utc) > (
+                datetime.now(timezone.utc) - timedelta(minutes=1)
+            )
+        finally:
+            db.close()
+        assert pledge_ids(BulkRequestPledge, bulk_request_id) == pledges
+        assert pledge_ids(BulkRequestPledgeArchive, bulk_request_id) == []
+        assert archive_finished() == 0
+
+    def test_restore_not_found(self, archived_bulk_request, users):
+        bulk_request_id, _ = archived_bulk_request
+        # Another buyer's archived request, and one that was never archived
+        assert restore(bulk_request_id, users[1]).status_code == 404
+        assert restore(bulk_request_id + 1000, users[0]).status_code == 404
+
+        assert restore(bulk_request_id, users[0]).status_code == 200
+        assert restore(bulk_request_id, users[0]).status_code == 404
+
+    def test_restore_conflicting_title(self, archived_bulk_request, users):
+        buyer = users[0]
+        bulk_request_id, pledges = archived_bulk_request
+        add_bulk_request(buyer, "Potatoes for the winter menu")
+
+        response = restore(bulk_request_id, buyer)
+        assert response.status_code == 409
+
+        # Nothing was moved
+        db = TestingSessionLocal()
+        try:
+            assert db.get(BulkRequestArchive, bulk_request_id) is not None
+        finally:
+            db.close()
+        assert pledge_ids(BulkRequestPledgeArchive, bulk_request_id) == pledges
+
+    def test_archived_ids_are_not_reused(self, clean_tables):
+        """New rows never take the id of an archived bulk request or pledge."""
+        buyer, _, farmer = clean_tables
+        open_id = add_bulk_request(buyer, "Open carrots")
+        add_pledge(open_id, farmer)
+        closed_id = add_bulk_request(
+            buyer, "Closed carrots", BulkRequestStatus.CLOSED, age_days=7
+        )
+        # The archived request and its pledge hold the highest ids
+        archived_pledge = add_pledge(closed_id, farmer)
+        assert archive_finished() == 1
+
+        new_id = add_bulk_request(buyer, "More carrots")
+        new_pledge = add_pledge(open_id, farmer)
+        assert new_id > closed_id
+        assert new_pledge > archived_pledge
+
+        assert restore(closed_id, buyer).status_code == 200
+        assert pledge_ids(BulkRequestPledge, closed_id) == [archived_pledge]
+
+
+
+def post_bulk_request(buyer, title, delivery_location):
+    response = client.post(
+        "/api/bulk-request",
+        json={
+            "title": title,
+            "product_name": "Onions",
+            "quantity_needed": 200,
+            "unit": "kg",
+            "delivery_deadline": (
+                datetime.now(timezone.utc) + timedelta(days=30)
+            ).isoformat(),
+            "delivery_location": delivery_location,
+        },
+        headers=auth_headers(buyer),
+    )
+    assert response.status_code == 201
+    return response.json()["data"]["data"]["id"]
+
+
+def list_near(user, query: str):
+    return client.get(f"/api/bulk-request?{query}", headers=auth_headers(user))
+
+
+# Central Dublin
+NEAR_DUBLIN = "near_lat=53.3498&near_lon=-6.2603"
+
+
+@pytest.fixture
+def located_bulk_requests(clean_tables):
+    """Bulk requests delivered to Dublin, Swords and Cork, and one to Bray archived."""
+    buyer, _, _ = clean_tables
+    ids = {
+        place: post_bulk_request(buyer, f"Onions for {place}", place)
+        for place in ("Cork", "Swords", "Dublin")
+    }
+    ids["Bray"] = add_bulk_request(
+        buyer,
+        "Onions for Bray",
+        BulkRequestStatus.CLOSED,
+        age_days=7,
+        delivery_location="Bray",
+        delivery_lat=53.2028,
+        delivery_lon=-6.0983,
+    )
+    assert archive_finished() == 1
+    return ids
+
+
+class TestBulkRequestRadiusSearch:
+    """Test near_lat/near_lon/radius_km on the bulk request listing."""
+
+    def test_radius_filter_nearest_first(self, located_bulk_requests, users):
+        response = list_near(users[0], f"{NEAR_DUBLIN}&radius_km=30")
+        assert response.status_code == 200
+        rows = response.json()["data"]["data"]
+        assert [row["delivery_location"] for row in rows] == ["Dublin", "Swords"]
+        assert rows[0]["distance_km"] == 0.0
+        assert 10 < rows[1]["distance_km"] < 15
+        assert response.json()["data"]["pagination"]["total"] == 2
+
+    def test_sort_by_distance_descending(self, located_bulk_requests, users):
+        response = list_near(
+            users[0], f"{NEAR_DUBLIN}&radius_km=300&sort_by=distance&sort_order=desc"
+        )
+        rows = response.json()["data"]["data"]
+        assert [row["delivery_location"] for row in rows] == ["Cork", "Swords", "Dublin"]
+
+    def test_include_archived(self, located_bulk_requests, users):
+        response = list_near(users[0], f"{NEAR_DUBLIN}&radius_km=30&include_archived=true")
+        rows = response.json()["data"]["data"]
+        assert [row["delivery_location"] for row in rows] == ["Dublin", "Swords", "Bray"]
+        assert 15 < rows[2]["distance_km"] < 25
+
+    def test_restored_bulk_request_is_indexed(self, located_bulk_requests, users):
+        """The R*Tree triggers follow rows moved out of and back into bulk_request."""
+        buyer = users[0]
+        assert restore(located_bulk_requests["Bray"], buyer).status_code == 200
+
+        rows = list_near(buyer, f"{NEAR_DUBLIN}&radius_km=30").json()["data"]["data"]
+        assert [row["delivery_location"] for row in rows] == ["Dublin", "Swords", "Bray"]
+
+    def test_partial_parameters_rejected(self, located_bulk_requests, users):
+        for query in (
+            "near_lat=53.3498&radius_km=30",
+            f"{NEAR_DUBLIN}",
+            "radius_km=30",
+            "sort_by=distance",
+        ):
+            response = list_near(users[0], query)
+            assert response.status_code == 400, query
+
+
+if __name__ == "__main__":
+    # Run tests with pytest
+    pytest.main([__file__, "-v"])
@@ -1,15 +1,18 @@
+from fastapi import HTTPException
 from fastapi.encoders import jsonable_encoder
 from sqlalchemy.orm import Session
 from apps.bulk_request.services import (
     get_all_bulk_requests,
     create_bulk_request,
-    bulk_request_exists_for_user,
+    restore_bulk_request,
 )
 from apps.bulk_request.schemas import (
     BulkRequestCreate,
     BulkRequestListQueryParams,
 )
 from apps.common.custom_response import CustomJSONResponse
+from apps.common.geo import distance_km
+from apps.common.rows import serialize_rows
 
 
 def get_bulk_requests_view(
@@ -17,32 +20,66 @@ def get_bulk_requests_view(
 ) -> CustomJSONResponse:
     """
     Get all bulk requests with filtering and pagination.
+    `fields` narrows both the selected columns and the serialized bulk requests.
     """
+    try:
+        fields = query_params.field_list()
+        near = query_params.near()
+    except ValueError as e:
+        return CustomJSONResponse(content={}, message=str(e), status_code=400)
+    if query_params.sort_by == "distance" and near is None:
+        return CustomJSONResponse(
+            content={},
+            message="sort_by=distance needs near_lat, near_lon and radius_km",
+            status_code=400,
+        )
+    if query_params.sort_by == "relevance" and not query_params.fuzzy():
+        return CustomJSONResponse(
+            content={},
+            message="sort_by=relevance needs search with search_mode=fuzzy",
+            status_code=400,
+        )
     try:
         # For business users, show only their requests
         # For farmers/sellers, show all open requests they can pledge to
         buyer_id = user_id if user_type == "business" else None
+        sort_by, sort_order = query_params.sorting()
 
         result = get_all_bulk_requests(
             db_session=db,
             page=query_params.page,
             limit=query_params.limit,
             search=query_params.search,
+            search_mode=query_params.search_mode,
             category_id=query_params.category_id,
             status=query_params.status,
             min_quantity=query_params.min_quantity,
             max_quantity=query_params.max_quantity,
             min_price=query_params.min_price,
             max_price=query_params.max_price,
-            sort_by=query_params.sort_by,
-            sort_order=query_params.sort_order,
+            sort_by=sort_by,
+            sort_order=sort_order,
             buyer_id=buyer_id,
+            fields=fields,
+            include_archived=query_params.include_archived,
+            near=near,
         )
 
         if result["success"]:
+            bulk_requests = serialize_rows(result["bulk_requests"])
+            if near is not None:
+                for bulk_request in bulk_requests:
+                    distance = distance_km(
+                        bulk_request.get("delivery_lat"),
+                        bulk_request.get("delivery_lon"),
+                        near[0],
+                        near[1],
+                    )
+                    if distance is not None:
+                        bulk_request["distance_km"] = round(distance, 1)
             return CustomJSONResponse(
                 content={
-                    "data": jsonable_encoder(result["bulk_requests"]),
+                    "data": bulk_requests,
                     "pagination": result["pagination"],
                 },
                 message="Bulk Request List",
@@ -70,14 +107,7 @@ def create_bulk_request_view(
     Create a new bulk request for a business user.
     """
     try:
-        # Check if user already has a bulk request with the same title
-        if bulk_request_exists_for_user(db, user_id, bulk_request_data.title):
-            return CustomJSONResponse(
-                content={},
-                message="A bulk request with this title already exists for this user",
-                status_code=400,
-            )
-        # Create the bulk request
+        # Create the bulk request, unless the user has one with the same title
         print("*" * 80)
         print("WOrking ")
         print("*" * 80)
@@ -104,3 +134,31 @@ def create_bulk_request_view(
             message=str(e),
             status_code=500,
         )
+
+
+def restore_bulk_request_view(
+    bulk_request_id: int, db: Session, user_id: int
+) -> CustomJSONResponse:
+    """
+    Move an archived bulk request, with its pledges, back into the live tables.
+    """
+    try:
+        bulk_request = restore_bulk_request(db, bulk_request_id, user_id)
+        if bulk_request is None:
+            return CustomJSONResponse(
+                content={},
+                message=f"Archived bulk request with ID {bulk_request_id} not found.",
+                status_code=404,
+            )
+        return CustomJSONResponse(
+            content={"data": jsonable_encoder(bulk_request)},
+            message="Bulk request restored successfully",
+            status_code=200,
+        )
+
+    except HTTPException as e:
+        return CustomJSONResponse(
+            content={},
+            message=str(e.detail),
+            status_code=e.status_code,
+        )
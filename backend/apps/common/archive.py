@@ -0,0 +1,182 @@
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Callable, Dict, Optional, Sequence, Tuple
+
+from sqlalchemy import Table, func, literal, select
+from sqlalchemy.orm import Session
+
+from apps.common.metrics import register_metrics
+
+ARCHIVED_AT = "archived_at"
+
+# (child table, child archive table, column referencing the parent id)
+ChildTables = Sequence[Tuple[Table, Table, str]]
+
+
+def _copy_rows(
+    db_session: Session,
+    source: Table,
+    target: Table,
+    key_column: str,
+    keys: Sequence[int],
+    now: datetime,
+) -> None:
+    names = [column.name for column in target.c if column.name in source.c]
+    columns = [source.c[name] for name in names]
+    if ARCHIVED_AT in target.c and ARCHIVED_AT not in source.c:
+        names.append(ARCHIVED_AT)
+        columns.append(literal(now, target.c[ARCHIVED_AT].type))
+    db_session.execute(
+        target.insert().from_select(
+            names, select(*columns).where(source.c[key_column].in_(keys))
+        )
+    )
+
+
+def move_rows(
+    db_session: Session,
+    source: Table,
+    target: Table,
+    ids: Sequence[int],
+    children: ChildTables = (),
+) -> None:
+    """
+    Move the rows with `ids` (and their child rows) from `source` to `target`,
+    in either direction between a live table and its archive. Columns are
+    matched by name; `archived_at` is filled in when moving into an archive.
+    The caller commits.
+    """
+    now = datetime.now(timezone.utc)
+    if ids:
+        _copy_rows(db_session, source, target, "id", ids, now)
+        for child_source, child_target, parent_column in children:
+            _copy_rows(db_session, child_source, child_target, parent_column, ids, now)
+        for child_source, _, parent_column in children:
+            db_session.execute(
+                child_source.delete().where(child_source.c[parent_column].in_(ids))
+            )
+        db_session.execute(source.delete().where(source.c.id.in_(ids)))
+
+
+def archive_in_batches(
+    db_session: Session,
+    source: Table,
+    target: Table,
+    condition,
+    batch_size: int,
+    children: ChildTables = (),
+) -> int:
+    """
+    Move every `source` row matching `condition` to `target`, `batch_size`
+    rows per transaction so writers are never blocked for long. Returns the
+    number of rows moved.
+
+    Live tables must be declared with sqlite_autoincrement, so that ids of
+    archived rows (parents and children) are not handed out to new rows.
+    """
+    moved = 0
+    while True:
+        ids = (
+            db_session.execute(
+                select(source.c.id)
+                .where(condition)
+                .order_by(source.c.id)
+                .limit(batch_size)
+            )
+            .scalars()
+            .all()
+        )
+        if not ids:
+            return moved
+        try:
+            move_rows(db_session, source, target, ids, children)
+            db_session.commit()
+        except Exception:
+            db_session.rollback()
+            raise
+        moved += len(ids)
+        if len(ids) < batch_size:
+            return moved
+
+
+class ArchiveScheduler:
+    """
+    Runs the registered archive jobs periodically on a daemon thread and keeps
+    the sizes of the live and archive tables for /api/metrics.
+    """
+
+    def __init__(self):
+        self._jobs: Dict[str, Tuple[Callable[[Session], int], Sequence[Table]]] = {}
+        self._lock = threading.Lock()
+        self.runs = 0
+        self.moved: Dict[str, int] = {}
+        self.table_rows: Dict[str, int] = {}
+        self.last_run_at: Optional[str] = None
+        self.last_error: Optional[str] = None
+
+    def register(
+        self, name: str, job: Callable[[Session], int], tables: Sequence[Table]
+    ) -> None:
+        """
+        Register `job(session) -> rows moved`. The row counts of `tables` are
+        refreshed after each run.
+        """
+        self._jobs[name] = (job, tables)
+        self.moved.setdefault(name, 0)
+
+    def run_once(self, session_factory: Callable[[], Session]) -> Dict[str, int]:
+        """
+        Run every job once, each on its own session. A failing job is logged
+        and does not stop the others.
+        """
+        results = {}
+        with self._lock:
+            for name, (job, tables) in self._jobs.items():
+                session = session_factory()
+                try:
+                    results[name] = job(session)
+                    self.moved[name] += results[name]
+                    for table in tables:
+                        self.table_rows[table.name] = session.execute(
+                            select(func.count()).select_from(table)
+                        ).scalar()
+                except Exception as e:
+                    print(f"Error running archive job {name}: {str(e)}")
+                    self.last_error = f"{name}: {str(e)}"
+                finally:
+                    session.close()
+            self.runs += 1
+            self.last_run_at = datetime.now(timezone.utc).isoformat()
+        return results
+
+    def start(
+        self, session_factory: Callable[[], Session], interval_seconds: float
+    ) -> Optional[threading.Thread]:
+        """
+        Run the jobs every `interval_seconds`, starting one interval from now.
+        """
+        if interval_seconds <= 0 or not self._jobs:
+            return None
+
+        def run_forever():
+            while True:
+                time.sleep(interval_seconds)
+                self.run_once(session_factory)
+
+        thread = threading.Thread(target=run_forever, name="archiver", daemon=True)
+        thread.start()
+        return thread
+
+    def stats(self) -> dict:
+        return {
+            "runs": self.runs,
+            "last_run_at": self.last_run_at,
+            "last_error": self.last_error,
+            "moved": dict(self.moved),
+            "table_rows": dict(self.table_rows),
+        }
+
+
+archive_scheduler = ArchiveScheduler()
+register_metrics("archive", archive_scheduler.stats)
@@ -0,0 +1,184 @@
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Callable, Hashable, Optional, Tuple
+
+from fastapi.responses import Response
+
+from apps.common.shared_state import SharedVersions, shared_versions
+
+
+@dataclass
+class CachedResponse:
+    body: bytes
+    status_code: int
+    media_type: str
+    version: int
+    stored_at: float
+
+    def to_response(self, cache_status: str) -> Response:
+        """
+        Build a fresh Response from the cached, already rendered body.
+        """
+        return Response(
+            content=self.body,
+            status_code=self.status_code,
+            media_type=self.media_type,
+            headers={"X-Cache": cache_status},
+        )
+
+
+class ResponseCache:
+    """
+    Process-local cache of rendered responses.
+
+    Entries are evicted in LRU order once the total size of the cached bodies
+    goes over `max_bytes`. Every entry is tagged with the cache version at the
+    time its data was loaded; `invalidate()` bumps the version so all older
+    entries turn into misses without walking the whole cache. The version is
+    kept in SharedVersions under the cache name, so under the multi-worker
+    launcher an invalidation in one worker reaches every worker.
+
+    An entry is fresh for `ttl_seconds` and then served as stale for another
+    `stale_seconds` while a single background refresh replaces it.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        max_bytes: int,
+        ttl_seconds: float,
+        stale_seconds: float = 0.0,
+        versions: Optional[SharedVersions] = None,
+    ):
+        self.name = name
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.stale_seconds = stale_seconds
+        self._entries: "OrderedDict[Hashable, CachedResponse]" = OrderedDict()
+        self._size = 0
+        self._versions = versions or shared_versions
+        self._refreshing: set = set()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def version(self) -> int:
+        return self._versions.get(self.name)
+
+    def invalidate(self) -> None:
+        """
+        Bump the cache version. Entries loaded before this call become misses.
+        """
+        self._versions.bump(self.name)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+        self.invalidate()
+
+    def get(self, key: Hashable) -> Optional[Tuple[CachedResponse, bool]]:
+        """
+        Return `(entry, is_stale)` for a usable entry, or None on a miss.
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            age = now - entry.stored_at
+            if entry.version != self.version or age >= (
+                self.ttl_seconds + self.stale_seconds
+            ):
+                self._discard(key)
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            is_stale = age >= self.ttl_seconds
+            if is_stale:
+                self.stale_hits += 1
+            else:
+                self.hits += 1
+            return entry, is_stale
+
+    def set(self, key: Hashable, response: Response, version: int) -> bool:
+        """
+        Store a rendered response loaded while the cache was at `version`.
+        Responses loaded before an invalidation are dropped.
+        """
+        body = bytes(response.body)
+        if len(body) > self.max_bytes or not 200 <= response.status_code < 300:
+            return False
+
+        entry = CachedResponse(
+            body=body,
+            status_code=response.status_code,
+            media_type=response.media_type or "application/json",
+            version=version,
+            stored_at=time.monotonic(),
+        )
+        with self._lock:
+            if version != self.version:
+                return False
+            if key in self._entries:
+                self._discard(key)
+            self._entries[key] = entry
+            self._size += len(body)
+            while self._size > self.max_bytes:
+                oldest_key = next(iter(self._entries))
+                self._discard(oldest_key)
+                self.evictions += 1
+        return True
+
+    def refresh_in_background(
+        self, key: Hashable, loader: Callable[[], Response]
+    ) -> bool:
+        """
+        Reload a stale entry on a daemon thread. Only one refresh per key runs
+        at a time; returns False if one is already in progress.
+        """
+        with self._lock:
+            if key in self._refreshing:
+                return False
+            self._refreshing.add(key)
+
+        def refresh():
+            try:
+                version = self.version
+                self.set(key, loader(), version)
+            except Exception as e:
+                print(f"Error refreshing {self.name} cache entry: {str(e)}")
+            finally:
+                with self._lock:
+                    self._refreshing.discard(key)
+
+        threading.Thread(
+            target=refresh, name=f"{self.name}-cache-refresh", daemon=True
+        ).start()
+        return True
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._size,
+                "max_bytes": self.max_bytes,
+                "version": self.version,
+                "hits": self.hits,
+                "stale_hits": self.stale_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+    def _discard(self, key: Hashable) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._size -= len(entry.body)
@@ -1,20 +1,149 @@
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+import threading
+from typing import Callable, Optional
+
+from fastapi import Request
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session, sessionmaker
 from sqlalchemy.ext.declarative import declarative_base
+from apps.common.metrics import register_metrics
+from config import SQLITE_JOURNAL_MODE, SQLITE_BUSY_TIMEOUT_MS
 
 
 DATABASE_URL = "sqlite:///./database.db" # Update this to use from environment variables
 
-engine = create_engine(
-    DATABASE_URL, echo=True
-)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# The engine is created on first use (see get_engine) rather than at import time
+_engine = None
+SessionLocal = sessionmaker(autocommit=False, autoflush=False)
 
 Base = declarative_base()
 
-def get_db():
-    db = SessionLocal()
+
+def get_engine() -> Engine:
+    """
+    Create the application engine on first call and bind SessionLocal to it.
+    """
+    global _engine
+    if _engine is None:
+        _engine = create_engine(
+            DATABASE_URL, echo=True
+        )
+        if _engine.dialect.name == "sqlite":
+            event.listen(_engine, "connect", _configure_sqlite_connection)
+        SessionLocal.configure(bind=_engine)
+    return _engine
+
+
+def _configure_sqlite_connection(dbapi_connection, connection_record):
+    """
+    Let several worker processes share the SQLite file: WAL lets readers run
+    alongside the single writer, and the busy timeout makes writers wait for
+    the lock instead of failing with "database is locked".
+    """
+    cursor = dbapi_connection.cursor()
+    cursor.execute(f"PRAGMA journal_mode={SQLITE_JOURNAL_MODE}")
+    cursor.execute(f"PRAGMA busy_timeout={int(SQLITE_BUSY_TIMEOUT_MS)}")
+    cursor.close()
+
+
+def dispose_engine_after_fork() -> None:
+    """
+    Called in a freshly forked worker: drop pooled connections inherited from
+    the parent (without closing them, they still belong to the parent) so the
+    worker opens its own.
+    """
+    if _engine is not None:
+        _engine.dispose(close=False)
+
+
+def __getattr__(name):
+    # `from apps.common.database import engine` still works, lazily
+    if name == "engine":
+        return get_engine()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+class LazySession:
+    """
+    Stand-in for a Session that only creates it when first used.
+
+    Requests answered from a cache, or that never reach a query, get one of
+    these from get_db and never build a Session or check out a connection.
+    Any attribute access (execute, query, add, ...) opens the real session.
+    """
+
+    __slots__ = ("_factory", "_session")
+
+    def __init__(self, factory: Callable[[], Session]):
+        self._factory = factory
+        self._session: Optional[Session] = None
+
+    @property
+    def is_open(self) -> bool:
+        return self._session is not None
+
+    def _get_session(self) -> Session:
+        if self._session is None:
+            if _engine is None:
+                get_engine()
+            self._session = self._factory()
+            _session_stats.record_open()
+        return self._session
+
+    def __getattr__(self, name):
+        return getattr(self._get_session(), name)
+
+    def close(self) -> None:
+        if self._session is not None:
+            self._session.close()
+            self._session = None
+
+
+class _SessionStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requested = 0
+        self.opened = 0
+
+    def record_request(self) -> None:
+        with self._lock:
+            self.requested += 1
+
+    def record_open(self) -> None:
+        with self._lock:
+            self.opened += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "requested": self.requested,
+                "opened": self.opened,
+                "skipped": self.requested - self.opened,
+            }
+
+
+_session_stats = _SessionStats()
+register_metrics("db_sessions", _session_stats.stats)
+
+
+def get_db(request: Request = None):
+    """
+    Request-scoped, lazily opened session. The session is kept on
+    `request.state.db`, so every dependency of one request (is_authenticated,
+    get_read_db, the route itself) shares it, and it is only created once a
+    statement actually runs.
+    """
+    if request is not None and getattr(request.state, "db", None) is not None:
+        yield request.state.db
+        return
+
+    db = LazySession(SessionLocal)
+    _session_stats.record_request()
+    if request is not None:
+        request.state.db = db
     try:
         yield db
     finally:
         db.close()
+        if request is not None:
+            request.state.db = None
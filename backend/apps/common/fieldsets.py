@@ -0,0 +1,24 @@
+from typing import Optional, Sequence, Tuple
+
+
+def parse_fieldset(
+    value: Optional[str], allowed: Sequence[str], always: Sequence[str] = ("id",)
+) -> Optional[Tuple[str, ...]]:
+    """
+    Parse a `fields=name,price` query parameter.
+
+    Returns None when no fieldset was requested, otherwise the requested names
+    plus `always`, in the order of `allowed` so equivalent requests compare
+    equal. Raises ValueError for names not in `allowed`.
+    """
+    if value is None or not value.strip():
+        return None
+    requested = {name.strip() for name in value.split(",") if name.strip()}
+    unknown = requested - set(allowed)
+    if unknown:
+        raise ValueError(
+            f"Unknown fields: {', '.join(sorted(unknown))}. "
+            f"Available fields: {', '.join(allowed)}"
+        )
+    requested.update(always)
+    return tuple(name for name in allowed if name in requested)
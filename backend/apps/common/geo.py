@@ -0,0 +1,126 @@
+import csv
+import math
+import re
+import sqlite3
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from apps.common.text import normalize_text
+from config import GAZETTEER_PATH
+
+EARTH_RADIUS_KM = 6371.0088
+# Length of one degree of latitude
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+
+_COUNTY_PREFIX = re.compile(r"^(county|co) ")
+
+Point = Tuple[float, float]
+
+
+def distance_km(
+    lat1: Optional[float],
+    lon1: Optional[float],
+    lat2: Optional[float],
+    lon2: Optional[float],
+) -> Optional[float]:
+    """
+    Great-circle (haversine) distance between two points, or None if any
+    coordinate is missing.
+    """
+    if lat1 is None or lon1 is None or lat2 is None or lon2 is None:
+        return None
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    d_phi = phi2 - phi1
+    d_lambda = math.radians(lon2 - lon1)
+    a = (
+        math.sin(d_phi / 2) ** 2
+        + math.cos(phi1) * math.cos(phi2) * math.sin(d_lambda / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def bounding_box(lat: float, lon: float, radius_km: float) -> Tuple[float, float, float, float]:
+    """
+    (min_lat, max_lat, min_lon, max_lon) of a box containing every point within
+    `radius_km` of (lat, lon). Near the poles or across the antimeridian the
+    box spans every longitude.
+    """
+    d_lat = radius_km / KM_PER_DEGREE
+    min_lat, max_lat = lat - d_lat, lat + d_lat
+    if min_lat <= -90 or max_lat >= 90:
+        return max(min_lat, -90.0), min(max_lat, 90.0), -180.0, 180.0
+    # The box must be wide enough at the latitude furthest from the equator
+    d_lon = d_lat / math.cos(math.radians(max(abs(min_lat), abs(max_lat))))
+    min_lon, max_lon = lon - d_lon, lon + d_lon
+    if min_lon < -180 or max_lon > 180:
+        return min_lat, max_lat, -180.0, 180.0
+    return min_lat, max_lat, min_lon, max_lon
+
+
+class Gazetteer:
+    """
+    Offline place name lookup from a CSV of `name,lat,lon` rows.
+    """
+
+    def __init__(self, places: Dict[str, Point]):
+        self.places = {normalize_text(name): point for name, point in places.items()}
+        self.max_words = max((len(name.split()) for name in self.places), default=0)
+
+    @classmethod
+    def from_csv(cls, path: str) -> "Gazetteer":
+        with open(path, newline="", encoding="utf-8") as gazetteer_file:
+            return cls(
+                {
+                    row["name"]: (float(row["lat"]), float(row["lon"]))
+                    for row in csv.DictReader(gazetteer_file)
+                }
+            )
+
+    def _lookup(self, part: str) -> Optional[Point]:
+        name = normalize_text(part)
+        return self.places.get(name) or self.places.get(_COUNTY_PREFIX.sub("", name))
+
+    def geocode(self, location: Optional[str]) -> Optional[Point]:
+        """
+        Coordinates of a free-text location such as "12 Main St, Mallow, Co. Cork".
+
+        The comma-separated parts are tried first to last, so the town wins
+        over the county. Failing that, the first capitalized run of words
+        naming a place is used ("Farm gate near Naas").
+        """
+        if not location:
+            return None
+        for part in location.split(","):
+            point = self._lookup(part)
+            if point is not None:
+                return point
+
+        words: List[str] = re.findall(r"[^\W\d_][\w'-]*", location)
+        for start in range(len(words)):
+            for size in range(min(self.max_words, len(words) - start), 0, -1):
+                candidate = words[start : start + size]
+                if not candidate[0][0].isupper():
+                    continue
+                point = self.places.get(normalize_text(" ".join(candidate)))
+                if point is not None:
+                    return point
+        return None
+
+
+@lru_cache(maxsize=1)
+def get_gazetteer() -> Gazetteer:
+    return Gazetteer.from_csv(GAZETTEER_PATH)
+
+
+def geocode(location: Optional[str]) -> Optional[Point]:
+    return get_gazetteer().geocode(location)
+
+
+@event.listens_for(Engine, "connect")
+def _register_sqlite_functions(dbapi_connection, connection_record):
+    # distance_km(lat1, lon1, lat2, lon2) for the exact radius check in SQL
+    if isinstance(dbapi_connection, sqlite3.Connection):
+        dbapi_connection.create_function("distance_km", 4, distance_km, deterministic=True)
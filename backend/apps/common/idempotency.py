@@ -0,0 +1,466 @@
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Hashable, Optional, Tuple
+
+from fastapi.responses import Response
+from sqlalchemy import delete, select, update
+from sqlalchemy.engine import Engine
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session
+
+from apps.common.archive import archive_scheduler
+from apps.common.custom_response import CustomJSONResponse
+from apps.common.metrics import register_metrics
+from apps.common.models import IdempotencyKey
+from config import (
+    IDEMPOTENCY_LEASE_SECONDS,
+    IDEMPOTENCY_MAX_KEYS,
+    IDEMPOTENCY_TTL_SECONDS,
+    IDEMPOTENCY_WAIT_SECONDS,
+)
+
+# Longest Idempotency-Key header accepted
+IDEMPOTENCY_KEY_MAX_LENGTH = 255
+# How often a request polls for a key held by another worker
+IDEMPOTENCY_POLL_SECONDS = 0.05
+
+idempotency_keys = IdempotencyKey.__table__
+
+
+@dataclass
+class _Entry:
+    fingerprint: str
+    started_at: float
+    done: threading.Event = field(default_factory=threading.Event)
+    body: Optional[bytes] = None
+    status_code: int = 0
+    media_type: str = "application/json"
+
+    def to_response(self) -> Response:
+        return Response(
+            content=self.body,
+            status_code=self.status_code,
+            media_type=self.media_type,
+            headers={"Idempotent-Replayed": "true"},
+        )
+
+
+class IdempotencyStore:
+    """
+    Store of recent Idempotency-Key values and the responses they produced,
+    so a client retrying a create gets the original response instead of a
+    second row.
+
+    The first request with a key runs; requests arriving with the same key
+    while it runs wait for it (up to `wait_seconds`) and replay its response.
+    Responses below 500 are kept for `ttl_seconds`; a server error or an
+    exception releases the key so the client can retry. Keys are scoped by
+    the caller (e.g. route and user) and the request payload is fingerprinted:
+    reusing a key with a different payload is rejected. At most `max_keys`
+    completed keys are kept in memory, oldest evicted first.
+
+    Given a database session, keys are also claimed in the idempotency_key
+    table, so a retry landing on another worker waits for or replays the
+    response of the worker holding the key. The holder records its pid and
+    renews a lease on the row every `lease_seconds` / 3 while it runs; the key
+    is only taken over once that process is gone or its lease has expired.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        max_keys: int,
+        ttl_seconds: float,
+        wait_seconds: float,
+        lease_seconds: float = IDEMPOTENCY_LEASE_SECONDS,
+    ):
+        self.name = name
+        self.max_keys = max_keys
+        self.ttl_seconds = ttl_seconds
+        self.wait_seconds = wait_seconds
+        self.lease_seconds = lease_seconds
+        self._entries: "OrderedDict[Hashable, _Entry]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.executions = 0
+        self.replays = 0
+        self.waits = 0
+        self.conflicts = 0
+        self.evictions = 0
+        self.remote_replays = 0
+        self.takeovers = 0
+
+    @staticmethod
+    def fingerprint(payload: bytes) -> str:
+        return hashlib.sha256(payload).hexdigest()
+
+    def _expired(self, entry: _Entry, now: float) -> bool:
+        return entry.done.is_set() and now - entry.started_at >= self.ttl_seconds
+
+    def _evict(self, now: float) -> None:
+        # Called with the lock held. Keys still running are never evicted.
+        for key in list(self._entries):
+            if len(self._entries) <= self.max_keys:
+                break
+            entry = self._entries[key]
+            if entry.done.is_set():
+                del self._entries[key]
+                self.evictions += 1
+        for key in list(self._entries):
+            entry = self._entries[key]
+            if not self._expired(entry, now):
+                break
+            del self._entries[key]
+
+    def run(
+        self,
+        key: Hashable,
+        payload: bytes,
+        fn: Callable[[], Response],
+        db_session: Optional[Session] = None,
+    ) -> Response:
+        """
+        Return the response stored for `key`, waiting for it if the request
+        holding the key is still running, or run `fn` and store its response.
+        With `db_session`, `key` is a (scope, Idempotency-Key) pair.
+        """
+        fingerprint = self.fingerprint(payload)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self._expired(entry, now):
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                entry = self._entries[key] = _Entry(fingerprint=fingerprint, started_at=now)
+                self._evict(now)
+                is_leader = True
+            else:
+                is_leader = False
+
+        if not is_leader:
+            return self._replay(entry, fingerprint)
+
+        lease = None
+        if db_session is not None:
+            if not self._claim(db_session, key, fingerprint):
+                return self._follow(db_session, key, entry, fingerprint)
+            lease = self._renew_lease(db_session.get_bind(), key)
+
+        self.executions += 1
+        try:
+            response = fn()
+        except BaseException:
+            self._release(key, entry, db_session)
+            raise
+        finally:
+            if lease is not None:
+                lease.set()
+        if response.status_code >= 500:
+            self._release(key, entry, db_session)
+            return response
+
+        with self._lock:
+            entry.body = bytes(response.body)
+            entry.status_code = response.status_code
+            entry.media_type = response.media_type or "application/json"
+            entry.done.set()
+        if db_session is not None:
+            self._complete(db_session, key, entry)
+        return response
+
+    def _replay(self, entry: _Entry, fingerprint: str) -> Response:
+        if entry.fingerprint != fingerprint:
+            self.conflicts += 1
+            return CustomJSONResponse(
+                content={},
+                message="Idempotency-Key was already used with a different request",
+                status_code=422,
+            )
+        if not entry.done.is_set():
+            self.waits += 1
+            entry.done.wait(self.wait_seconds)
+        if entry.body is None:
+            # Still running after wait_seconds, or failed and released
+            return CustomJSONResponse(
+                content={},
+                message="A request with this Idempotency-Key is still in progress",
+                status_code=409,
+            )
+        self.replays += 1
+        return entry.to_response()
+
+    def _release(
+        self, key: Hashable, entry: _Entry, db_session: Optional[Session] = None
+    ) -> None:
+        with self._lock:
+            if self._entries.get(key) is entry:
+                del self._entries[key]
+            entry.done.set()
+        if db_session is None:
+            return
+        try:
+            db_session.rollback()
+            db_session.execute(
+                delete(idempotency_keys).where(
+                    *_row_filter(key),
+                    idempotency_keys.c.owner_pid == os.getpid(),
+                    idempotency_keys.c.status_code.is_(None),
+                )
+            )
+            db_session.commit()
+        except Exception as e:
+            db_session.rollback()
+            print(f"Error releasing idempotency key: {str(e)}")
+
+    def _claim(self, db_session: Session, key: Hashable, fingerprint: str) -> bool:
+        """
+        Insert the running row for `key`, owned by this process; False if
+        another request holds it or already completed it.
+        """
+        scope, idempotency_key = _row_key(key)
+        now = datetime.now(timezone.utc)
+        try:
+            holder = db_session.execute(
+                select(idempotency_keys.c.owner_pid, idempotency_keys.c.status_code)
+                .where(*_row_filter(key))
+            ).first()
+            running = idempotency_keys.c.status_code.is_(None)
+            abandoned = idempotency_keys.c.heartbeat_at <= now - timedelta(
+                seconds=self.lease_seconds
+            )
+            if (
+                holder is not None
+                and holder.status_code is None
+                and not _process_alive(holder.owner_pid)
+            ):
+                abandoned = abandoned | (idempotency_keys.c.owner_pid == holder.owner_pid)
+            taken_over = db_session.execute(
+                delete(idempotency_keys).where(
+                    *_row_filter(key),
+                    (
+                        idempotency_keys.c.created_at
+                        <= now - timedelta(seconds=self.ttl_seconds)
+                    )
+                    | (running & abandoned),
+                )
+            ).rowcount
+            claimed = db_session.execute(
+                sqlite_insert(idempotency_keys)
+                .values(
+                    scope=scope,
+                    key=idempotency_key,
+                    fingerprint=fingerprint,
+                    owner_pid=os.getpid(),
+                    heartbeat_at=now,
+                    created_at=now,
+                )
+                .on_conflict_do_nothing()
+            ).rowcount
+            db_session.commit()
+        except Exception:
+            db_session.rollback()
+            raise
+        if claimed == 1 and taken_over and holder is not None and holder.status_code is None:
+            self.takeovers += 1
+        return claimed == 1
+
+    def _renew_lease(self, bind: Engine, key: Hashable) -> threading.Event:
+        """
+        Renew this process's lease on the row of `key` on a daemon thread,
+        with its own session, until the returned event is set.
+        """
+        stop = threading.Event()
+
+        def renew():
+            while not stop.wait(self.lease_seconds / 3):
+                session = Session(bind=bind)
+                try:
+                    session.execute(
+                        update(idempotency_keys)
+                        .where(
+                            *_row_filter(key),
+                            idempotency_keys.c.owner_pid == os.getpid(),
+                            idempotency_keys.c.status_code.is_(None),
+                        )
+                        .values(heartbeat_at=datetime.now(timezone.utc))
+                    )
+                    session.commit()
+                except Exception as e:
+                    session.rollback()
+                    print(f"Error renewing idempotency key lease: {str(e)}")
+                finally:
+                    session.close()
+
+        threading.Thread(target=renew, name=f"{self.name}-lease", daemon=True).start()
+        return stop
+
+    def _follow(
+        self, db_session: Session, key: Hashable, entry: _Entry, fingerprint: str
+    ) -> Response:
+        """
+        Wait for the row of a key claimed by another worker, then replay it.
+        """
+        deadline = time.monotonic() + self.wait_seconds
+        row = _load(db_session, key)
+        if row is not None and row.fingerprint != fingerprint:
+            self._release(key, entry)
+            self.conflicts += 1
+            return CustomJSONResponse(
+                content={},
+                message="Idempotency-Key was already used with a different request",
+                status_code=422,
+            )
+        if row is not None and row.status_code is None:
+            self.waits += 1
+        while row is not None and row.status_code is None and time.monotonic() < deadline:
+            time.sleep(IDEMPOTENCY_POLL_SECONDS)
+            row = _load(db_session, key)
+        if row is None or row.status_code is None:
+            self._release(key, entry)
+            return CustomJSONResponse(
+                content={},
+                message="A request with this Idempotency-Key is still in progress",
+                status_code=409,
+            )
+
+        with self._lock:
+            entry.body = row.body
+            entry.status_code = row.status_code
+            entry.media_type = row.media_type
+            entry.done.set()
+        self.replays += 1
+        self.remote_replays += 1
+        return entry.to_response()
+
+    def _complete(self, db_session: Session, key: Hashable, entry: _Entry) -> None:
+        # The response is already built; failing to store it only means other
+        # workers answer 409 until the row is taken over
+        try:
+            db_session.rollback()
+            db_session.execute(
+                update(idempotency_keys)
+                .where(*_row_filter(key), idempotency_keys.c.owner_pid == os.getpid())
+                .values(
+                    status_code=entry.status_code,
+                    media_type=entry.media_type,
+                    body=entry.body,
+                )
+            )
+            db_session.commit()
+        except Exception as e:
+            db_session.rollback()
+            print(f"Error storing idempotency key: {str(e)}")
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            in_flight = sum(not entry.done.is_set() for entry in self._entries.values())
+            return {
+                "keys": len(self._entries),
+                "in_flight": in_flight,
+                "max_keys": self.max_keys,
+                "executions": self.executions,
+                "replays": self.replays,
+                "waits": self.waits,
+                "conflicts": self.conflicts,
+                "evictions": self.evictions,
+                "remote_replays": self.remote_replays,
+                "takeovers": self.takeovers,
+            }
+
+
+def _process_alive(pid: Optional[int]) -> bool:
+    # Workers share one host (the SQLite file), so the pid can be checked
+    if pid is None:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _row_key(key: Hashable) -> Tuple[str, str]:
+    scope, idempotency_key = key
+    if isinstance(scope, tuple):
+        scope = ":".join(str(part) for part in scope)
+    return str(scope), idempotency_key
+
+
+def _row_filter(key: Hashable) -> tuple:
+    scope, idempotency_key = _row_key(key)
+    return (
+        idempotency_keys.c.scope == scope,
+        idempotency_keys.c.key == idempotency_key,
+    )
+
+
+def _load(db_session: Session, key: Hashable):
+    # A new transaction, so rows committed by other workers are visible
+    db_session.rollback()
+    return db_session.execute(
+        select(
+            idempotency_keys.c.fingerprint,
+            idempotency_keys.c.status_code,
+            idempotency_keys.c.media_type,
+            idempotency_keys.c.body,
+        ).where(*_row_filter(key))
+    ).first()
+
+
+# POST /api/product and POST /api/bulk-request responses, keyed by
+# (route, user id, Idempotency-Key)
+idempotency_store = IdempotencyStore(
+    name="idempotency",
+    max_keys=IDEMPOTENCY_MAX_KEYS,
+    ttl_seconds=IDEMPOTENCY_TTL_SECONDS,
+    wait_seconds=IDEMPOTENCY_WAIT_SECONDS,
+)
+register_metrics("idempotency", idempotency_store.stats)
+
+
+def prune_idempotency_keys(db_session: Session) -> int:
+    """
+    Delete the idempotency_key rows older than the store's TTL.
+    """
+    cutoff = datetime.now(timezone.utc) - timedelta(
+        seconds=idempotency_store.ttl_seconds
+    )
+    try:
+        removed = db_session.execute(
+            delete(idempotency_keys).where(idempotency_keys.c.created_at <= cutoff)
+        ).rowcount
+        db_session.commit()
+        return removed
+    except Exception:
+        db_session.rollback()
+        raise
+
+
+archive_scheduler.register("idempotency_keys", prune_idempotency_keys, [idempotency_keys])
+
+
+def idempotent(
+    scope: Hashable,
+    idempotency_key: Optional[str],
+    payload: bytes,
+    fn: Callable[[], Response],
+    db_session: Optional[Session] = None,
+) -> Response:
+    """
+    Run `fn` once per (scope, Idempotency-Key); without a key it just runs.
+    Pass the request's `db_session` so the key holds across workers.
+    """
+    if not idempotency_key:
+        return fn()
+    return idempotency_store.run((scope, idempotency_key), payload, fn, db_session)
@@ -0,0 +1,45 @@
+import hmac
+from typing import Callable, Dict, Optional
+
+from fastapi import Header, HTTPException, status
+
+from config import METRICS_TOKEN
+
+
+_providers: Dict[str, Callable[[], dict]] = {}
+
+
+def register_metrics(name: str, provider: Callable[[], dict]) -> None:
+    """
+    Register a callable returning a dict of counters under `name`.
+    Registering the same name again replaces the previous provider.
+    """
+    _providers[name] = provider
+
+
+def collect_metrics() -> dict:
+    """
+    Collect the current value of every registered metrics provider.
+    """
+    collected = {}
+    for name, provider in list(_providers.items()):
+        try:
+            collected[name] = provider()
+        except Exception as e:
+            print(f"Error collecting metrics for {name}: {str(e)}")
+            collected[name] = {"error": str(e)}
+    return collected
+
+
+def require_metrics_token(x_metrics_token: Optional[str] = Header(default=None)) -> None:
+    """
+    Guard for /api/metrics, which exposes internals (replica URLs, directories,
+    queue and job state). Without METRICS_TOKEN the endpoint does not exist;
+    otherwise the request must send it as X-Metrics-Token.
+    """
+    if not METRICS_TOKEN:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not Found")
+    if x_metrics_token is None or not hmac.compare_digest(x_metrics_token, METRICS_TOKEN):
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid metrics token"
+        )
@@ -0,0 +1,399 @@
+"""
+Batched data backfills for Alembic revisions.
+
+A single `UPDATE product SET ...` over a large table holds the SQLite write
+lock until every row is rewritten. A Backfill instead walks the table in
+primary key order and rewrites `batch_size` rows per transaction, sleeping
+between batches so the API's writers get the lock in between. Progress is
+stored in `backfill_progress` after every batch, so an interrupted backfill
+resumes where it stopped.
+
+In a revision:
+
+    from apps.common.migrations import Backfill, reset_backfill, run_backfill
+
+    product = sa.table(
+        "product", sa.column("id", sa.Integer), sa.column("created_at", sa.DateTime)
+    )
+    PRODUCT_TIMESTAMPS = Backfill(
+        "product_timestamps",
+        product,
+        values={"created_at": sa.func.datetime("now")},
+        where=product.c.created_at.is_(None),
+    )
+
+    def upgrade():
+        op.add_column(...)
+        run_backfill(PRODUCT_TIMESTAMPS)
+
+    def downgrade():
+        reset_backfill(PRODUCT_TIMESTAMPS)
+        op.drop_column(...)
+
+Give the columns in sa.table() their types so offline (--sql) mode can
+render the values.
+
+Values that need Python (e.g. geocoding) come from `compute` instead: it is
+called with every row of a batch and returns the values for that row, or
+None to leave it unchanged. Such backfills are skipped in offline mode.
+
+    BULK_REQUEST_GEOCODE = Backfill(
+        "bulk_request_geocode",
+        bulk_request,
+        compute=lambda row: {"delivery_lat": ..., "delivery_lon": ...},
+    )
+
+    python -m apps.common.migrations estimate <revision>
+    python -m apps.common.migrations status
+"""
+import argparse
+import importlib.util
+import time
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional
+
+from sqlalchemy import (
+    Column,
+    DateTime,
+    Integer,
+    MetaData,
+    String,
+    Table,
+    bindparam,
+    create_engine,
+    func,
+    insert,
+    inspect,
+    select,
+    update,
+)
+from sqlalchemy.engine import Connection, Row
+
+from config import BACKFILL_BATCH_SIZE, BACKFILL_DRY_RUN, BACKFILL_SLEEP_SECONDS
+
+# Kept out of Base.metadata: created on demand and ignored by autogenerate
+# (see include_object in alembic/env.py)
+progress_metadata = MetaData()
+backfill_progress = Table(
+    "backfill_progress",
+    progress_metadata,
+    Column("name", String(100), primary_key=True),
+    Column("last_key", Integer, nullable=True),
+    Column("rows_done", Integer, nullable=False, default=0),
+    Column("batches_done", Integer, nullable=False, default=0),
+    Column("started_at", DateTime(timezone=True), nullable=False),
+    Column("updated_at", DateTime(timezone=True), nullable=False),
+    Column("finished_at", DateTime(timezone=True), nullable=True),
+)
+
+
+class BackfillDryRun(RuntimeError):
+    """
+    Raised by run_backfill in dry-run mode so Alembic does not record the
+    revision as applied.
+    """
+
+
+class Backfill:
+    """
+    Rewrite `values` ({column name: value or SQL expression}) on the rows of
+    `table` matching `where`, in batches ordered by the integer column `key`.
+    With `compute` instead of `values`, each row of a batch gets the values
+    `compute(row)` returns (the same columns for every row), or is skipped
+    when it returns None. `name` identifies the progress record and must be
+    unique per backfill.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        table: Table,
+        values: Optional[Dict[str, Any]] = None,
+        where=None,
+        key: str = "id",
+        compute: Optional[Callable[[Row], Optional[Dict[str, Any]]]] = None,
+    ):
+        if (values is None) == (compute is None):
+            raise ValueError("Backfill needs either values or compute")
+        self.name = name
+        self.table = table
+        self.values = values
+        self.where = where
+        self.key = table.c[key]
+        self.compute = compute
+
+    def _conditions(self) -> list:
+        return [] if self.where is None else [self.where]
+
+    def _next_keys(self, connection: Connection, after: Optional[int], batch_size: int) -> List[int]:
+        stmt = select(self.key).where(*self._conditions())
+        if after is not None:
+            stmt = stmt.where(self.key > after)
+        return connection.execute(stmt.order_by(self.key).limit(batch_size)).scalars().all()
+
+    def _apply(self, connection: Connection, keys: List[int]) -> int:
+        # A key range plus the filter, so the batch is found through the
+        # primary key instead of a large IN list
+        batch = [self.key >= keys[0], self.key <= keys[-1], *self._conditions()]
+        if self.compute is not None:
+            return self._apply_computed(connection, batch)
+        stmt = update(self.table).where(*batch).values(self.values)
+        return connection.execute(stmt).rowcount
+
+    def _apply_computed(self, connection: Connection, batch: list) -> int:
+        params = []
+        for row in connection.execute(select(self.table).where(*batch)):
+            values = self.compute(row)
+            if values:
+                params.append(
+                    {"_key": row._mapping[self.key.name]}
+                    | {f"_{name}": value for name, value in values.items()}
+                )
+        if not params:
+            return 0
+        # Bind names are prefixed: SQLAlchemy reserves the column names
+        columns = [name[1:] for name in params[0] if name != "_key"]
+        stmt = (
+            update(self.table)
+            .where(self.key == bindparam("_key"))
+            .values({name: bindparam(f"_{name}") for name in columns})
+        )
+        return connection.execute(stmt, params).rowcount
+
+    def progress(self, connection: Connection) -> Optional[dict]:
+        """
+        The stored progress record, or None. Read-only: a database where no
+        backfill ever ran has no backfill_progress table.
+        """
+        if not inspect(connection).has_table(backfill_progress.name):
+            return None
+        row = connection.execute(
+            select(backfill_progress).where(backfill_progress.c.name == self.name)
+        ).mappings().first()
+        return dict(row) if row else None
+
+    def remaining(self, connection: Connection) -> int:
+        """
+        Rows still to be visited, counting from the stored position.
+        """
+        progress = self.progress(connection) or {}
+        stmt = select(func.count()).select_from(self.table).where(*self._conditions())
+        if progress.get("last_key") is not None:
+            stmt = stmt.where(self.key > progress["last_key"])
+        return connection.execute(stmt).scalar()
+
+    def run(
+        self,
+        connection: Connection,
+        batch_size: int = BACKFILL_BATCH_SIZE,
+        sleep_seconds: float = BACKFILL_SLEEP_SECONDS,
+        max_batches: Optional[int] = None,
+    ) -> dict:
+        """
+        Run (or resume) the backfill on `connection`, which must not be in a
+        transaction: each batch commits together with its progress record.
+        Stops early after `max_batches`. Returns the progress record.
+        """
+        with connection.begin():
+            progress_metadata.create_all(connection, checkfirst=True)
+            progress = self.progress(connection)
+            if progress is None:
+                now = datetime.now(timezone.utc)
+                connection.execute(
+                    insert(backfill_progress).values(
+                        name=self.name,
+                        rows_done=0,
+                        batches_done=0,
+                        started_at=now,
+                        updated_at=now,
+                    )
+                )
+                progress = self.progress(connection)
+        if progress["finished_at"] is not None:
+            print(f"Backfill {self.name} already finished.")
+            return progress
+
+        last_key = progress["last_key"]
+        batches = 0
+        started = time.perf_counter()
+        while max_batches is None or batches < max_batches:
+            with connection.begin():
+                keys = self._next_keys(connection, last_key, batch_size)
+                now = datetime.now(timezone.utc)
+                if not keys:
+                    connection.execute(
+                        update(backfill_progress)
+                        .where(backfill_progress.c.name == self.name)
+                        .values(updated_at=now, finished_at=now)
+                    )
+                    break
+                rows = self._apply(connection, keys)
+                last_key = keys[-1]
+                connection.execute(
+                    update(backfill_progress)
+                    .where(backfill_progress.c.name == self.name)
+                    .values(
+                        last_key=last_key,
+                        rows_done=backfill_progress.c.rows_done + rows,
+                        batches_done=backfill_progress.c.batches_done + 1,
+                        updated_at=now,
+                    )
+                )
+            batches += 1
+            print(f"Backfill {self.name}: batch {batches}, up to {self.key.name}={last_key}")
+            # A short batch was the last one; no need to yield the lock again
+            if len(keys) == batch_size and sleep_seconds > 0:
+                time.sleep(sleep_seconds)
+
+        with connection.begin():
+            progress = self.progress(connection)
+        print(
+            f"Backfill {self.name}: {progress['rows_done']} rows in "
+            f"{progress['batches_done']} batches "
+            f"({time.perf_counter() - started:.1f}s this run)"
+        )
+        return progress
+
+    def estimate(
+        self,
+        connection: Connection,
+        batch_size: int = BACKFILL_BATCH_SIZE,
+        sleep_seconds: float = BACKFILL_SLEEP_SECONDS,
+        sample_batches: int = 3,
+    ) -> dict:
+        """
+        Time up to `sample_batches` batches inside a transaction that is
+        rolled back, and extrapolate the duration of the remaining backfill.
+        No data changes.
+        """
+        remaining = self.remaining(connection)
+        batches = -(-remaining // batch_size)
+        transaction = connection.begin_nested() if connection.in_transaction() else connection.begin()
+        try:
+            last_key = (self.progress(connection) or {}).get("last_key")
+            timings = []
+            for _ in range(min(sample_batches, batches)):
+                keys = self._next_keys(connection, last_key, batch_size)
+                if not keys:
+                    break
+                start = time.perf_counter()
+                self._apply(connection, keys)
+                timings.append(time.perf_counter() - start)
+                last_key = keys[-1]
+        finally:
+            transaction.rollback()
+
+        seconds_per_batch = sum(timings) / len(timings) if timings else 0.0
+        return {
+            "name": self.name,
+            "rows": remaining,
+            "batches": batches,
+            "seconds_per_batch": round(seconds_per_batch, 4),
+            "estimated_seconds": round(
+                batches * seconds_per_batch + max(batches - 1, 0) * sleep_seconds, 1
+            ),
+        }
+
+
+def run_backfill(
+    backfill: Backfill,
+    batch_size: int = BACKFILL_BATCH_SIZE,
+    sleep_seconds: float = BACKFILL_SLEEP_SECONDS,
+    dry_run: bool = BACKFILL_DRY_RUN,
+) -> Optional[dict]:
+    """
+    Run `backfill` from an Alembic upgrade().
+
+    The revision's earlier operations are committed first and the batches run
+    on a separate connection, one transaction each. Offline (--sql) mode
+    emits a single UPDATE instead, or nothing for a `compute` backfill.
+    With BACKFILL_DRY_RUN=true the timing
+    estimate is printed and the upgrade is aborted with BackfillDryRun.
+    SQLite commits ALTER TABLE immediately, so do dry runs of upgrades against
+    a copy of the database; `python -m apps.common.migrations estimate` is
+    read-only.
+    """
+    from alembic import op
+
+    context = op.get_context()
+    if context.as_sql:
+        if backfill.compute is not None:
+            print(
+                f"Backfill {backfill.name} computes its values in Python and "
+                f"cannot be rendered as SQL; run the upgrade online to apply it."
+            )
+            return None
+        stmt = update(backfill.table).where(*backfill._conditions()).values(backfill.values)
+        op.execute(stmt)
+        return None
+
+    if dry_run:
+        estimate = backfill.estimate(op.get_bind(), batch_size, sleep_seconds)
+        print(f"Backfill estimate: {estimate}")
+        raise BackfillDryRun(f"Dry run of backfill {backfill.name}, nothing applied")
+
+    with context.autocommit_block():
+        with op.get_bind().engine.connect() as connection:
+            return backfill.run(connection, batch_size, sleep_seconds)
+
+
+def reset_backfill(backfill: Backfill) -> None:
+    """
+    Forget the progress of `backfill`, from the downgrade() of its revision,
+    so upgrading again reruns it.
+    """
+    from alembic import op
+
+    if op.get_context().as_sql:
+        return
+    connection = op.get_bind()
+    if inspect(connection).has_table(backfill_progress.name):
+        connection.execute(
+            backfill_progress.delete().where(backfill_progress.c.name == backfill.name)
+        )
+
+
+def _load_revision_backfills(revision: str) -> List[Backfill]:
+    from alembic.config import Config
+    from alembic.script import ScriptDirectory
+
+    # Revisions import apps.common.migrations, which is not this module's
+    # class when run with python -m
+    from apps.common.migrations import Backfill as RevisionBackfill
+
+    script = ScriptDirectory.from_config(Config("alembic.ini")).get_revision(revision)
+    spec = importlib.util.spec_from_file_location(f"revision_{script.revision}", script.path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return [value for value in vars(module).values() if isinstance(value, RevisionBackfill)]
+
+
+def main(argv=None) -> None:
+    from apps.common.database import DATABASE_URL
+
+    parser = argparse.ArgumentParser(description="Batched Alembic backfills")
+    parser.add_argument("--url", default=DATABASE_URL)
+    commands = parser.add_subparsers(dest="command", required=True)
+    estimate_parser = commands.add_parser("estimate", help="time the backfills of a revision")
+    estimate_parser.add_argument("revision")
+    estimate_parser.add_argument("--batch-size", type=int, default=BACKFILL_BATCH_SIZE)
+    estimate_parser.add_argument("--sleep", type=float, default=BACKFILL_SLEEP_SECONDS)
+    commands.add_parser("status", help="show stored backfill progress")
+    args = parser.parse_args(argv)
+
+    engine = create_engine(args.url)
+    with engine.connect() as connection:
+        if args.command == "status":
+            if not inspect(connection).has_table(backfill_progress.name):
+                print("No backfill has run on this database.")
+                return
+            for row in connection.execute(select(backfill_progress)).mappings():
+                print(dict(row))
+            connection.rollback()
+            return
+        for backfill in _load_revision_backfills(args.revision):
+            print(backfill.estimate(connection, args.batch_size, args.sleep))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,38 @@
 from datetime import datetime, timezone
-from sqlalchemy import DateTime, func
+from typing import Optional
+from sqlalchemy import DateTime, Integer, LargeBinary, String, func
 from sqlalchemy.orm import Mapped
 from sqlalchemy.orm import mapped_column
 from apps.common.database import Base
 
 class BaseDatabaseModel(Base):
-    __abstract__ = True
\ No newline at end of file
+    __abstract__ = True
+
+
+class IdempotencyKey(BaseDatabaseModel):
+    """
+    Idempotency-Key values seen by any worker (see apps/common/idempotency.py).
+    A row with no status_code is held by the request still running, which
+    renews heartbeat_at; once it completes, the response it produced is kept
+    for replays.
+    """
+
+    __tablename__ = "idempotency_key"
+
+    scope: Mapped[str] = mapped_column(String(100), primary_key=True)
+    key: Mapped[str] = mapped_column(String(255), primary_key=True)
+    fingerprint: Mapped[str] = mapped_column(String(64), nullable=False)
+    status_code: Mapped[Optional[int]] = mapped_column(Integer, nullable=True)
+    media_type: Mapped[Optional[str]] = mapped_column(String(100), nullable=True)
+    body: Mapped[Optional[bytes]] = mapped_column(LargeBinary, nullable=True)
+    # Process holding the key while it runs, and when it last renewed its lease
+    owner_pid: Mapped[Optional[int]] = mapped_column(Integer, nullable=True)
+    heartbeat_at: Mapped[Optional[datetime]] = mapped_column(
+        DateTime(timezone=True), nullable=True
+    )
+    created_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True),
+        default=lambda: datetime.now(timezone.utc),
+        nullable=False,
+        index=True,
+    )
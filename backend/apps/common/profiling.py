@@ -0,0 +1,336 @@
+import contextvars
+import functools
+import hmac
+import inspect
+import json
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Set
+
+from fastapi.routing import APIRoute
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import Headers, MutableHeaders
+
+from apps.common.metrics import register_metrics
+from config import (
+    PROFILING_DIR,
+    PROFILING_INTERVAL_MS,
+    PROFILING_MAX_PROFILES,
+    PROFILING_SAMPLE_RATE,
+    PROFILING_TOKEN,
+)
+
+PROFILE_HEADER = "X-Profile"
+PROFILE_ID_HEADER = "X-Profile-Id"
+# Most SQL statements kept per profile
+MAX_STATEMENTS = 500
+
+_current_profile: contextvars.ContextVar[Optional["RequestProfile"]] = contextvars.ContextVar(
+    "current_profile", default=None
+)
+
+
+class RequestProfile:
+    """
+    Stack samples and SQL statements of one profiled request.
+
+    Samples are kept as collapsed stacks ("root;caller;callee" -> count),
+    the input format of flamegraph.pl and speedscope. While a statement is
+    running, samples get a "[sql] ..." leaf frame so database time shows up
+    per statement in the flame graph.
+    """
+
+    def __init__(self, method: str, path: str, query_string: str, reason: str):
+        self.id = uuid.uuid4().hex[:12]
+        self.method = method
+        self.path = path
+        self.query_string = query_string
+        self.reason = reason
+        self.route: Optional[str] = None
+        self.status_code: Optional[int] = None
+        self.started_at = time.perf_counter()
+        self.duration_ms: Optional[float] = None
+        self.threads: Set[int] = set()
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self.statements: List[dict] = []
+        self.running_sql: Dict[int, str] = {}
+
+    def record(self, thread_id: int, frame) -> None:
+        names = []
+        while frame is not None:
+            code = frame.f_code
+            names.append(f"{code.co_name} ({code.co_filename}:{code.co_firstlineno})")
+            frame = frame.f_back
+        names.reverse()
+        sql = self.running_sql.get(thread_id)
+        if sql is not None:
+            names.append(f"[sql] {sql}")
+        self.stacks[";".join(names)] += 1
+        self.samples += 1
+
+    def statement_started(self, thread_id: int, statement: str) -> None:
+        self.running_sql[thread_id] = " ".join(statement.split())[:120]
+
+    def statement_finished(
+        self, thread_id: int, statement: str, seconds: float, error: Optional[str] = None
+    ) -> None:
+        self.running_sql.pop(thread_id, None)
+        if len(self.statements) < MAX_STATEMENTS:
+            entry = {"statement": " ".join(statement.split()), "ms": round(seconds * 1000, 3)}
+            if error is not None:
+                entry["error"] = error
+            self.statements.append(entry)
+
+    def metadata(self) -> dict:
+        return {
+            "id": self.id,
+            "reason": self.reason,
+            "method": self.method,
+            "path": self.path,
+            "route": self.route,
+            "query_params": self.query_string,
+            "status_code": self.status_code,
+            "duration_ms": self.duration_ms,
+            "interval_ms": PROFILING_INTERVAL_MS,
+            "samples": self.samples,
+            "sql_ms": round(sum(s["ms"] for s in self.statements), 3),
+            "sql": self.statements,
+        }
+
+
+class _Sampler:
+    """
+    One daemon thread sampling the stacks of every thread registered by an
+    active profile, running only while at least one profile is active.
+    """
+
+    def __init__(self, interval_seconds: float):
+        self.interval_seconds = interval_seconds
+        self._profiles: Set[RequestProfile] = set()
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    def add(self, profile: RequestProfile) -> None:
+        with self._lock:
+            self._profiles.add(profile)
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name="request-profiler", daemon=True
+                )
+                self._thread.start()
+
+    def remove(self, profile: RequestProfile) -> None:
+        with self._lock:
+            self._profiles.discard(profile)
+
+    def _run(self) -> None:
+        while True:
+            with self._lock:
+                if not self._profiles:
+                    self._thread = None
+                    return
+                profiles = list(self._profiles)
+            frames = sys._current_frames()
+            for profile in profiles:
+                for thread_id in list(profile.threads):
+                    frame = frames.get(thread_id)
+                    if frame is not None:
+                        profile.record(thread_id, frame)
+            del frames
+            time.sleep(self.interval_seconds)
+
+
+_sampler = _Sampler(PROFILING_INTERVAL_MS / 1000)
+
+
+class ProfiledRoute(APIRoute):
+    """
+    APIRoute whose endpoint registers the thread it runs on (the threadpool
+    thread of a sync endpoint, the event loop for an async one) with the
+    request's profile, so the sampler knows which stacks to take.
+    """
+
+    def __init__(self, path: str, endpoint, **kwargs):
+        # include_router builds new routes from already wrapped endpoints
+        endpoint = getattr(endpoint, "unprofiled", endpoint)
+        route_path = path
+
+        if inspect.iscoroutinefunction(endpoint):
+
+            @functools.wraps(endpoint)
+            async def profiled_endpoint(*args, **kwargs):
+                with _profiled_thread(route_path):
+                    return await endpoint(*args, **kwargs)
+
+        else:
+
+            @functools.wraps(endpoint)
+            def profiled_endpoint(*args, **kwargs):
+                with _profiled_thread(route_path):
+                    return endpoint(*args, **kwargs)
+
+        profiled_endpoint.unprofiled = endpoint
+        super().__init__(path, profiled_endpoint, **kwargs)
+
+
+@contextmanager
+def _profiled_thread(route_path: str):
+    profile = _current_profile.get()
+    if profile is None:
+        yield
+        return
+    profile.route = route_path
+    thread_id = threading.get_ident()
+    profile.threads.add(thread_id)
+    try:
+        yield
+    finally:
+        profile.threads.discard(thread_id)
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    profile = _current_profile.get()
+    if profile is not None:
+        conn.info.setdefault("profile_started", []).append(time.perf_counter())
+        profile.statement_started(threading.get_ident(), statement)
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    profile = _current_profile.get()
+    started = conn.info.get("profile_started")
+    if profile is not None and started:
+        profile.statement_finished(
+            threading.get_ident(), statement, time.perf_counter() - started.pop()
+        )
+
+
+@event.listens_for(Engine, "handle_error")
+def _handle_error(context):
+    # Failed statements never reach after_cursor_execute
+    profile = _current_profile.get()
+    conn = context.connection
+    started = conn.info.get("profile_started") if conn is not None else None
+    if profile is not None and started:
+        profile.statement_finished(
+            threading.get_ident(),
+            context.statement or "",
+            time.perf_counter() - started.pop(),
+            error=type(context.original_exception).__name__,
+        )
+
+
+class ProfilingMiddleware:
+    """
+    ASGI middleware profiling requests that carry `X-Profile: <PROFILING_TOKEN>`
+    or are picked at PROFILING_SAMPLE_RATE. Each profile is written to
+    PROFILING_DIR as <id>.folded (collapsed stacks for flamegraph.pl or
+    speedscope) and <id>.json (route, query params, status, timings and the
+    SQL statements run), and the response carries X-Profile-Id. Only the
+    newest PROFILING_MAX_PROFILES profiles are kept.
+
+    SQL parameters are not recorded, only the statements.
+    """
+
+    def __init__(
+        self,
+        app,
+        directory: str = PROFILING_DIR,
+        token: Optional[str] = PROFILING_TOKEN,
+        sample_rate: float = PROFILING_SAMPLE_RATE,
+        max_profiles: int = PROFILING_MAX_PROFILES,
+    ):
+        self.app = app
+        self.directory = directory
+        self.token = token
+        self.sample_rate = sample_rate
+        self.max_profiles = max_profiles
+        self.profiled = 0
+        self.rejected_tokens = 0
+        register_metrics("profiling", self.stats)
+
+    def _reason(self, scope) -> Optional[str]:
+        requested = Headers(scope=scope).get(PROFILE_HEADER)
+        if requested is not None:
+            if self.token and hmac.compare_digest(requested, self.token):
+                return "header"
+            self.rejected_tokens += 1
+        if self.sample_rate > 0 and random.random() < self.sample_rate:
+            return "sampled"
+        return None
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        reason = self._reason(scope)
+        if reason is None:
+            await self.app(scope, receive, send)
+            return
+
+        profile = RequestProfile(
+            scope["method"],
+            scope["path"],
+            scope.get("query_string", b"").decode("latin-1"),
+            reason,
+        )
+
+        async def send_with_profile_id(message):
+            if message["type"] == "http.response.start":
+                profile.status_code = message["status"]
+                MutableHeaders(scope=message).append(PROFILE_ID_HEADER, profile.id)
+            await send(message)
+
+        token = _current_profile.set(profile)
+        _sampler.add(profile)
+        try:
+            await self.app(scope, receive, send_with_profile_id)
+        finally:
+            _sampler.remove(profile)
+            _current_profile.reset(token)
+            profile.duration_ms = round((time.perf_counter() - profile.started_at) * 1000, 3)
+            self.profiled += 1
+            try:
+                await run_in_threadpool(self._write, profile)
+            except Exception as e:
+                print(f"Error writing request profile: {str(e)}")
+
+    def _write(self, profile: RequestProfile) -> None:
+        os.makedirs(self.directory, exist_ok=True)
+        stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S")
+        base = os.path.join(self.directory, f"{stamp}-{profile.id}")
+        with open(f"{base}.folded", "w") as folded:
+            for stack, count in profile.stacks.most_common():
+                folded.write(f"{stack} {count}\n")
+        with open(f"{base}.json", "w") as metadata:
+            json.dump(profile.metadata(), metadata, indent=2)
+        self._prune()
+
+    def _prune(self) -> None:
+        profiles = sorted(
+            name for name in os.listdir(self.directory) if name.endswith(".json")
+        )
+        for name in profiles[: max(0, len(profiles) - self.max_profiles)]:
+            for suffix in (".json", ".folded"):
+                path = os.path.join(self.directory, name[: -len(".json")] + suffix)
+                if os.path.exists(path):
+                    os.remove(path)
+
+    def stats(self) -> dict:
+        return {
+            "profiled": self.profiled,
+            "rejected_tokens": self.rejected_tokens,
+            "sample_rate": self.sample_rate,
+            "directory": self.directory,
+        }
@@ -0,0 +1,210 @@
+import itertools
+import sqlite3
+import threading
+import time
+from typing import List, Optional
+
+from fastapi import Depends, HTTPException, Request
+from sqlalchemy import create_engine, text
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.orm import Session, sessionmaker
+
+from apps.common.database import get_db
+from apps.common.metrics import register_metrics
+from apps.common.shared_state import shared_deadlines
+from apps.user.services import verify_token
+from config import (
+    READ_REPLICA_URLS,
+    REPLICA_HEALTH_CHECK_SECONDS,
+    READ_YOUR_WRITES_SECONDS,
+)
+
+
+class _Replica:
+    def __init__(self, url: str):
+        self.url = url
+        connect_args = {}
+        if url.startswith("sqlite"):
+            connect_args["check_same_thread"] = False
+        self.engine = create_engine(url, connect_args=connect_args)
+        self.session_factory = sessionmaker(
+            autocommit=False, autoflush=False, bind=self.engine
+        )
+        self.healthy = True
+        self.checked_at = 0.0
+        self.sessions = 0
+
+
+class ReplicaPool:
+    """
+    Round-robin pool of read-only database replicas.
+
+    A replica's health is re-checked with `SELECT 1` at most once every
+    `health_check_seconds`, when it comes up in the rotation. Unhealthy
+    replicas are skipped; if none is usable, callers fall back to the primary.
+    """
+
+    def __init__(self, urls: List[str], health_check_seconds: float = 10.0):
+        self.replicas = [_Replica(url) for url in urls]
+        self.health_check_seconds = health_check_seconds
+        self._cursor = itertools.count()
+        self._lock = threading.Lock()
+        self.fallbacks = 0
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.replicas)
+
+    def session(self) -> Optional[Session]:
+        """
+        Open a session on the next healthy replica, or return None.
+        """
+        for _ in range(len(self.replicas)):
+            with self._lock:
+                replica = self.replicas[next(self._cursor) % len(self.replicas)]
+            if self._is_healthy(replica):
+                replica.sessions += 1
+                return replica.session_factory()
+        self.fallbacks += 1
+        return None
+
+    def _is_healthy(self, replica: _Replica) -> bool:
+        now = time.monotonic()
+        if now - replica.checked_at < self.health_check_seconds:
+            return replica.healthy
+        replica.checked_at = now
+        try:
+            with replica.engine.connect() as connection:
+                connection.execute(text("SELECT 1"))
+            replica.healthy = True
+        except Exception as e:
+            print(f"Read replica {replica.url} failed health check: {str(e)}")
+            replica.healthy = False
+        return replica.healthy
+
+    def stats(self) -> dict:
+        return {
+            "replicas": [
+                {
+                    "url": make_url(replica.url).render_as_string(hide_password=True),
+                    "healthy": replica.healthy,
+                    "sessions": replica.sessions,
+                }
+                for replica in self.replicas
+            ],
+            "fallbacks": self.fallbacks,
+            "recent_writers": shared_deadlines.active(time.monotonic()),
+        }
+
+
+replica_pool = ReplicaPool(READ_REPLICA_URLS, REPLICA_HEALTH_CHECK_SECONDS)
+register_metrics("read_replicas", lambda: replica_pool.stats())
+
+
+def configure_replicas(urls: List[str], health_check_seconds: float = 10.0) -> ReplicaPool:
+    """
+    Replace the replica pool, e.g. from tests or a launcher.
+    """
+    global replica_pool
+    replica_pool = ReplicaPool(urls, health_check_seconds)
+    return replica_pool
+
+
+def record_write(user_id: Optional[int]) -> None:
+    """
+    Send this user's reads to the primary for READ_YOUR_WRITES_SECONDS so
+    they see their own changes before the replicas catch up. The deadline is
+    kept in shared state, so it holds whichever worker serves the next read.
+    """
+    if user_id is None or not replica_pool.enabled or READ_YOUR_WRITES_SECONDS <= 0:
+        return
+    shared_deadlines.extend(user_id, time.monotonic() + READ_YOUR_WRITES_SECONDS)
+
+
+def _reads_own_writes(request: Request) -> bool:
+    authorization = request.headers.get("authorization", "")
+    scheme, _, token = authorization.partition(" ")
+    if scheme.lower() != "bearer" or not token:
+        return False
+    try:
+        user_id = verify_token(token).user_id
+    except HTTPException:
+        return False
+    return shared_deadlines.is_active(user_id, time.monotonic())
+
+
+def get_read_db(request: Request, db: Session = Depends(get_db)):
+    """
+    Session dependency for read-only routes. Uses a replica when one is
+    configured and healthy, the primary session otherwise or when the caller
+    wrote recently.
+    """
+    if not replica_pool.enabled or _reads_own_writes(request):
+        yield db
+        return
+
+    replica_session = replica_pool.session()
+    if replica_session is None:
+        yield db
+        return
+    replica_session.info["primary"] = db
+    try:
+        yield replica_session
+    finally:
+        replica_session.close()
+
+
+def primary_session(session):
+    """
+    The primary session behind a session from get_read_db: the session itself
+    unless it is a replica session.
+    """
+    if isinstance(session, Session):
+        return session.info.get("primary", session)
+    return session
+
+
+def refresh_sqlite_replica(source_engine: Engine, replica_path: str) -> None:
+    """
+    Copy a SQLite primary into a replica file with the online backup API.
+    Meant for local testing of replica routing.
+    """
+    source = source_engine.raw_connection()
+    try:
+        target = sqlite3.connect(replica_path)
+        try:
+            source.driver_connection.backup(target)
+        finally:
+            target.close()
+    finally:
+        source.close()
+
+
+def start_sqlite_replica_refresher(
+    source_engine: Engine, interval_seconds: float
+) -> Optional[threading.Thread]:
+    """
+    Periodically refresh every file-based SQLite replica from the primary.
+    """
+    paths = [
+        make_url(replica.url).database
+        for replica in replica_pool.replicas
+        if replica.url.startswith("sqlite") and make_url(replica.url).database
+    ]
+    if not paths or interval_seconds <= 0:
+        return None
+
+    def refresh_forever():
+        while True:
+            for path in paths:
+                try:
+                    refresh_sqlite_replica(source_engine, path)
+                except Exception as e:
+                    print(f"Error refreshing SQLite replica {path}: {str(e)}")
+            time.sleep(interval_seconds)
+
+    thread = threading.Thread(
+        target=refresh_forever, name="sqlite-replica-refresher", daemon=True
+    )
+    thread.start()
+    return thread
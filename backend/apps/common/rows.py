@@ -0,0 +1,23 @@
+import enum
+from datetime import date, datetime
+from typing import Any, Iterable, List
+
+
+def to_json_value(value: Any) -> Any:
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, enum.Enum):
+        return value.value
+    return value
+
+
+def serialize_row(row) -> dict:
+    """
+    Turn a row DTO (a NamedTuple) or a Core RowMapping into a JSON-ready dict.
+    """
+    items = row._asdict().items() if hasattr(row, "_asdict") else row.items()
+    return {key: to_json_value(value) for key, value in items}
+
+
+def serialize_rows(rows: Iterable) -> List[dict]:
+    return [serialize_row(row) for row in rows]
@@ -0,0 +1,185 @@
+import fcntl
+import mmap
+import os
+import struct
+import threading
+import zlib
+from typing import Callable, Optional
+
+from apps.common.metrics import register_metrics
+from config import SHARED_STATE_PATH
+
+
+def _aligned(offset: int) -> int:
+    """
+    Round `offset` up to a valid mmap offset.
+    """
+    granularity = mmap.ALLOCATIONGRANULARITY
+    return -(-offset // granularity) * granularity
+
+
+class _SharedSlots:
+    """
+    Fixed-size table of `SLOTS` packed values. Without a backing file it is a
+    process-local list; with one (set up by the multi-worker launcher before
+    forking) it is a memory-mapped region of that file, at byte `OFFSET`,
+    shared by every worker. Writes take an flock on the file.
+    """
+
+    SLOTS = 1024
+    SLOT = struct.Struct("q")
+    # Byte offset of the table in the file, a multiple of
+    # mmap.ALLOCATIONGRANULARITY (see _aligned)
+    OFFSET = 0
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = None
+        self._map = None
+        self._local = [self.SLOT.unpack(bytes(self.SLOT.size))[0]] * self.SLOTS
+        if path:
+            self._open()
+            # flock() locks belong to the open file, which a forked child
+            # shares with its parent, so every process opens its own.
+            os.register_at_fork(after_in_child=self._reopen)
+
+    def _open(self) -> None:
+        self._file = open(self.path, "a+b")
+        size = self.SLOTS * self.SLOT.size
+        if os.fstat(self._file.fileno()).st_size < self.OFFSET + size:
+            self._file.truncate(self.OFFSET + size)
+        self._map = mmap.mmap(self._file.fileno(), size, offset=self.OFFSET)
+
+    def _reopen(self) -> None:
+        self._lock = threading.Lock()
+        self._map.close()
+        self._file.close()
+        self._open()
+
+    @property
+    def is_shared(self) -> bool:
+        return self._map is not None
+
+    def _read(self, slot: int):
+        if self._map is None:
+            return self._local[slot]
+        return self.SLOT.unpack_from(self._map, slot * self.SLOT.size)[0]
+
+    def _update(self, slot: int, fn):
+        """
+        Store fn(current value) in `slot` and return it, atomically across
+        workers.
+        """
+        with self._lock:
+            if self._map is None:
+                self._local[slot] = fn(self._local[slot])
+                return self._local[slot]
+            offset = slot * self.SLOT.size
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_EX)
+            try:
+                value = fn(self.SLOT.unpack_from(self._map, offset)[0])
+                self.SLOT.pack_into(self._map, offset, value)
+            finally:
+                fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+            return value
+
+
+class SharedVersions(_SharedSlots):
+    """
+    Named version counters used to invalidate process-local caches.
+
+    Under the multi-worker launcher the counters are shared by every worker,
+    so a bump in one worker is seen by the next read in all of them. Names
+    are hashed onto a fixed number of 8-byte slots; a collision only causes
+    an extra invalidation.
+    """
+
+    def _slot(self, name: str) -> int:
+        return zlib.crc32(name.encode()) % self.SLOTS
+
+    def get(self, name: str) -> int:
+        return self._read(self._slot(name))
+
+    def bump(self, name: str) -> int:
+        return self._update(self._slot(name), lambda version: version + 1)
+
+
+class SharedDeadlines(_SharedSlots):
+    """
+    time.monotonic() deadlines per integer key (e.g. a user id), stored after
+    the version counters in the same file. CLOCK_MONOTONIC is system-wide, so
+    a deadline set by one worker means the same instant in the others. Keys
+    are hashed onto the slots; a collision only extends another key's
+    deadline.
+    """
+
+    SLOTS = 4096
+    SLOT = struct.Struct("d")
+    OFFSET = _aligned(SharedVersions.SLOTS * SharedVersions.SLOT.size)
+
+    def _slot(self, key: int) -> int:
+        return zlib.crc32(str(key).encode()) % self.SLOTS
+
+    def extend(self, key: int, deadline: float) -> float:
+        """
+        Move the deadline of `key` to `deadline`, unless it is already later.
+        """
+        return self._update(self._slot(key), lambda current: max(current, deadline))
+
+    def is_active(self, key: int, now: float) -> bool:
+        return self._read(self._slot(key)) > now
+
+    def active(self, now: float) -> int:
+        """
+        Number of slots whose deadline has not passed.
+        """
+        return sum(self._read(slot) > now for slot in range(self.SLOTS))
+
+
+class LeaderLock:
+    """
+    Elects the one worker that runs the periodic background jobs (archiving,
+    similar products, replica refresh), so N workers do not run N copies.
+
+    Every worker waits on an flock of the lock file on a daemon thread; the
+    holder runs the jobs until it exits, then the kernel releases the lock
+    and a waiting worker takes over. Without a lock file (a single process)
+    the caller leads right away.
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path
+        self.is_leader = False
+        self._file = None
+
+    def run_when_leader(self, start: Callable[[], None]) -> Optional[threading.Thread]:
+        """
+        Call `start` once this process holds the lock.
+        """
+        if not self.path:
+            self.is_leader = True
+            start()
+            return None
+
+        def wait():
+            file = open(self.path, "a+b")
+            fcntl.flock(file.fileno(), fcntl.LOCK_EX)
+            # Kept open, and so locked, for the rest of the process
+            self._file = file
+            self.is_leader = True
+            print(f"Worker {os.getpid()} runs the background jobs")
+            start()
+
+        thread = threading.Thread(target=wait, name="leader-election", daemon=True)
+        thread.start()
+        return thread
+
+    def stats(self) -> dict:
+        return {"pid": os.getpid(), "is_leader": self.is_leader}
+
+
+shared_versions = SharedVersions(SHARED_STATE_PATH)
+shared_deadlines = SharedDeadlines(SHARED_STATE_PATH)
+leader_lock = LeaderLock(f"{SHARED_STATE_PATH}.leader" if SHARED_STATE_PATH else None)
+register_metrics("background_jobs", leader_lock.stats)
@@ -0,0 +1,132 @@
+import asyncio
+import threading
+from typing import Any, Callable, Dict, Hashable, List, Tuple
+
+from starlette.concurrency import run_in_threadpool
+
+
+class _Call:
+    """
+    One in-flight execution shared by every caller with the same key.
+    """
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result: Any = None
+        self.error: BaseException | None = None
+        self.async_waiters: List[Tuple[asyncio.AbstractEventLoop, asyncio.Future]] = []
+
+    def outcome(self):
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+class SingleFlight:
+    """
+    Collapse concurrent calls with the same key into a single execution.
+
+    The first caller for a key runs the function; callers arriving while it
+    is still running wait for it and receive the same result (or exception).
+    Nothing is cached: once the call finishes the next caller runs it again.
+
+    Sync callers (threadpool routes) block on a threading.Event, async
+    callers await a future resolved from whichever thread finishes the call.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._calls: Dict[Hashable, _Call] = {}
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.executions = 0
+        self.collapsed = 0
+
+    def _join(self, key: Hashable) -> Tuple[_Call, bool]:
+        """
+        Return the in-flight call for `key` and whether the caller leads it.
+        Must be called with the lock held.
+        """
+        self.calls += 1
+        call = self._calls.get(key)
+        if call is not None:
+            self.collapsed += 1
+            return call, False
+        call = _Call()
+        self._calls[key] = call
+        self.executions += 1
+        return call, True
+
+    def _finish(self, key: Hashable, call: _Call, result=None, error=None) -> None:
+        with self._lock:
+            self._calls.pop(key, None)
+            call.result = result
+            call.error = error
+            call.event.set()
+            waiters, call.async_waiters = call.async_waiters, []
+        for loop, future in waiters:
+            loop.call_soon_threadsafe(_resolve_future, future, result, error)
+
+    def do(self, key: Hashable, fn: Callable, *args, **kwargs):
+        """
+        Run `fn(*args, **kwargs)` unless an identical call is already in
+        flight, in which case wait for it and return its result.
+        """
+        with self._lock:
+            call, is_leader = self._join(key)
+
+        if not is_leader:
+            call.event.wait()
+            return call.outcome()
+
+        try:
+            result = fn(*args, **kwargs)
+        except BaseException as e:
+            self._finish(key, call, error=e)
+            raise
+        self._finish(key, call, result=result)
+        return result
+
+    async def do_async(self, key: Hashable, fn: Callable, *args, **kwargs):
+        """
+        Async counterpart of `do`. Coroutine functions are awaited directly,
+        plain functions run in the threadpool. Waiting never blocks a thread.
+        """
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            call, is_leader = self._join(key)
+            if not is_leader:
+                future = loop.create_future()
+                call.async_waiters.append((loop, future))
+
+        if not is_leader:
+            return await future
+
+        try:
+            if asyncio.iscoroutinefunction(fn):
+                result = await fn(*args, **kwargs)
+            else:
+                result = await run_in_threadpool(fn, *args, **kwargs)
+        except BaseException as e:
+            self._finish(key, call, error=e)
+            raise
+        self._finish(key, call, result=result)
+        return result
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "executions": self.executions,
+                "collapsed": self.collapsed,
+                "in_flight": len(self._calls),
+            }
+
+
+def _resolve_future(future: asyncio.Future, result, error) -> None:
+    if future.done():
+        return
+    if error is not None:
+        future.set_exception(error)
+    else:
+        future.set_result(result)
@@ -0,0 +1,64 @@
+import time
+from contextlib import contextmanager
+from typing import List, Optional, Tuple
+
+
+class StartupProfiler:
+    """
+    Records how long each startup phase (module imports, engine and crypto
+    initialization, warm-up) takes, when the app became ready and when the
+    first request arrived. All times are relative to the profiler's creation.
+    """
+
+    def __init__(self):
+        self.started_at = time.perf_counter()
+        self.phases: List[Tuple[str, float]] = []
+        self.ready_at: Optional[float] = None
+        self.first_request_at: Optional[float] = None
+
+    @contextmanager
+    def phase(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases.append((name, time.perf_counter() - start))
+
+    @property
+    def is_ready(self) -> bool:
+        return self.ready_at is not None
+
+    def mark_ready(self) -> None:
+        self.ready_at = time.perf_counter()
+
+    def mark_first_request(self) -> None:
+        if self.first_request_at is None:
+            self.first_request_at = time.perf_counter()
+
+    def report(self) -> dict:
+        def since_start(moment: Optional[float]) -> Optional[float]:
+            if moment is None:
+                return None
+            return round((moment - self.started_at) * 1000, 2)
+
+        return {
+            "phases_ms": {name: round(seconds * 1000, 2) for name, seconds in self.phases},
+            "ready_ms": since_start(self.ready_at),
+            "first_request_ms": since_start(self.first_request_at),
+        }
+
+
+class FirstRequestTimer:
+    """
+    ASGI middleware recording the arrival of the first HTTP request.
+    """
+
+    def __init__(self, app, profiler: StartupProfiler):
+        self.app = app
+        self.profiler = profiler
+
+    async def __call__(self, scope, receive, send):
+        if self.profiler.first_request_at is None and scope["type"] == "http":
+            self.profiler.mark_first_request()
+            print(f"Startup report: {self.profiler.report()}")
+        await self.app(scope, receive, send)
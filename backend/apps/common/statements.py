@@ -0,0 +1,65 @@
+import json
+from typing import Any, Dict, Sequence, Tuple
+
+from sqlalchemy import bindparam, func, select
+from sqlalchemy.sql.elements import ColumnElement
+
+
+class FilterSet:
+    """
+    A fixed, ordered list of optional WHERE clauses written against bound
+    parameters (`bindparam(name)`).
+
+    The filters given for a call are reduced to a bitmask ("shape") and a
+    parameter dict. A filter bound to several parameters takes a dict of them
+    as its value. Listing builders cache one statement per shape, so the
+    select() is built and compiled once per filter combination and each call
+    only binds new values.
+    """
+
+    def __init__(self, filters: Sequence[Tuple[str, ColumnElement]]):
+        if len(filters) > 62:
+            raise ValueError("Too many filters for a shape bitmask")
+        self.filters = list(filters)
+
+    def shape(self, values: Dict[str, Any]) -> Tuple[int, Dict[str, Any]]:
+        """
+        Return the shape of the non-None `values` and their bound parameters.
+        """
+        shape = 0
+        params = {}
+        for bit, (name, _) in enumerate(self.filters):
+            value = values.get(name)
+            if value is not None:
+                shape |= 1 << bit
+                if isinstance(value, dict):
+                    params.update(value)
+                else:
+                    params[name] = value
+        return shape, params
+
+    def apply(self, stmt, shape: int):
+        """
+        Add the WHERE clauses of `shape` to a select().
+        """
+        for bit, (_, clause) in enumerate(self.filters):
+            if shape & (1 << bit):
+                stmt = stmt.where(clause)
+        return stmt
+
+
+def in_id_list(column, name: str) -> ColumnElement:
+    """
+    `column IN` the ids bound to `name` (see `id_list`) through SQLite's
+    json_each, so a list of any length is a single bound parameter: it never
+    hits the bound-parameter limit and the statement stays the same.
+    """
+    ids = func.json_each(bindparam(name)).table_valued("value")
+    return column.in_(select(ids.c.value))
+
+
+def id_list(ids: Sequence[int]) -> str:
+    """
+    Bound value of an `in_id_list` parameter.
+    """
+    return json.dumps(list(ids))
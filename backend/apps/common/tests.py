@@ -0,0 +1,984 @@
+import asyncio
+import json
+import mmap
+import os
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+
+import httpx
+import pytest
+import sqlalchemy as sa
+from fastapi import APIRouter, Depends, FastAPI
+from fastapi.responses import Response
+from fastapi.testclient import TestClient
+from sqlalchemy.orm import sessionmaker
+
+from apps.common.cache import ResponseCache
+from apps.common.database import LazySession, get_db
+from apps.common.fieldsets import parse_fieldset
+from apps.common.idempotency import IdempotencyStore, idempotency_keys
+from apps.common.geo import Gazetteer, bounding_box, distance_km
+from apps.common.migrations import Backfill
+from apps.common.profiling import ProfiledRoute, ProfilingMiddleware
+from apps.common.rows import serialize_row
+from apps.common.rate_limit import RateLimitMiddleware, TokenBucketStore
+from apps.common.replicas import ReplicaPool
+from apps.common.shared_state import LeaderLock, SharedDeadlines, SharedVersions
+from apps.common.singleflight import SingleFlight
+from apps.common.writer import WriteCoordinator, WriteTimeout, execute_write
+
+
+def make_response(size: int) -> Response:
+    return Response(content=b"x" * size, media_type="application/json")
+
+
+class TestResponseCache:
+    """Test the shared response cache."""
+
+    def test_hit_after_set(self):
+        cache = ResponseCache("test", max_bytes=1024, ttl_seconds=60)
+        assert cache.get("a") is None
+        cache.set("a", make_response(10), cache.version)
+
+        entry, is_stale = cache.get("a")
+        assert not is_stale
+        assert entry.body == b"x" * 10
+        assert cache.stats()["hits"] == 1
+        assert cache.stats()["misses"] == 1
+
+    def test_lru_eviction_by_size(self):
+        cache = ResponseCache("test", max_bytes=100, ttl_seconds=60)
+        cache.set("a", make_response(40), cache.version)
+        cache.set("b", make_response(40), cache.version)
+        # Touch "a" so "b" becomes the least recently used entry
+        assert cache.get("a") is not None
+        cache.set("c", make_response(40), cache.version)
+
+        assert cache.get("b") is None
+        assert cache.get("a") is not None
+        assert cache.get("c") is not None
+        assert cache.stats()["bytes"] <= 100
+        assert cache.stats()["evictions"] == 1
+
+    def test_invalidate_bumps_version(self):
+        cache = ResponseCache("test", max_bytes=1024, ttl_seconds=60)
+        version = cache.version
+        cache.set("a", make_response(10), version)
+        cache.invalidate()
+
+        assert cache.get("a") is None
+        # A load that started before the invalidation must not be stored
+        assert cache.set("a", make_response(10), version) is False
+        assert cache.get("a") is None
+
+    def test_stale_entry_is_served_and_refreshed(self):
+        cache = ResponseCache("test", max_bytes=1024, ttl_seconds=0, stale_seconds=60)
+        cache.set("a", make_response(10), cache.version)
+
+        entry, is_stale = cache.get("a")
+        assert is_stale
+        assert cache.refresh_in_background("a", lambda: make_response(20))
+
+        deadline = time.monotonic() + 2
+        while time.monotonic() < deadline:
+            entry, _ = cache.get("a")
+            if len(entry.body) == 20:
+                break
+            time.sleep(0.01)
+        assert len(entry.body) == 20
+
+    def test_expired_entry_is_a_miss(self):
+        cache = ResponseCache("test", max_bytes=1024, ttl_seconds=0, stale_seconds=0)
+        cache.set("a", make_response(10), cache.version)
+        assert cache.get("a") is None
+
+
+class TestSingleFlight:
+    """Test coalescing of concurrent identical calls."""
+
+    def test_concurrent_sync_calls_are_collapsed(self):
+        flight = SingleFlight("test")
+        started = threading.Event()
+        release = threading.Event()
+        executions = []
+
+        def slow_query():
+            executions.append(1)
+            started.set()
+            release.wait(2)
+            return {"rows": [1, 2, 3]}
+
+        results = []
+        leader = threading.Thread(
+            target=lambda: results.append(flight.do("key", slow_query))
+        )
+        leader.start()
+        started.wait(2)
+        followers = [
+            threading.Thread(target=lambda: results.append(flight.do("key", slow_query)))
+            for _ in range(5)
+        ]
+        for thread in followers:
+            thread.start()
+        while flight.stats()["collapsed"] < 5:
+            time.sleep(0.01)
+        release.set()
+        for thread in [leader, *followers]:
+            thread.join(2)
+
+        assert len(executions) == 1
+        assert len(results) == 6
+        assert all(result is results[0] for result in results)
+        assert flight.stats() == {
+            "calls": 6,
+            "executions": 1,
+            "collapsed": 5,
+            "in_flight": 0,
+        }
+
+    def test_errors_are_shared_and_not_cached(self):
+        flight = SingleFlight("test")
+
+        def failing():
+            raise ValueError("boom")
+
+        with pytest.raises(ValueError):
+            flight.do("key", failing)
+        assert flight.do("key", lambda: 42) == 42
+        assert flight.stats()["executions"] == 2
+
+    def test_async_callers_are_collapsed(self):
+        flight = SingleFlight("test")
+        executions = []
+
+        async def slow_query():
+            executions.append(1)
+            await asyncio.sleep(0.05)
+            return "result"
+
+        async def run():
+            return await asyncio.gather(
+                *[flight.do_async("key", slow_query) for _ in range(4)]
+            )
+
+        assert asyncio.run(run()) == ["result"] * 4
+        assert len(executions) == 1
+        assert flight.stats()["collapsed"] == 3
+
+    def test_async_caller_joins_sync_call(self):
+        flight = SingleFlight("test")
+        started = threading.Event()
+        release = threading.Event()
+
+        def slow_query():
+            started.set()
+            release.wait(2)
+            return "shared"
+
+        leader = threading.Thread(target=lambda: flight.do("key", slow_query))
+        leader.start()
+        started.wait(2)
+
+        async def follower():
+            task = asyncio.ensure_future(flight.do_async("key", slow_query))
+            await asyncio.sleep(0.05)
+            release.set()
+            return await task
+
+        assert asyncio.run(follower()) == "shared"
+        leader.join(2)
+        assert flight.stats()["executions"] == 1
+
+
+class TestIdempotencyStore:
+    """Test replaying responses by Idempotency-Key."""
+
+    def test_concurrent_duplicate_waits_for_first(self):
+        store = IdempotencyStore("test", max_keys=10, ttl_seconds=60, wait_seconds=2)
+        started = threading.Event()
+        release = threading.Event()
+        executions = []
+
+        def create():
+            executions.append(1)
+            started.set()
+            release.wait(2)
+            return Response(content=b'{"id": 1}', status_code=201, media_type="application/json")
+
+        results = []
+        first = threading.Thread(target=lambda: results.append(store.run("k", b"body", create)))
+        first.start()
+        started.wait(2)
+        retry = threading.Thread(target=lambda: results.append(store.run("k", b"body", create)))
+        retry.start()
+        while store.stats()["waits"] < 1:
+            time.sleep(0.01)
+        release.set()
+        for thread in [first, retry]:
+            thread.join(2)
+
+        assert len(executions) == 1
+        assert [r.body for r in results] == [b'{"id": 1}', b'{"id": 1}']
+        assert results[1].headers["Idempotent-Replayed"] == "true"
+        assert results[1].status_code == 201
+
+    def test_different_payload_is_rejected(self):
+        store = IdempotencyStore("test", max_keys=10, ttl_seconds=60, wait_seconds=1)
+        store.run("k", b"one", lambda: make_response(3))
+        assert store.run("k", b"two", lambda: make_response(3)).status_code == 422
+
+    def test_server_errors_release_the_key(self):
+        store = IdempotencyStore("test", max_keys=10, ttl_seconds=60, wait_seconds=1)
+        def failing():
+            raise ValueError("boom")
+
+        failed = store.run("k", b"body", lambda: Response(status_code=500))
+        assert failed.status_code == 500
+        with pytest.raises(ValueError):
+            store.run("k", b"body", failing)
+        assert store.run("k", b"body", lambda: make_response(3)).status_code == 200
+        assert store.stats()["executions"] == 3
+
+    def test_bounded_and_expiring(self):
+        store = IdempotencyStore("test", max_keys=2, ttl_seconds=60, wait_seconds=1)
+        for key in ["a", "b", "c"]:
+            store.run(key, b"body", lambda: make_response(3))
+        assert store.stats()["keys"] == 2
+        assert store.stats()["evictions"] == 1
+
+        store.ttl_seconds = 0
+        store.run("b", b"body", lambda: make_response(3))
+        assert store.stats()["replays"] == 0
+
+    def test_key_held_by_another_worker(self, tmp_path):
+        """Workers with their own store share keys through the database."""
+        engine = sa.create_engine(f"sqlite:///{tmp_path / 'keys.db'}")
+        idempotency_keys.create(engine)
+        Session = sessionmaker(bind=engine)
+        workers = [
+            IdempotencyStore("test", max_keys=10, ttl_seconds=60, wait_seconds=2)
+            for _ in range(2)
+        ]
+        started = threading.Event()
+        release = threading.Event()
+
+        def create():
+            started.set()
+            release.wait(2)
+            return Response(content=b'{"id": 1}', status_code=201, media_type="application/json")
+
+        key = (("product", 1), "create-1")
+        results = []
+        first = threading.Thread(
+            target=lambda: results.append(workers[0].run(key, b"body", create, Session()))
+        )
+        first.start()
+        started.wait(2)
+        retry = threading.Thread(
+            target=lambda: results.append(workers[1].run(key, b"body", create, Session()))
+        )
+        retry.start()
+        while workers[1].stats()["waits"] < 1:
+            time.sleep(0.01)
+        release.set()
+        for thread in [first, retry]:
+            thread.join(2)
+
+        assert [r.body for r in results] == [b'{"id": 1}', b'{"id": 1}']
+        assert results[1].headers["Idempotent-Replayed"] == "true"
+        assert workers[1].stats()["executions"] == 0
+        assert workers[1].stats()["remote_replays"] == 1
+        other = workers[1].run(key, b"other", create, Session())
+        assert other.status_code == 422
+
+    def test_slow_request_keeps_its_key(self, tmp_path):
+        """A key is not taken over while its holder keeps renewing the lease."""
+        engine = sa.create_engine(f"sqlite:///{tmp_path / 'keys.db'}")
+        idempotency_keys.create(engine)
+        Session = sessionmaker(bind=engine)
+        workers = [
+            IdempotencyStore(
+                "test", max_keys=10, ttl_seconds=60, wait_seconds=0.2, lease_seconds=0.3
+            )
+            for _ in range(2)
+        ]
+        started = threading.Event()
+        release = threading.Event()
+
+        def create():
+            started.set()
+            release.wait(5)
+            return Response(content=b'{"id": 1}', status_code=201, media_type="application/json")
+
+        key = (("product", 1), "create-1")
+        first = threading.Thread(target=lambda: workers[0].run(key, b"body", create, Session()))
+        first.start()
+        started.wait(2)
+        # Well past wait_seconds and several lease periods
+        time.sleep(0.8)
+        retry = workers[1].run(key, b"body", create, Session())
+        release.set()
+        first.join(2)
+
+        assert retry.status_code == 409
+        assert workers[1].stats()["executions"] == 0
+        replay = workers[1].run(key, b"body", create, Session())
+        assert replay.body == b'{"id": 1}'
+
+    def test_key_of_dead_worker_is_taken_over(self, tmp_path):
+        engine = sa.create_engine(f"sqlite:///{tmp_path / 'keys.db'}")
+        idempotency_keys.create(engine)
+        pid = os.fork()
+        if pid == 0:
+            os._exit(0)
+        os.waitpid(pid, 0)
+        now = datetime.now(timezone.utc)
+        with engine.begin() as connection:
+            connection.execute(
+                idempotency_keys.insert().values(
+                    scope="product:1",
+                    key="create-1",
+                    fingerprint=IdempotencyStore.fingerprint(b"body"),
+                    owner_pid=pid,
+                    heartbeat_at=now,
+                    created_at=now,
+                )
+            )
+
+        worker = IdempotencyStore("test", max_keys=10, ttl_seconds=60, wait_seconds=1)
+        key = (("product", 1), "create-1")
+        response = worker.run(key, b"body", lambda: make_response(3), sessionmaker(bind=engine)())
+        assert response.status_code == 200
+        assert worker.stats()["executions"] == 1
+        assert worker.stats()["takeovers"] == 1
+
+    def test_failed_request_releases_the_shared_key(self, tmp_path):
+        engine = sa.create_engine(f"sqlite:///{tmp_path / 'keys.db'}")
+        idempotency_keys.create(engine)
+        Session = sessionmaker(bind=engine)
+        workers = [
+            IdempotencyStore("test", max_keys=10, ttl_seconds=60, wait_seconds=1)
+            for _ in range(2)
+        ]
+        key = (("product", 1), "create-1")
+
+        failed = workers[0].run(key, b"body", lambda: Response(status_code=500), Session())
+        assert failed.status_code == 500
+        retry = workers[1].run(key, b"body", lambda: make_response(3), Session())
+        assert retry.status_code == 200
+        assert workers[1].stats()["executions"] == 1
+
+
+class TestReplicaPool:
+    """Test read replica selection."""
+
+    def test_round_robin_over_healthy_replicas(self, tmp_path):
+        pool = ReplicaPool(
+            [f"sqlite:///{tmp_path / 'a.db'}", f"sqlite:///{tmp_path / 'b.db'}"]
+        )
+        binds = []
+        for _ in range(4):
+            session = pool.session()
+            binds.append(session.get_bind())
+            session.close()
+
+        first, second = pool.replicas
+        assert binds == [first.engine, second.engine, first.engine, second.engine]
+
+    def test_unhealthy_replica_is_skipped(self, tmp_path):
+        pool = ReplicaPool(
+            [
+                "sqlite:////nonexistent-directory/replica.db",
+                f"sqlite:///{tmp_path / 'ok.db'}",
+            ]
+        )
+        for _ in range(3):
+            session = pool.session()
+            assert session.get_bind() is pool.replicas[1].engine
+            session.close()
+
+        stats = pool.stats()
+        assert stats["replicas"][0]["healthy"] is False
+        assert stats["replicas"][1]["sessions"] == 3
+
+    def test_no_healthy_replica_falls_back(self):
+        pool = ReplicaPool(["sqlite:////nonexistent-directory/replica.db"])
+        assert pool.session() is None
+        assert pool.stats()["fallbacks"] == 1
+
+
+def make_rate_limited_app(rules: dict):
+    """Build a small app whose route counts how often its session is opened."""
+    app = FastAPI()
+    app.add_middleware(RateLimitMiddleware, rules=rules)
+    app.state.sessions_opened = 0
+
+    def fake_db():
+        app.state.sessions_opened += 1
+        yield None
+
+    @app.post("/api/user/login")
+    def login(db=Depends(fake_db)):
+        return {"ok": True}
+
+    @app.get("/api/product")
+    async def products():
+        await asyncio.sleep(0.1)
+        return {"ok": True}
+
+    return app
+
+
+class TestRateLimiting:
+    """Test token buckets and the rate limit middleware."""
+
+    def test_token_bucket_refills(self):
+        buckets = TokenBucketStore(capacity=2, rate=100)
+        assert buckets.consume("ip") == 0
+        assert buckets.consume("ip") == 0
+        assert buckets.consume("ip") > 0
+        time.sleep(0.02)
+        assert buckets.consume("ip") == 0
+
+    def test_token_bucket_tracks_bounded_number_of_keys(self):
+        buckets = TokenBucketStore(capacity=1, rate=0, max_keys=2)
+        for key in ["a", "b", "c"]:
+            buckets.consume(key)
+        assert list(buckets._buckets) == ["b", "c"]
+
+    def test_over_limit_is_rejected_before_dependencies(self):
+        app = make_rate_limited_app(
+            {("POST", "/api/user/login"): {"ip_burst": 2, "ip_rate": 0.1}}
+        )
+        client = TestClient(app)
+
+        assert client.post("/api/user/login").status_code == 200
+        assert client.post("/api/user/login").status_code == 200
+        response = client.post("/api/user/login")
+
+        assert response.status_code == 429
+        assert int(response.headers["Retry-After"]) >= 1
+        assert response.json()["success"] is False
+        assert app.state.sessions_opened == 2
+
+    def test_concurrency_cap(self):
+        app = make_rate_limited_app({("GET", "/api/product"): {"concurrency": 1}})
+
+        async def run():
+            transport = httpx.ASGITransport(app=app)
+            async with httpx.AsyncClient(
+                transport=transport, base_url="http://test"
+            ) as client:
+                return await asyncio.gather(
+                    client.get("/api/product"), client.get("/api/product")
+                )
+
+        statuses = sorted(response.status_code for response in asyncio.run(run()))
+        assert statuses == [200, 429]
+
+
+class TestLazyStartup:
+    """Test that importing the entry points stays cheap."""
+
+    def run_python(self, code: str) -> str:
+        return subprocess.run(
+            [sys.executable, "-c", code], capture_output=True, text=True, check=True
+        ).stdout.strip()
+
+    def test_config_import_does_not_load_passlib(self):
+        output = self.run_python(
+            "import sys, config; print('passlib' in sys.modules)"
+        )
+        assert output == "False"
+
+    def test_photo_default_size_must_be_a_thumbnail_size(self):
+        result = subprocess.run(
+            [sys.executable, "-c", "import config"],
+            capture_output=True,
+            text=True,
+            env={**os.environ, "PHOTO_THUMBNAIL_SIZES": "160,320", "PHOTO_DEFAULT_SIZE": "640"},
+        )
+        assert result.returncode != 0
+        assert "PHOTO_DEFAULT_SIZE=640 is not one of" in result.stderr
+
+    def test_main_import_does_not_build_app(self):
+        output = self.run_python(
+            "import sys, main; print('apps.product.routers' in sys.modules)"
+        )
+        assert output == "False"
+
+    def test_app_is_built_on_first_access(self):
+        output = self.run_python(
+            "from main import app; print(sorted(app.state.startup.report()['phases_ms']))"
+        )
+        assert "import:apps.product.routers" in output
+
+
+class TestSharedVersions:
+    """Test cache version counters shared between worker processes."""
+
+    def test_process_local_counters(self):
+        versions = SharedVersions()
+        assert versions.get("product_list") == 0
+        assert versions.bump("product_list") == 1
+        assert versions.get("product_list") == 1
+        assert not versions.is_shared
+
+    def test_bump_in_forked_worker_is_visible(self, tmp_path):
+        versions = SharedVersions(str(tmp_path / "state"))
+        before = versions.get("product_list")
+
+        pid = os.fork()
+        if pid == 0:
+            versions.bump("product_list")
+            os._exit(0)
+        os.waitpid(pid, 0)
+
+        assert versions.get("product_list") == before + 1
+
+    def test_cache_invalidated_by_another_worker(self, tmp_path):
+        path = str(tmp_path / "state")
+        worker_a = ResponseCache("products", 1024, 60, versions=SharedVersions(path))
+        worker_b = ResponseCache("products", 1024, 60, versions=SharedVersions(path))
+        worker_a.set("page-1", make_response(10), worker_a.version)
+
+        worker_b.invalidate()
+
+        assert worker_a.get("page-1") is None
+
+    def test_deadline_set_in_forked_worker_is_visible(self, tmp_path):
+        path = str(tmp_path / "state")
+        versions = SharedVersions(path)
+        deadlines = SharedDeadlines(path)
+        now = time.monotonic()
+        assert not deadlines.is_active(42, now)
+
+        pid = os.fork()
+        if pid == 0:
+            deadlines.extend(42, time.monotonic() + 60)
+            os._exit(0)
+        os.waitpid(pid, 0)
+
+        assert deadlines.is_active(42, now)
+        assert not deadlines.is_active(43, now)
+        assert not deadlines.is_active(42, now + 120)
+        assert deadlines.active(now) == 1
+        # Deadlines are stored after the version counters, not on top of them
+        assert versions.get("product_list") == 0
+        assert SharedDeadlines.OFFSET % mmap.ALLOCATIONGRANULARITY == 0
+
+    def test_deadline_is_never_shortened(self):
+        deadlines = SharedDeadlines()
+        deadlines.extend(7, 100.0)
+        deadlines.extend(7, 50.0)
+        assert deadlines.is_active(7, 99.0)
+
+    def test_one_worker_leads_until_it_exits(self, tmp_path):
+        path = str(tmp_path / "state.leader")
+        led, release = os.pipe(), os.pipe()
+
+        pid = os.fork()
+        if pid == 0:
+            child_lock = LeaderLock(path)
+            child_lock.run_when_leader(lambda: os.write(led[1], b"1"))
+            os.read(release[0], 1)
+            os._exit(0)
+        try:
+            os.read(led[0], 1)
+            started = threading.Event()
+            leader = LeaderLock(path)
+            leader.run_when_leader(started.set)
+            assert not started.wait(0.2)
+            assert not leader.is_leader
+        finally:
+            os.write(release[1], b"1")
+            os.waitpid(pid, 0)
+
+        assert started.wait(2)
+        assert leader.is_leader
+        for fd in [*led, *release]:
+            os.close(fd)
+
+
+class TestFieldsets:
+    """Test parsing of the fields= query parameter."""
+
+    def test_parse_orders_and_adds_id(self):
+        allowed = ("id", "name", "price", "description")
+        assert parse_fieldset(None, allowed) is None
+        assert parse_fieldset(" ", allowed) is None
+        assert parse_fieldset("price, name,price", allowed) == ("id", "name", "price")
+
+    def test_unknown_field(self):
+        with pytest.raises(ValueError):
+            parse_fieldset("name,password", ("id", "name"))
+
+
+class TestLazySession:
+    """Test the lazily opened, request-scoped session."""
+
+    def test_session_created_on_first_use(self):
+        created = []
+
+        class FakeSession:
+            def __init__(self):
+                created.append(self)
+                self.closed = False
+
+            def execute(self, statement):
+                return statement
+
+            def close(self):
+                self.closed = True
+
+        db = LazySession(FakeSession)
+        db.close()
+        assert created == []
+        assert not db.is_open
+
+        assert db.execute("SELECT 1") == "SELECT 1"
+        assert db.execute("SELECT 2") == "SELECT 2"
+        assert len(created) == 1
+        db.close()
+        assert created[0].closed
+
+    def test_dependencies_share_one_unopened_session(self):
+        app = FastAPI()
+
+        def dependency(db=Depends(get_db, use_cache=False)):
+            return db
+
+        @app.get("/")
+        def route(db=Depends(get_db, use_cache=False), other=Depends(dependency)):
+            return {"shared": db is other, "open": db.is_open}
+
+        response = TestClient(app).get("/")
+        assert response.json() == {"shared": True, "open": False}
+
+
+class TestRowSerialization:
+    """Test serialization of row DTOs."""
+
+    def test_serialize_named_tuple_and_mapping(self):
+        import enum
+        from typing import NamedTuple
+
+        class Color(enum.Enum):
+            RED = "red"
+
+        class Row(NamedTuple):
+            id: int
+            color: Color
+            created_at: datetime
+
+        created_at = datetime(2024, 1, 2, 3, 4, 5, tzinfo=timezone.utc)
+        expected = {"id": 1, "color": "red", "created_at": "2024-01-02T03:04:05+00:00"}
+        assert serialize_row(Row(1, Color.RED, created_at)) == expected
+        assert serialize_row({"id": 1, "color": Color.RED, "created_at": created_at}) == expected
+
+
+@pytest.fixture
+def backfill_engine(tmp_path):
+    engine = sa.create_engine(f"sqlite:///{tmp_path / 'backfill.db'}")
+    with engine.begin() as connection:
+        connection.exec_driver_sql(
+            "CREATE TABLE item (id INTEGER PRIMARY KEY, price FLOAT, cents INTEGER)"
+        )
+        connection.exec_driver_sql(
+            "INSERT INTO item (id, price) VALUES "
+            + ", ".join(f"({i}, {i}.5)" for i in range(1, 26))
+        )
+    yield engine
+    engine.dispose()
+
+
+def make_cents_backfill() -> Backfill:
+    item = sa.table("item", sa.column("id"), sa.column("price"), sa.column("cents"))
+    return Backfill(
+        "item_cents",
+        item,
+        values={"cents": sa.cast(item.c.price * 100, sa.Integer)},
+        where=item.c.cents.is_(None),
+    )
+
+
+class TestBackfill:
+    """Test batched, resumable backfills."""
+
+    def count_missing(self, engine) -> int:
+        with engine.connect() as connection:
+            return connection.exec_driver_sql(
+                "SELECT count(*) FROM item WHERE cents IS NULL"
+            ).scalar()
+
+    def test_resumes_from_stored_progress(self, backfill_engine):
+        backfill = make_cents_backfill()
+        with backfill_engine.connect() as connection:
+            progress = backfill.run(
+                connection, batch_size=10, sleep_seconds=0, max_batches=1
+            )
+        assert progress["last_key"] == 10
+        assert progress["finished_at"] is None
+        assert self.count_missing(backfill_engine) == 15
+
+        with backfill_engine.connect() as connection:
+            progress = backfill.run(connection, batch_size=10, sleep_seconds=0)
+        assert progress["rows_done"] == 25
+        assert progress["batches_done"] == 3
+        assert progress["finished_at"] is not None
+        assert self.count_missing(backfill_engine) == 0
+        with backfill_engine.connect() as connection:
+            assert connection.exec_driver_sql(
+                "SELECT cents FROM item WHERE id = 3"
+            ).scalar() == 350
+
+    def test_estimate_changes_nothing(self, backfill_engine):
+        backfill = make_cents_backfill()
+        with backfill_engine.connect() as connection:
+            estimate = backfill.estimate(
+                connection, batch_size=10, sleep_seconds=0.5, sample_batches=2
+            )
+        assert estimate["rows"] == 25
+        assert estimate["batches"] == 3
+        assert estimate["estimated_seconds"] >= 1.0
+        assert self.count_missing(backfill_engine) == 25
+        with backfill_engine.connect() as connection:
+            assert not sa.inspect(connection).has_table("backfill_progress")
+
+    def test_computed_values(self, backfill_engine):
+        item = sa.table("item", sa.column("id"), sa.column("price"), sa.column("cents"))
+        backfill = Backfill(
+            "item_cents_computed",
+            item,
+            where=item.c.cents.is_(None),
+            # Odd rows are left alone
+            compute=lambda row: {"cents": int(row.price * 100)} if row.id % 2 == 0 else None,
+        )
+        with backfill_engine.connect() as connection:
+            progress = backfill.run(connection, batch_size=10, sleep_seconds=0)
+        assert progress["rows_done"] == 12
+        assert progress["finished_at"] is not None
+        assert self.count_missing(backfill_engine) == 13
+        with backfill_engine.connect() as connection:
+            assert connection.exec_driver_sql(
+                "SELECT cents FROM item WHERE id = 4"
+            ).scalar() == 450
+
+
+@pytest.fixture
+def writer_sessions(tmp_path):
+    engine = sa.create_engine(
+        f"sqlite:///{tmp_path / 'writer.db'}",
+        connect_args={"check_same_thread": False},
+    )
+    with engine.begin() as connection:
+        connection.exec_driver_sql("CREATE TABLE item (id INTEGER PRIMARY KEY, name TEXT UNIQUE)")
+    yield sessionmaker(bind=engine)
+    engine.dispose()
+
+
+def insert_item(name: str):
+    def unit(session):
+        return session.execute(
+            sa.text("INSERT INTO item (name) VALUES (:name) RETURNING id"), {"name": name}
+        ).scalar_one()
+
+    return unit
+
+
+def item_names(sessions) -> list:
+    with sessions() as session:
+        return session.execute(sa.text("SELECT name FROM item ORDER BY id")).scalars().all()
+
+
+class TestWriteCoordinator:
+    """Test group commits through the single writer thread."""
+
+    def test_queued_units_share_one_commit(self, writer_sessions):
+        coordinator = WriteCoordinator("test-writer", max_batch=64, timeout_seconds=5)
+        coordinator.start(writer_sessions)
+        release = threading.Event()
+
+        def blocking(session):
+            release.wait(2)
+            return insert_item("first")(session)
+
+        try:
+            first = coordinator.submit(blocking)
+            while coordinator.stats()["queued"]:
+                time.sleep(0.01)
+            queued = [coordinator.submit(insert_item(f"item{i}")) for i in range(5)]
+            release.set()
+            ids = [future.result(2) for future in [first, *queued]]
+        finally:
+            coordinator.stop()
+
+        assert ids == [1, 2, 3, 4, 5, 6]
+        assert len(item_names(writer_sessions)) == 6
+        stats = coordinator.stats()
+        assert (stats["batches"], stats["largest_batch"]) == (2, 5)
+
+    def test_failed_unit_only_rolls_back_its_savepoint(self, writer_sessions):
+        coordinator = WriteCoordinator("test-writer", max_batch=64, timeout_seconds=5)
+        release = threading.Event()
+
+        def blocking(session):
+            release.wait(2)
+            return insert_item("a")(session)
+
+        coordinator.start(writer_sessions)
+        try:
+            futures = [coordinator.submit(blocking)]
+            while coordinator.stats()["queued"]:
+                time.sleep(0.01)
+            futures += [
+                coordinator.submit(insert_item("b")),
+                coordinator.submit(insert_item("b")),
+                coordinator.submit(insert_item("c")),
+            ]
+            release.set()
+            futures[0].result(2)
+            assert futures[1].result(2) == 2
+            with pytest.raises(sa.exc.IntegrityError):
+                futures[2].result(2)
+            futures[3].result(2)
+        finally:
+            coordinator.stop()
+
+        assert item_names(writer_sessions) == ["a", "b", "c"]
+        assert coordinator.stats()["failed_units"] == 1
+
+    def test_timed_out_unit_is_never_committed(self, writer_sessions):
+        coordinator = WriteCoordinator("test-writer", max_batch=64, timeout_seconds=0.2)
+        release = threading.Event()
+
+        def blocking(session):
+            release.wait(2)
+            return insert_item("slow")(session)
+
+        coordinator.start(writer_sessions)
+        try:
+            first = coordinator.submit(blocking)
+            while coordinator.stats()["queued"]:
+                time.sleep(0.01)
+            with pytest.raises(WriteTimeout):
+                coordinator.run(insert_item("late"))
+            release.set()
+            first.result(2)
+            assert coordinator.run(insert_item("retry")) == 2
+        finally:
+            coordinator.stop()
+
+        assert item_names(writer_sessions) == ["slow", "retry"]
+        assert coordinator.stats()["timed_out_units"] == 1
+
+    def test_running_unit_is_waited_for(self, writer_sessions):
+        coordinator = WriteCoordinator("test-writer", max_batch=64, timeout_seconds=0.1)
+
+        def slow(session):
+            time.sleep(0.3)
+            return insert_item("slow")(session)
+
+        coordinator.start(writer_sessions)
+        try:
+            assert coordinator.run(slow) == 1
+        finally:
+            coordinator.stop()
+        assert coordinator.stats()["timed_out_units"] == 0
+
+    def test_execute_write_commits_inline_when_stopped(self, writer_sessions):
+        with writer_sessions() as session:
+            assert execute_write(session, insert_item("inline")) == 1
+            with pytest.raises(sa.exc.IntegrityError):
+                execute_write(session, insert_item("inline"))
+        assert item_names(writer_sessions) == ["inline"]
+
+
+def make_profiled_app(directory) -> FastAPI:
+    engine = sa.create_engine("sqlite://")
+    router = APIRouter(route_class=ProfiledRoute)
+
+    @router.get("/api/product")
+    def slow_listing(category: str = ""):
+        with engine.connect() as connection:
+            connection.execute(sa.text("SELECT 1"))
+        time.sleep(0.05)
+        return {"category": category}
+
+    app = FastAPI()
+    app.include_router(router)
+    app.add_middleware(
+        ProfilingMiddleware, directory=str(directory), token="secret", sample_rate=0
+    )
+    return app
+
+
+class TestProfiling:
+    """Test per-request profiles triggered by header."""
+
+    def test_profile_written_for_authorized_header(self, tmp_path):
+        client = TestClient(make_profiled_app(tmp_path))
+        response = client.get("/api/product?category=fruit", headers={"X-Profile": "secret"})
+        assert response.json() == {"category": "fruit"}
+        profile_id = response.headers["X-Profile-Id"]
+
+        [metadata_path] = tmp_path.glob(f"*-{profile_id}.json")
+        metadata = json.loads(metadata_path.read_text())
+        assert metadata["route"] == "/api/product"
+        assert metadata["query_params"] == "category=fruit"
+        assert metadata["status_code"] == 200
+        assert [s["statement"] for s in metadata["sql"]] == ["SELECT 1"]
+        assert metadata["samples"] > 0
+
+        folded = metadata_path.with_suffix(".folded").read_text().splitlines()
+        assert all(line.rsplit(" ", 1)[1].isdigit() for line in folded)
+        assert any("slow_listing (" in line for line in folded)
+
+    def test_no_profile_without_token(self, tmp_path):
+        client = TestClient(make_profiled_app(tmp_path))
+        for headers in [{}, {"X-Profile": "wrong"}]:
+            response = client.get("/api/product", headers=headers)
+            assert response.status_code == 200
+            assert "X-Profile-Id" not in response.headers
+        assert list(tmp_path.iterdir()) == []
+
+
+class TestGeo:
+    """Test offline geocoding and distance helpers."""
+
+    gazetteer = Gazetteer(
+        {
+            "Cork": (51.8985, -8.4756),
+            "Mallow": (52.1347, -8.6451),
+            "Dun Laoghaire": (53.2940, -6.1339),
+        }
+    )
+
+    def test_geocode_prefers_most_specific_part(self):
+        assert self.gazetteer.geocode("12 Main St, Mallow, Co. Cork") == (52.1347, -8.6451)
+        assert self.gazetteer.geocode("County Cork") == (51.8985, -8.4756)
+        assert self.gazetteer.geocode("Pier road near Dún Laoghaire") == (53.2940, -6.1339)
+        assert self.gazetteer.geocode("somewhere in the midlands") is None
+
+    def test_bounding_box_contains_radius(self):
+        lat, lon, radius = 53.35, -6.26, 50
+        min_lat, max_lat, min_lon, max_lon = bounding_box(lat, lon, radius)
+        for bearing_lat, bearing_lon in [(max_lat, lon), (min_lat, lon), (lat, max_lon), (lat, min_lon)]:
+            assert distance_km(lat, lon, bearing_lat, bearing_lon) >= radius - 0.01
+        assert bounding_box(89.9, 0, 50)[2:] == (-180.0, 180.0)
+
+    def test_distance_function_registered_on_sqlite(self):
+        engine = sa.create_engine("sqlite://")
+        with engine.connect() as connection:
+            distance = connection.execute(
+                sa.text("SELECT distance_km(53.3498, -6.2603, 51.8985, -8.4756)")
+            ).scalar()
+        assert 218 < distance < 222
+
+
+if __name__ == "__main__":
+    # Run tests with pytest
+    pytest.main([__file__, "-v"])
@@ -0,0 +1,12 @@
+import re
+import unicodedata
+
+
+def normalize_text(text: str) -> str:
+    """
+    Lowercase, strip accents and collapse everything but letters and digits
+    to single spaces, for matching user input against stored names.
+    """
+    text = unicodedata.normalize("NFKD", text)
+    text = "".join(char for char in text if not unicodedata.combining(char))
+    return " ".join(re.sub(r"[^a-z0-9]+", " ", text.lower()).split())
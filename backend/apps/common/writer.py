@@ -0,0 +1,214 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from typing import Callable, List, Optional, Tuple, TypeVar
+
+from sqlalchemy.orm import Session
+
+from apps.common.metrics import register_metrics
+from config import WRITE_COORDINATOR_MAX_BATCH, WRITE_COORDINATOR_TIMEOUT_SECONDS
+
+T = TypeVar("T")
+# A unit of work: runs its statements on the given session and returns a
+# result. It must not commit or roll back, and should return plain values or
+# objects it expunged from the session.
+WriteUnit = Callable[[Session], T]
+
+_STOP = object()
+
+
+class WriteTimeout(TimeoutError):
+    """
+    The write coordinator did not start a unit within its timeout. The unit
+    was cancelled, so nothing was written and the write can be retried.
+    """
+
+
+class WriteCoordinator:
+    """
+    Optional single writer per worker process. Request handlers submit write
+    units; a dedicated thread takes every unit queued so far (up to
+    `max_batch`), runs each in its own SAVEPOINT inside one BEGIN IMMEDIATE
+    transaction, commits once and resolves each caller's future. A unit
+    that fails only rolls back its savepoint; a failed commit fails the
+    whole batch.
+
+    Threadpool workers then stop contending for the SQLite write lock
+    within a process, and one fsync covers a whole batch. Reads do not go
+    through here. Other processes (workers, jobs) still wait on the busy
+    timeout.
+    """
+
+    def __init__(self, name: str, max_batch: int, timeout_seconds: float):
+        self.name = name
+        self.max_batch = max_batch
+        self.timeout_seconds = timeout_seconds
+        self._queue: "queue.Queue" = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._running = False
+        self.units = 0
+        self.failed_units = 0
+        self.batches = 0
+        self.failed_batches = 0
+        self.timed_out_units = 0
+        self.largest_batch = 0
+        self.commit_seconds = 0.0
+
+    @property
+    def is_running(self) -> bool:
+        return self._running
+
+    def start(self, session_factory) -> threading.Thread:
+        with self._lock:
+            if self._running:
+                return self._thread
+            self._running = True
+            self._thread = threading.Thread(
+                target=self._run, args=(session_factory,), name=self.name, daemon=True
+            )
+            self._thread.start()
+            return self._thread
+
+    def stop(self, timeout: float = 5.0) -> None:
+        """
+        Stop taking units; those already queued are still committed.
+        """
+        with self._lock:
+            if not self._running:
+                return
+            self._running = False
+            self._queue.put(_STOP)
+            thread = self._thread
+        thread.join(timeout)
+
+    def submit(self, unit: WriteUnit) -> Future:
+        future: Future = Future()
+        with self._lock:
+            if not self._running:
+                raise RuntimeError(f"{self.name} is not running")
+            self._queue.put((future, unit))
+        return future
+
+    def run(self, unit: WriteUnit) -> T:
+        """
+        Submit `unit` and wait for the commit of its batch. A unit still
+        queued after `timeout_seconds` is cancelled and WriteTimeout raised;
+        one already in a batch is waited for, since that batch may commit.
+        """
+        future = self.submit(unit)
+        try:
+            return future.result(self.timeout_seconds)
+        except FutureTimeoutError:
+            if future.cancel():
+                self.timed_out_units += 1
+                raise WriteTimeout(
+                    f"{self.name} did not start the write within "
+                    f"{self.timeout_seconds}s; it was not applied"
+                )
+        # The batch holding the unit is running; its outcome decides
+        return future.result()
+
+    def _run(self, session_factory) -> None:
+        # Results are expunged after each commit, so nothing needs reloading
+        session: Session = session_factory(expire_on_commit=False)
+        try:
+            stopping = False
+            while not stopping:
+                item = self._queue.get()
+                if item is _STOP:
+                    break
+                batch = [item]
+                while len(batch) < self.max_batch:
+                    try:
+                        item = self._queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if item is _STOP:
+                        stopping = True
+                        break
+                    batch.append(item)
+                self._commit_batch(session, batch)
+        finally:
+            session.close()
+
+    def _commit_batch(self, session: Session, batch: List[Tuple[Future, WriteUnit]]) -> None:
+        started = time.perf_counter()
+        outcomes = []
+        try:
+            connection = session.connection()
+            if connection.dialect.name == "sqlite":
+                # pysqlite would otherwise let the first RELEASE commit
+                connection.exec_driver_sql("BEGIN IMMEDIATE")
+            for future, unit in batch:
+                if not future.set_running_or_notify_cancel():
+                    continue
+                try:
+                    with session.begin_nested():
+                        outcomes.append((future, unit(session), None))
+                except Exception as e:
+                    outcomes.append((future, None, e))
+            session.commit()
+            session.expunge_all()
+        except Exception as e:
+            session.rollback()
+            print(f"Error committing {self.name} batch: {str(e)}")
+            self.failed_batches += 1
+            for future, _ in batch:
+                if future.running():
+                    future.set_exception(e)
+            return
+        finally:
+            self.batches += 1
+            self.units += len(batch)
+            self.largest_batch = max(self.largest_batch, len(batch))
+            self.commit_seconds += time.perf_counter() - started
+
+        for future, result, error in outcomes:
+            if error is not None:
+                self.failed_units += 1
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+    def stats(self) -> dict:
+        return {
+            "running": self._running,
+            "queued": self._queue.qsize(),
+            "units": self.units,
+            "failed_units": self.failed_units,
+            "batches": self.batches,
+            "failed_batches": self.failed_batches,
+            "timed_out_units": self.timed_out_units,
+            "avg_batch": round(self.units / self.batches, 2) if self.batches else 0.0,
+            "largest_batch": self.largest_batch,
+            "avg_commit_ms": round(self.commit_seconds / self.batches * 1000, 2)
+            if self.batches
+            else 0.0,
+        }
+
+
+write_coordinator = WriteCoordinator(
+    name="write-coordinator",
+    max_batch=WRITE_COORDINATOR_MAX_BATCH,
+    timeout_seconds=WRITE_COORDINATOR_TIMEOUT_SECONDS,
+)
+register_metrics("write_coordinator", write_coordinator.stats)
+
+
+def execute_write(db_session: Session, unit: WriteUnit) -> T:
+    """
+    Run a write unit and commit it: through the write coordinator when it is
+    running, otherwise on `db_session`. Errors raised by the unit propagate
+    to the caller either way.
+    """
+    if write_coordinator.is_running:
+        return write_coordinator.run(unit)
+    try:
+        result = unit(db_session)
+        db_session.commit()
+        return result
+    except Exception:
+        db_session.rollback()
+        raise
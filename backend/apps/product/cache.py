@@ -0,0 +1,35 @@
+from apps.common.cache import ResponseCache
+from apps.common.metrics import register_metrics
+from config import (
+    PRODUCT_LIST_CACHE_MAX_BYTES,
+    PRODUCT_LIST_CACHE_TTL_SECONDS,
+    PRODUCT_LIST_CACHE_STALE_SECONDS,
+)
+
+
+# Anonymous GET /api/product responses, keyed by ProductListQueryParams.cache_key()
+product_list_cache = ResponseCache(
+    name="product_list",
+    max_bytes=PRODUCT_LIST_CACHE_MAX_BYTES,
+    ttl_seconds=PRODUCT_LIST_CACHE_TTL_SECONDS,
+    stale_seconds=PRODUCT_LIST_CACHE_STALE_SECONDS,
+)
+
+# GET /api/product/facets responses, keyed by ProductFacetQueryParams.cache_key()
+product_facets_cache = ResponseCache(
+    name="product_facets",
+    max_bytes=PRODUCT_LIST_CACHE_MAX_BYTES,
+    ttl_seconds=PRODUCT_LIST_CACHE_TTL_SECONDS,
+    stale_seconds=PRODUCT_LIST_CACHE_STALE_SECONDS,
+)
+
+register_metrics("product_list_cache", product_list_cache.stats)
+register_metrics("product_facets_cache", product_facets_cache.stats)
+
+
+def invalidate_product_caches() -> None:
+    """
+    Called after every committed product write.
+    """
+    product_list_cache.invalidate()
+    product_facets_cache.invalidate()
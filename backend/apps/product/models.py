@@ -1,6 +1,6 @@
 from typing import TYPE_CHECKING
 from datetime import datetime, timezone
-from sqlalchemy import String, Integer, Float, Boolean, ForeignKey, Text, DateTime, func
+from sqlalchemy import String, Integer, Float, Boolean, ForeignKey, Text, DateTime, Index, func
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 from typing import Optional, List
 from apps.common.models import BaseDatabaseModel
@@ -34,6 +34,12 @@ class Category(BaseDatabaseModel):
 
 class Product(BaseDatabaseModel):
     __tablename__ = "product"
+    __table_args__ = (
+        # One live product per name and owner; creates insert against it
+        Index("uq_product_owner_name", "product_owner_id", "name", unique=True),
+        # Ids of archived products are never handed out again
+        {"sqlite_autoincrement": True},
+    )
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
     name: Mapped[str] = mapped_column(String(100), nullable=False)
@@ -68,3 +74,71 @@ class Product(BaseDatabaseModel):
 
     def __str__(self):
         return f"Product(id={self.id}, name={self.name}, price={self.price})"
+
+
+class ProductArchive(BaseDatabaseModel):
+    """
+    Cold storage for deactivated products, moved out of `product` by the
+    archiver so listings only scan live rows. Rows keep their product id.
+    """
+
+    __tablename__ = "product_archive"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=False)
+    name: Mapped[str] = mapped_column(String(100), nullable=False)
+    description: Mapped[Optional[str]] = mapped_column(Text, nullable=True)
+    price: Mapped[float] = mapped_column(Float, nullable=False)
+    photo_url: Mapped[Optional[str]] = mapped_column(String(255), nullable=True)
+    is_active: Mapped[bool] = mapped_column(Boolean, default=False, nullable=False)
+    category_id: Mapped[Optional[int]] = mapped_column(Integer, nullable=True)
+    product_owner_id: Mapped[Optional[int]] = mapped_column(
+        Integer, nullable=True, index=True
+    )
+    created_at: Mapped[Optional[datetime]] = mapped_column(
+        DateTime(timezone=True), nullable=True
+    )
+    updated_at: Mapped[Optional[datetime]] = mapped_column(
+        DateTime(timezone=True), nullable=True
+    )
+    archived_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True), nullable=False
+    )
+
+    def __repr__(self):
+        return f"<ProductArchive id={self.id} name={self.name}>"
+
+
+class ProductSimilarity(BaseDatabaseModel):
+    """
+    Precomputed "similar products" of each active product, best first, written
+    by the job in apps/product/similarity.py. No foreign keys, so deleting or
+    archiving products does not wait on it; the job drops stale rows.
+    """
+
+    __tablename__ = "product_similarity"
+
+    product_id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=False)
+    rank: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=False)
+    similar_product_id: Mapped[int] = mapped_column(Integer, nullable=False)
+    score: Mapped[float] = mapped_column(Float, nullable=False)
+
+    def __repr__(self):
+        return f"<ProductSimilarity product_id={self.product_id} rank={self.rank}>"
+
+
+class ProductSimilarityState(BaseDatabaseModel):
+    """
+    The product updated_at each product_similarity list was computed from, so
+    the job only recomputes products that changed since.
+    """
+
+    __tablename__ = "product_similarity_state"
+
+    product_id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=False)
+    source_updated_at: Mapped[Optional[datetime]] = mapped_column(
+        DateTime(timezone=True), nullable=True
+    )
+    computed_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=False)
+
+    def __repr__(self):
+        return f"<ProductSimilarityState product_id={self.product_id}>"
@@ -0,0 +1,172 @@
+import hashlib
+import io
+import os
+import re
+import tempfile
+from concurrent.futures import Future, ProcessPoolExecutor
+import multiprocessing
+from typing import Dict, List, Optional
+
+from config import (
+    MEDIA_ROOT,
+    MEDIA_URL_PREFIX,
+    PHOTO_THUMBNAIL_SIZES,
+    PHOTO_DEFAULT_SIZE,
+    PHOTO_THUMBNAIL_WORKERS,
+)
+
+ALLOWED_IMAGE_FORMATS = {"JPEG": "jpg", "PNG": "png", "WEBP": "webp"}
+MEDIA_FILENAME_PATTERN = re.compile(r"^(?P<digest>[0-9a-f]{64})(?:_(?P<size>\d+))?\.(?P<ext>jpg|png|webp)$")
+MEDIA_KINDS = ("originals", "thumbs")
+
+_executor: Optional[ProcessPoolExecutor] = None
+
+
+class InvalidPhotoError(ValueError):
+    pass
+
+
+def media_path(kind: str, filename: str) -> str:
+    """
+    Location of a stored file. Files are sharded by the first two characters
+    of their content hash.
+    """
+    return os.path.join(MEDIA_ROOT, kind, filename[:2], filename)
+
+
+def media_url(kind: str, filename: str) -> str:
+    return f"{MEDIA_URL_PREFIX}/{kind}/{filename}"
+
+
+def thumbnail_filename(digest: str, size: int) -> str:
+    return f"{digest}_{size}.webp"
+
+
+def photo_variants(digest: str) -> Dict[int, str]:
+    return {size: media_url("thumbs", thumbnail_filename(digest, size)) for size in PHOTO_THUMBNAIL_SIZES}
+
+
+def detect_image_format(data: bytes) -> str:
+    """
+    Return the file extension for an uploaded image, or raise InvalidPhotoError.
+    Only the image header is parsed here; decoding happens off the request path.
+    """
+    from PIL import Image, UnidentifiedImageError
+
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            image_format = image.format
+            image.verify()
+    except (UnidentifiedImageError, OSError, SyntaxError) as e:
+        raise InvalidPhotoError(f"Not a valid image: {str(e)}")
+    if image_format not in ALLOWED_IMAGE_FORMATS:
+        raise InvalidPhotoError(f"Unsupported image format: {image_format}")
+    return ALLOWED_IMAGE_FORMATS[image_format]
+
+
+def _write_atomically(path: str, data: bytes) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    handle, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    try:
+        with os.fdopen(handle, "wb") as temp_file:
+            temp_file.write(data)
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+def content_digest(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def store_original(data: bytes, digest: str, extension: str) -> str:
+    """
+    Store an uploaded original under its SHA-256 digest and return its path.
+    Uploading the same bytes twice reuses the existing file.
+    """
+    path = media_path("originals", f"{digest}.{extension}")
+    if not os.path.exists(path):
+        _write_atomically(path, data)
+    return path
+
+
+def find_original(digest: str) -> Optional[str]:
+    for extension in ALLOWED_IMAGE_FORMATS.values():
+        path = media_path("originals", f"{digest}.{extension}")
+        if os.path.exists(path):
+            return path
+    return None
+
+
+def generate_thumbnails(original_path: str, thumbnail_paths: Dict[int, str]) -> List[str]:
+    """
+    Decode the original once and write a WebP thumbnail per size.
+    Runs in the thumbnail process pool.
+    """
+    from PIL import Image, ImageOps
+
+    written = []
+    with Image.open(original_path) as image:
+        image = ImageOps.exif_transpose(image)
+        if image.mode not in ("RGB", "RGBA"):
+            image = image.convert("RGBA" if "A" in image.getbands() else "RGB")
+        for size, path in sorted(thumbnail_paths.items(), reverse=True):
+            if os.path.exists(path):
+                continue
+            thumbnail = image.copy()
+            thumbnail.thumbnail((size, size), Image.Resampling.LANCZOS)
+            buffer = io.BytesIO()
+            thumbnail.save(buffer, format="WEBP", quality=80, method=4)
+            _write_atomically(path, buffer.getvalue())
+            written.append(path)
+    return written
+
+
+def _get_executor() -> ProcessPoolExecutor:
+    global _executor
+    if _executor is None:
+        # spawn: the API process is multi-threaded, forking it is not safe
+        _executor = ProcessPoolExecutor(
+            max_workers=PHOTO_THUMBNAIL_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+    return _executor
+
+
+def shutdown_thumbnail_workers() -> None:
+    """
+    Stop the thumbnail worker processes, after the thumbnails already queued.
+    Called when the app shuts down; a later upload starts a new pool.
+    """
+    global _executor
+    executor, _executor = _executor, None
+    if executor is not None:
+        executor.shutdown(wait=True)
+
+
+def schedule_thumbnails(digest: str) -> Optional[Future]:
+    """
+    Queue thumbnail generation for a stored original, off the request path.
+    """
+    original_path = find_original(digest)
+    if original_path is None:
+        return None
+    thumbnail_paths = {
+        size: media_path("thumbs", thumbnail_filename(digest, size))
+        for size in PHOTO_THUMBNAIL_SIZES
+    }
+    future = _get_executor().submit(generate_thumbnails, original_path, thumbnail_paths)
+    future.add_done_callback(_log_thumbnail_failure)
+    return future
+
+
+def _log_thumbnail_failure(future: Future) -> None:
+    error = future.exception()
+    if error is not None:
+        print(f"Error generating thumbnails: {str(error)}")
+
+
+def default_photo_url(digest: str) -> str:
+    return media_url("thumbs", thumbnail_filename(digest, PHOTO_DEFAULT_SIZE))
@@ -1,9 +1,17 @@
-from fastapi import APIRouter, Request
+from typing import Optional
+from fastapi import APIRouter, Request, UploadFile, File, Query, Header
 from fastapi import HTTPException
 from fastapi import Depends
-from apps.product.schemas import ProductListQueryParams, ProductCreate, ProductUpdate
+from apps.product.schemas import (
+    ProductListQueryParams,
+    ProductCreate,
+    ProductUpdate,
+    ProductFacetQueryParams,
+    ProductBatchRequest,
+)
 from apps.user.models import UserTypeEnum
 from apps.common.database import get_db
+from apps.common.replicas import get_read_db
 from apps.product.views import (
     get_all_product_view,
     create_product_view,
@@ -11,14 +19,31 @@ from apps.product.views import (
     update_product_view,
     get_all_product_categories_view,
     get_user_products_view,
+    get_product_facets_view,
+    upload_product_photo_view,
+    serve_media_view,
+    get_products_batch_view,
+    get_similar_products_view,
+    restore_product_view,
 )
 from apps.common.custom_response import CustomJSONResponse
 from apps.common.auth import is_authenticated
+from apps.common.idempotency import IDEMPOTENCY_KEY_MAX_LENGTH, idempotent
+from apps.common.profiling import ProfiledRoute
+from config import SIMILAR_PRODUCTS_TOP_K
 
 router = APIRouter(
     prefix="/product",
     tags=["product"],
     responses={404: {"description": "Not found"}},
+    route_class=ProfiledRoute,
+)
+
+media_router = APIRouter(
+    prefix="/media",
+    tags=["media"],
+    responses={404: {"description": "Not found"}},
+    route_class=ProfiledRoute,
 )
 
 
@@ -26,7 +51,7 @@ router = APIRouter(
 def get_all_product_route(
     request: Request,
     query_params: ProductListQueryParams = Depends(),
-    db=Depends(get_db),
+    db=Depends(get_read_db),
 ) -> CustomJSONResponse:
     """
     Get all products with optional query parameters for filtering, sorting, and pagination.
@@ -41,19 +66,88 @@ def get_all_product_route(
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@router.get("/facets")
+def get_product_facets_route(
+    request: Request,
+    query_params: ProductFacetQueryParams = Depends(),
+    db=Depends(get_read_db),
+) -> CustomJSONResponse:
+    """
+    Get category, active state and price histogram counts for the filtered products.
+    """
+    try:
+        return get_product_facets_view(query_params, db)
+
+    except Exception as e:
+        print(f"Error in get_product_facets_route: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.get("/batch")
+def get_products_batch_route(
+    request: Request,
+    ids: str = Query(..., description="Comma-separated product ids"),
+    db=Depends(get_read_db),
+) -> CustomJSONResponse:
+    """
+    Get specific products by id, in the requested order.
+    """
+    try:
+        product_ids = [int(product_id) for product_id in ids.split(",") if product_id.strip()]
+    except ValueError:
+        return CustomJSONResponse(
+            content={},
+            message="ids must be a comma-separated list of integers",
+            status_code=400,
+        )
+    try:
+        return get_products_batch_view(product_ids, db)
+
+    except Exception as e:
+        print(f"Error in get_products_batch_route: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.post("/batch")
+def post_products_batch_route(
+    request: Request,
+    batch: ProductBatchRequest,
+    db=Depends(get_read_db),
+) -> CustomJSONResponse:
+    """
+    Get specific products by id, for id lists too long for a query string.
+    """
+    try:
+        return get_products_batch_view(batch.ids, db)
+
+    except Exception as e:
+        print(f"Error in post_products_batch_route: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+
 @router.post("")
 def create_product_route(
     request: Request,
     product: ProductCreate,
     db=Depends(get_db),
     is_authenticated=Depends(is_authenticated),
+    idempotency_key: Optional[str] = Header(
+        None, alias="Idempotency-Key", max_length=IDEMPOTENCY_KEY_MAX_LENGTH
+    ),
 ):
     """
-    Create a new product.
+    Create a new product. A retry with the same Idempotency-Key returns the
+    original response.
     """
     try:
         user_id = request.state.user_id
-        response = create_product_view(product=product, db=db, product_owner_id=user_id)
+        response = idempotent(
+            ("product", user_id),
+            idempotency_key,
+            product.model_dump_json().encode(),
+            lambda: create_product_view(product=product, db=db, product_owner_id=user_id),
+            db_session=db,
+        )
         return response
 
     except Exception as e:
@@ -103,15 +197,77 @@ def update_product_route(
         )
 
         return updated_product
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"Error in update_product_route: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@router.post("/{product_id}/photo")
+def upload_product_photo_route(
+    request: Request,
+    product_id: int,
+    photo: UploadFile = File(...),
+    db=Depends(get_db),
+    is_authenticated=Depends(is_authenticated),
+):
+    """
+    Upload a photo for a product. Thumbnails are generated in the background.
+    """
+    try:
+        user_id = request.state.user_id
+        return upload_product_photo_view(
+            product_id=product_id, user_id=user_id, photo=photo, db=db
+        )
+    except Exception as e:
+        print(f"Error in upload_product_photo_route: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.post("/{product_id}/restore")
+def restore_product_route(
+    request: Request,
+    product_id: int,
+    db=Depends(get_db),
+    is_authenticated=Depends(is_authenticated),
+):
+    """
+    Restore an archived product. It comes back inactive.
+    """
+    try:
+        user_id = request.state.user_id
+        return restore_product_view(product_id=product_id, user_id=user_id, db=db)
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"Error in restore_product_route: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.get("/{product_id}/similar")
+def get_similar_products_route(
+    request: Request,
+    product_id: int,
+    limit: int = Query(SIMILAR_PRODUCTS_TOP_K, gt=0, le=SIMILAR_PRODUCTS_TOP_K),
+    db=Depends(get_read_db),
+) -> CustomJSONResponse:
+    """
+    Get the products most similar to a product, precomputed in the background.
+    """
+    try:
+        return get_similar_products_view(product_id=product_id, limit=limit, db=db)
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"Error in get_similar_products_route: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+
 @router.get("/category")
 def get_all_product_categories_route(
     request: Request,
-    db=Depends(get_db),
+    db=Depends(get_read_db),
 ) -> CustomJSONResponse:
     """
     Get all product Category.
@@ -129,7 +285,7 @@ def get_all_product_categories_route(
 def get_user_products_route(
     request: Request,
     query_params: ProductListQueryParams = Depends(),
-    db=Depends(get_db),
+    db=Depends(get_read_db),
     is_authenticated=Depends(is_authenticated),
 ) -> CustomJSONResponse:
     """
@@ -148,3 +304,11 @@ def get_user_products_route(
     except Exception as e:
         print(f"Error in get_user_products_route: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
+
+
+@media_router.get("/{kind}/{filename}")
+def serve_media_route(kind: str, filename: str):
+    """
+    Serve an uploaded product photo or one of its thumbnails.
+    """
+    return serve_media_view(kind, filename)
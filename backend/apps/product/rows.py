@@ -0,0 +1,27 @@
+from datetime import datetime
+from typing import NamedTuple, Optional
+
+
+class ProductRow(NamedTuple):
+    """
+    A product as listed by the API, read straight from a Core result row.
+    `category` is the category name.
+    """
+
+    id: int
+    name: str
+    description: Optional[str]
+    price: float
+    photo_url: Optional[str]
+    is_active: bool
+    category: Optional[str]
+    category_id: Optional[int]
+    created_at: Optional[datetime]
+    updated_at: Optional[datetime]
+
+
+class CategoryRow(NamedTuple):
+    id: int
+    name: str
+    description: Optional[str]
+    is_active: bool
@@ -1,17 +1,99 @@
-from typing import Annotated, Optional, Literal
-from pydantic import BaseModel, conint
+from typing import Annotated, List, Optional, Literal, Tuple
+from pydantic import BaseModel, conint, Field
+from apps.common.fieldsets import parse_fieldset
+from apps.product.rows import ProductRow
+
+# Fields of a serialized product, as accepted by `fields=`
+PRODUCT_FIELDS = ProductRow._fields
 
 
 class ProductListQueryParams(BaseModel):
     page: Annotated[int, conint(gt=0)] = 1
     limit: Annotated[int, conint(gt=0)] = 10
     search: str | None = None
+    search_mode: Literal["substring", "fuzzy"] = Field(
+        "substring",
+        description="fuzzy matches misspelled product names by trigram similarity",
+    )
     category_id: Optional[int] = None
     is_active: Optional[bool] = None
     min_price: Optional[float] = None
     max_price: Optional[float] = None
-    sort_by: Optional[Literal["name", "price", "created_at", "updated_at"]] = "name"
+    sort_by: Optional[
+        Literal["name", "price", "created_at", "updated_at", "relevance"]
+    ] = Field(None, description="Defaults to name, or relevance for fuzzy searches")
     sort_order: Optional[Literal["asc", "desc"]] = "asc"
+    fields: Optional[str] = Field(
+        None, description="Comma-separated product fields to return, e.g. name,price"
+    )
+    include_archived: bool = Field(
+        False, description="Also list archived (long inactive) products"
+    )
+
+    def field_list(self) -> Optional[tuple]:
+        """
+        The requested fieldset, or None for every field. Raises ValueError for
+        unknown field names.
+        """
+        return parse_fieldset(self.fields, PRODUCT_FIELDS)
+
+    def fuzzy(self) -> bool:
+        return self.search_mode == "fuzzy" and bool(self.search)
+
+    def sorting(self) -> Tuple[str, str]:
+        """
+        The (sort_by, sort_order) to list with. Fuzzy searches default to
+        best match first. Raises ValueError for relevance without one.
+        """
+        if self.sort_by == "relevance" and not self.fuzzy():
+            raise ValueError("sort_by=relevance needs search with search_mode=fuzzy")
+        sort_by = self.sort_by or ("relevance" if self.fuzzy() else "name")
+        return sort_by, self.sort_order or "asc"
+
+    def cache_key(self) -> tuple:
+        """
+        Hashable key for caching listings. Values that produce the same query
+        (search casing, empty search, default sorting, field order) map to the
+        same key.
+        """
+        return (
+            self.page,
+            self.limit,
+            self.search.lower() if self.search else None,
+            self.search_mode if self.search else None,
+            self.category_id,
+            self.is_active,
+            self.min_price,
+            self.max_price,
+            *self.sorting(),
+            self.field_list(),
+            self.include_archived,
+        )
+
+
+class ProductFacetQueryParams(BaseModel):
+    search: str | None = None
+    category_id: Optional[int] = None
+    is_active: Optional[bool] = None
+    min_price: Optional[float] = None
+    max_price: Optional[float] = None
+    price_bucket_size: float = Field(
+        5.0, gt=0, description="Width of each price histogram bucket"
+    )
+
+    def cache_key(self) -> tuple:
+        return (
+            self.search.lower() if self.search else None,
+            self.category_id,
+            self.is_active,
+            self.min_price,
+            self.max_price,
+            self.price_bucket_size,
+        )
+
+
+class ProductBatchRequest(BaseModel):
+    ids: List[int] = Field(..., min_length=1)
 
 
 class ProductCreate(BaseModel):
@@ -1,8 +1,177 @@
-from typing import Union, Optional
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+from typing import Callable, List, Union, Optional, Sequence, Tuple
 from fastapi import HTTPException
-from sqlalchemy import select, func, or_, asc, desc
+from sqlalchemy import (
+    select,
+    func,
+    or_,
+    and_,
+    asc,
+    desc,
+    cast,
+    update,
+    Integer,
+    String,
+    bindparam,
+    union_all,
+)
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
-from apps.product.models import Product, Category
+from apps.common.archive import archive_in_batches, archive_scheduler, move_rows
+from apps.common.metrics import register_metrics
+from apps.common.replicas import record_write
+from apps.common.singleflight import SingleFlight
+from apps.common.statements import FilterSet, id_list, in_id_list
+from apps.common.writer import execute_write
+from apps.product.models import Product, Category, ProductArchive, ProductSimilarity
+from apps.product.rows import ProductRow, CategoryRow
+from apps.product.cache import invalidate_product_caches
+from apps.search.services import fuzzy_search, index_product, unindex_product
+from config import ARCHIVE_BATCH_SIZE, PRODUCT_ARCHIVE_AFTER_DAYS
+
+
+product_listing_flight = SingleFlight("product_listing")
+register_metrics("product_listing_singleflight", product_listing_flight.stats)
+
+
+def _product_filter_set(columns) -> FilterSet:
+    """
+    The product listing filters over `columns`, the product table or the
+    union of live and archived products.
+    """
+    return FilterSet(
+        [
+            (
+                "search",
+                or_(
+                    func.lower(columns.name).like(bindparam("search")),
+                    func.lower(columns.description).like(bindparam("search")),
+                ),
+            ),
+            ("fuzzy", in_id_list(columns.id, "fuzzy_ids")),
+            ("user_id", columns.product_owner_id == bindparam("user_id")),
+            ("category_id", columns.category_id == bindparam("category_id")),
+            ("is_active", columns.is_active == bindparam("is_active")),
+            ("min_price", columns.price >= bindparam("min_price")),
+            ("max_price", columns.price <= bindparam("max_price")),
+        ]
+    )
+
+
+product_table = Product.__table__
+product_archive_table = ProductArchive.__table__
+product_filters = _product_filter_set(product_table.c)
+
+# Live and archived products, for listings with include_archived
+products_with_archive = union_all(
+    select(*product_table.c),
+    select(*[product_archive_table.c[column.name] for column in product_table.c]),
+).subquery("product_with_archive")
+products_with_archive_filters = _product_filter_set(products_with_archive.c)
+
+PRODUCT_SORT_COLUMNS = ("name", "price", "created_at", "updated_at")
+# Only with a fuzzy search
+RELEVANCE_SORT = "relevance"
+
+
+def _fuzzy_params(product_ids: Optional[List[int]]) -> Optional[dict]:
+    """
+    Bound parameters of the fuzzy filter: the matching ids (see id_list),
+    and the same ids as ",12,5," so relevance sorting can order by position
+    in the string.
+    """
+    if product_ids is None:
+        return None
+    return {
+        "fuzzy_ids": id_list(product_ids),
+        "fuzzy_rank": "," + ",".join(str(product_id) for product_id in product_ids) + ",",
+    }
+
+
+def _product_filter_shape(
+    search: Union[str, None] = None,
+    fuzzy_ids: Optional[List[int]] = None,
+    category_id: Optional[int] = None,
+    is_active: Optional[bool] = None,
+    min_price: Optional[float] = None,
+    max_price: Optional[float] = None,
+    user_id: Optional[int] = None,
+) -> Tuple[int, dict]:
+    """
+    Reduce the product listing filters to a product_filters shape and its
+    bound parameters.
+    """
+    return product_filters.shape(
+        {
+            "search": f"%{search.lower()}%" if search else None,
+            "fuzzy": _fuzzy_params(fuzzy_ids),
+            "user_id": user_id,
+            "category_id": category_id,
+            "is_active": is_active,
+            "min_price": min_price,
+            "max_price": max_price,
+        }
+    )
+
+
+def _select_products(fields: Sequence[str] = ProductRow._fields, source=product_table):
+    """
+    Core select() of the given product fields from `source`, joining the
+    category name in only when it is requested.
+    """
+    stmt = select(
+        *[
+            Category.name.label("category") if field == "category" else source.c[field]
+            for field in fields
+        ]
+    )
+    if "category" in fields:
+        stmt = stmt.outerjoin(Category, source.c.category_id == Category.id)
+    return stmt
+
+
+@lru_cache(maxsize=512)
+def _product_listing_statements(
+    shape: int,
+    sort_by: str,
+    sort_order: str,
+    fields: Optional[Tuple[str, ...]],
+    include_archived: bool = False,
+):
+    """
+    Build the count and page statements for one filter shape, sort and
+    fieldset. Cached, so SQLAlchemy sees the same statement objects on every
+    call and only the bound parameters (filters, limit, offset) change.
+    With `include_archived` they read the union of live and archived products.
+    """
+    if include_archived:
+        source, filters = products_with_archive, products_with_archive_filters
+    else:
+        source, filters = product_table, product_filters
+    stmt = filters.apply(_select_products(fields or ProductRow._fields, source), shape)
+
+    if sort_by == RELEVANCE_SORT:
+        # Fuzzy matches come best first in fuzzy_rank
+        sort_column = func.instr(
+            bindparam("fuzzy_rank"), "," + cast(source.c.id, String) + ","
+        )
+    else:
+        sort_column = source.c[sort_by if sort_by in PRODUCT_SORT_COLUMNS else "name"]
+    order = desc(sort_column) if sort_order == "desc" else asc(sort_column)
+    page_stmt = (
+        stmt.order_by(order).offset(bindparam("offset")).limit(bindparam("limit"))
+    )
+
+    count_stmt = filters.apply(select(func.count()).select_from(source), shape)
+    return count_stmt, page_stmt
+
+
+register_metrics(
+    "product_listing_statements",
+    lambda: _product_listing_statements.cache_info()._asdict(),
+)
 
 
 def get_all_products(
@@ -10,6 +179,7 @@ def get_all_products(
     page: int = 1,
     limit: int = 10,
     search: Union[str, None] = None,
+    search_mode: str = "substring",
     category_id: Optional[int] = None,
     is_active: Optional[bool] = None,
     min_price: Optional[float] = None,
@@ -17,60 +187,107 @@ def get_all_products(
     sort_by: Optional[str] = "name",
     sort_order: Optional[str] = "asc",
     user_id: Optional[int] = None,
+    fields: Optional[Sequence[str]] = None,
+    include_archived: bool = False,
 ):
     """
-    Fetch products from the sqlite db using SQLAlchemy ORM (sync) with pagination, filtering, and sorting.
+    Fetch products from the sqlite db with pagination, filtering, and sorting.
+    Products are returned as ProductRow tuples read from Core rows, without
+    building ORM entities. With `fields`, only those columns are selected and
+    row mappings are returned instead. Archived products are only listed with
+    `include_archived`. With search_mode="fuzzy" the search matches product
+    names by trigram similarity, and sort_by="relevance" lists the closest
+    matches first.
+    Concurrent calls with the same normalized arguments share one execution.
     """
-    try:
-        offset = (page - 1) * limit
-        stmt = select(Product)
+    # Reads from different databases (primary, replicas) are never shared
+    key = (
+        id(db_session.get_bind()),
+        page,
+        limit,
+        search.lower() if search else None,
+        search_mode if search else None,
+        category_id,
+        is_active,
+        min_price,
+        max_price,
+        sort_by or "name",
+        (sort_order or "asc").lower(),
+        user_id,
+        tuple(fields) if fields else None,
+        include_archived,
+    )
+    return product_listing_flight.do(
+        key,
+        _query_products,
+        db_session,
+        page,
+        limit,
+        search,
+        search_mode,
+        category_id,
+        is_active,
+        min_price,
+        max_price,
+        sort_by,
+        sort_order,
+        user_id,
+        fields,
+        include_archived,
+    )
 
-        # Apply filters
-        if search:
-            search_pattern = f"%{search.lower()}%"
-            stmt = stmt.where(
-                or_(
-                    func.lower(Product.name).like(search_pattern),
-                    func.lower(Product.description).like(search_pattern),
-                )
-            )
-        if user_id is not None:
-            stmt = stmt.where(Product.product_owner_id == user_id)
-        if category_id is not None:
-            stmt = stmt.where(Product.category_id == category_id)
-        if is_active is not None:
-            stmt = stmt.where(Product.is_active == is_active)
-        if min_price is not None:
-            stmt = stmt.where(Product.price >= min_price)
-        if max_price is not None:
-            stmt = stmt.where(Product.price <= max_price)
-
-        # Apply sorting
-        sort_by_field = sort_by or "name"
-        sort_order_direction = sort_order or "asc"
-
-        # Map sort fields to Product attributes
-        sort_mapping = {
-            "name": Product.name,
-            "price": Product.price,
-            "created_at": Product.created_at,
-            "updated_at": Product.updated_at,
-        }
 
-        sort_column = sort_mapping.get(sort_by_field, Product.name)
-        if sort_order_direction.lower() == "desc":
-            stmt = stmt.order_by(desc(sort_column))
-        else:
-            stmt = stmt.order_by(asc(sort_column))
+def _query_products(
+    db_session: Session,
+    page: int,
+    limit: int,
+    search: Union[str, None],
+    search_mode: str,
+    category_id: Optional[int],
+    is_active: Optional[bool],
+    min_price: Optional[float],
+    max_price: Optional[float],
+    sort_by: Optional[str],
+    sort_order: Optional[str],
+    user_id: Optional[int],
+    fields: Optional[Sequence[str]] = None,
+    include_archived: bool = False,
+):
+    try:
+        fuzzy_ids = None
+        if search and search_mode == "fuzzy":
+            # Candidates come from the trigram index instead of a LIKE scan
+            fuzzy_ids = [product_id for product_id, _ in fuzzy_search(db_session, "product", search)]
+            search = None
+        elif sort_by == RELEVANCE_SORT:
+            sort_by = "name"
+        shape, params = _product_filter_shape(
+            search=search,
+            fuzzy_ids=fuzzy_ids,
+            category_id=category_id,
+            is_active=is_active,
+            min_price=min_price,
+            max_price=max_price,
+            user_id=user_id,
+        )
+        count_stmt, page_stmt = _product_listing_statements(
+            shape,
+            sort_by or "name",
+            (sort_order or "asc").lower(),
+            tuple(fields) if fields else None,
+            include_archived,
+        )
 
         # Get total count for pagination
-        count_stmt = select(func.count()).select_from(stmt.subquery())
-        total_count = db_session.execute(count_stmt).scalar() or 0
+        total_count = db_session.execute(count_stmt, params).scalar() or 0
 
         # Apply pagination
-        stmt = stmt.offset(offset).limit(limit)
-        result = db_session.execute(stmt)
-        products = result.scalars().all()
+        params = {**params, "offset": (page - 1) * limit, "limit": limit}
+        result = db_session.execute(page_stmt, params)
+        if fields:
+            products = result.mappings().all()
+        else:
+            products = [ProductRow._make(row) for row in result]
 
         return {
             "success": True,
@@ -89,15 +306,164 @@ def get_all_products(
         )
 
 
-def create_product(db_session: Session, product_data: dict):
+def get_product_facets(
+    db_session: Session,
+    search: Union[str, None] = None,
+    category_id: Optional[int] = None,
+    is_active: Optional[bool] = None,
+    min_price: Optional[float] = None,
+    max_price: Optional[float] = None,
+    price_bucket_size: float = 5.0,
+    user_id: Optional[int] = None,
+) -> dict:
+    """
+    Count the products matching the listing filters per category, per active
+    state and per fixed-width price bucket, plus their min/max price.
+    Everything comes from a single GROUP BY over the filtered products.
+    """
+    try:
+        price_bucket = cast(Product.price / price_bucket_size, Integer).label("bucket")
+        stmt = (
+            select(
+                Product.category_id,
+                Category.name,
+                Product.is_active,
+                price_bucket,
+                func.count(Product.id),
+                func.min(Product.price),
+                func.max(Product.price),
+            )
+            .outerjoin(Category, Product.category_id == Category.id)
+            .group_by(Product.category_id, Category.name, Product.is_active, price_bucket)
+        )
+        shape, params = _product_filter_shape(
+            search=search,
+            category_id=category_id,
+            is_active=is_active,
+            min_price=min_price,
+            max_price=max_price,
+            user_id=user_id,
+        )
+        stmt = product_filters.apply(stmt, shape)
+
+        categories = {}
+        active_counts = {True: 0, False: 0}
+        histogram = {}
+        total = 0
+        lowest_price = None
+        highest_price = None
+        for row_category_id, category_name, row_is_active, bucket, count, low, high in (
+            db_session.execute(stmt, params).all()
+        ):
+            total += count
+            category = categories.setdefault(
+                row_category_id,
+                {"category_id": row_category_id, "category": category_name, "count": 0},
+            )
+            category["count"] += count
+            active_counts[bool(row_is_active)] += count
+            histogram[bucket] = histogram.get(bucket, 0) + count
+            lowest_price = low if lowest_price is None else min(lowest_price, low)
+            highest_price = high if highest_price is None else max(highest_price, high)
+
+        return {
+            "total": total,
+            "categories": sorted(
+                categories.values(), key=lambda category: -category["count"]
+            ),
+            "is_active": [
+                {"is_active": state, "count": count}
+                for state, count in active_counts.items()
+            ],
+            "price_histogram": [
+                {
+                    "min": bucket * price_bucket_size,
+                    "max": (bucket + 1) * price_bucket_size,
+                    "count": histogram[bucket],
+                }
+                for bucket in sorted(histogram)
+            ],
+            "min_price": lowest_price,
+            "max_price": highest_price,
+        }
+    except Exception as e:
+        print(f"Error fetching product facets: {str(e)}")
+        raise HTTPException(
+            status_code=500, detail=f"Error fetching product facets: {str(e)}"
+        )
+
+
+def get_products_by_ids(db_session: Session, product_ids: List[int]) -> List[ProductRow]:
     """
-    Create a new product in the sqlite db using SQLAlchemy ORM (sync).
+    Fetch the given products, with their category names, in a single IN (...) query.
+    Ids that do not exist are left out; the result is in no particular order.
     """
     try:
-        new_product = Product(**product_data)
-        db_session.add(new_product)
-        db_session.commit()
-        db_session.refresh(new_product)
+        stmt = _select_products().where(Product.id.in_(product_ids))
+        return [ProductRow._make(row) for row in db_session.execute(stmt)]
+    except Exception as e:
+        print(f"Error fetching products by id: {str(e)}")
+        raise HTTPException(
+            status_code=500, detail=f"Error fetching products by id: {str(e)}"
+        )
+
+
+def get_similar_products(
+    db_session: Session, product_id: int, limit: int
+) -> Optional[List[Tuple[ProductRow, float]]]:
+    """
+    The precomputed similar products of a product, best first, with their
+    similarity scores. None if the product does not exist. Products
+    deactivated since the last similarity run are left out.
+    """
+    try:
+        if db_session.get(Product, product_id) is None:
+            return None
+        similarity = ProductSimilarity.__table__
+        stmt = (
+            _select_products()
+            .add_columns(similarity.c.score)
+            .join(similarity, similarity.c.similar_product_id == Product.id)
+            .where(similarity.c.product_id == product_id, Product.is_active.is_(True))
+            .order_by(similarity.c.rank)
+            .limit(limit)
+        )
+        return [
+            (ProductRow._make(row[:-1]), row[-1]) for row in db_session.execute(stmt)
+        ]
+    except Exception as e:
+        print(f"Error fetching similar products: {str(e)}")
+        raise HTTPException(
+            status_code=500, detail=f"Error fetching similar products: {str(e)}"
+        )
+
+
+def create_product(db_session: Session, product_data: dict) -> Optional[Product]:
+    """
+    Create a new product with a single INSERT ... ON CONFLICT DO NOTHING
+    RETURNING statement. Returns None if the owner already has a product
+    with the same name (uq_product_owner_name).
+    """
+
+    def insert_product(session: Session) -> Optional[Product]:
+        product = session.execute(
+            insert(Product)
+            .values(**product_data)
+            .on_conflict_do_nothing(index_elements=["product_owner_id", "name"])
+            .returning(Product)
+        ).scalar_one_or_none()
+        if product is not None:
+            # Detached, the RETURNING values stay loaded past the commit
+            session.expunge(product)
+        return product
+
+    try:
+        new_product = execute_write(db_session, insert_product)
+        if new_product is None:
+            return None
+        invalidate_product_caches()
+        record_write(new_product.product_owner_id)
+        index_product(new_product)
         return new_product
     except Exception as e:
         print(f"Error creating product: {str(e)}")
@@ -106,31 +472,38 @@ def create_product(db_session: Session, product_data: dict):
 
 def update_product(
     db_session: Session, product_id: int, product_data: dict, user_id: int
-) -> Product:
+) -> Optional[Product]:
     """
-    Update an existing product by its ID in the sqlite db using SQLAlchemy ORM (sync).
+    Update a product of the user with a single UPDATE ... RETURNING
+    statement. Returns None if the user has no product with this ID.
     """
-    try:
-        product = (
-            db_session.query(Product)
-            .filter(Product.id == product_id, Product.product_owner_id == user_id)
-            .first()
-        )
-        print(f"The Product: {product}")
 
-        if not product:
-            print(f"Product with ID {product_id} not found.")
-            raise HTTPException(
-                status_code=404, detail=f"Product with ID {product_id} not found."
-            )
-
-        for key, value in product_data.items():
-            setattr(product, key, value)
+    def update_row(session: Session) -> Optional[Product]:
+        product = session.execute(
+            update(Product)
+            .where(Product.id == product_id, Product.product_owner_id == user_id)
+            .values(**product_data, updated_at=datetime.now(timezone.utc))
+            .returning(Product)
+            .execution_options(synchronize_session=False)
+        ).scalar_one_or_none()
+        if product is not None:
+            session.expunge(product)
+        return product
 
-        db_session.commit()
-        db_session.refresh(product)
+    try:
+        product = execute_write(db_session, update_row)
+        if product is None:
+            print(f"Product with ID {product_id} not found.")
+            return None
+        invalidate_product_caches()
+        record_write(user_id)
+        index_product(product)
         print(f"Product with ID {product_id} updated successfully.")
         return product
+    except IntegrityError:
+        raise HTTPException(
+            status_code=400, detail="Product with same name already exists"
+        )
     except Exception as e:
         print(f"Error updating product: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error updating product: {str(e)}")
@@ -154,6 +527,9 @@ def delete_product(db_session: Session, product_id: int, user_id: int) -> bool:
 
         db_session.delete(product)
         db_session.commit()
+        invalidate_product_caches()
+        record_write(user_id)
+        unindex_product(product_id)
         print(f"Product with ID {product_id} deleted successfully.")
         return True
     except Exception as e:
@@ -161,37 +537,124 @@ def delete_product(db_session: Session, product_id: int, user_id: int) -> bool:
         raise HTTPException(status_code=500, detail=f"Error deleting product: {str(e)}")
 
 
-def get_all_product_categories(db_session: Session) -> list:
+def set_product_photo(
+    db_session: Session,
+    product_id: int,
+    user_id: int,
+    photo_url: str,
+    store_photo: Callable[[], object],
+) -> Optional[Product]:
     """
-    Fetch all categories from the sqlite db category table using SQLAlchemy ORM (sync).
+    Point a product's photo_url at an uploaded photo. `store_photo` writes the
+    photo's file once the product is found and before the commit, so a failed
+    write leaves photo_url unchanged. Returns None if the product does not
+    exist or is not owned by the user.
     """
     try:
-        stmt = select(Category)
-        result = db_session.execute(stmt)
-        categories = result.scalars().all()
-        return categories
+        product = (
+            db_session.query(Product)
+            .filter(Product.id == product_id, Product.product_owner_id == user_id)
+            .first()
+        )
+        if not product:
+            return None
+
+        store_photo()
+        product.photo_url = photo_url
+        db_session.commit()
+        invalidate_product_caches()
+        record_write(user_id)
+        db_session.refresh(product)
+        return product
     except Exception as e:
-        print(f"Error fetching product categories: {str(e)}")
+        print(f"Error setting product photo: {str(e)}")
         raise HTTPException(
-            status_code=500, detail=f"Error fetching product categories: {str(e)}"
+            status_code=500, detail=f"Error setting product photo: {str(e)}"
         )
 
 
-def product_exists_for_user(
-    db_session: Session, product_name: str, user_id: int
-) -> bool:
+def archive_inactive_products(
+    db_session: Session,
+    older_than_days: float = PRODUCT_ARCHIVE_AFTER_DAYS,
+    batch_size: int = ARCHIVE_BATCH_SIZE,
+) -> int:
     """
-    Check if a product with the same name already exists for the user.
+    Move products that have been inactive for `older_than_days` into
+    product_archive, in batches. Returns the number of products moved.
+    """
+    cutoff = datetime.now(timezone.utc) - timedelta(days=older_than_days)
+    condition = and_(
+        product_table.c.is_active.is_(False),
+        or_(product_table.c.updated_at.is_(None), product_table.c.updated_at < cutoff),
+    )
+    moved = archive_in_batches(
+        db_session, product_table, product_archive_table, condition, batch_size
+    )
+    if moved:
+        invalidate_product_caches()
+        print(f"Archived {moved} inactive products.")
+    return moved
+
+
+archive_scheduler.register(
+    "products", archive_inactive_products, [product_table, product_archive_table]
+)
+
+
+def restore_product(
+    db_session: Session, product_id: int, user_id: int
+) -> Optional[Product]:
+    """
+    Move an archived product back into the product table. It stays inactive
+    until the owner reactivates it. Returns None if the user has no archived
+    product with this id.
     """
     try:
-        stmt = select(Product).where(
-            Product.name == product_name, Product.product_owner_id == user_id
+        archived = db_session.execute(
+            select(product_archive_table.c.id).where(
+                product_archive_table.c.id == product_id,
+                product_archive_table.c.product_owner_id == user_id,
+            )
+        ).first()
+        if archived is None:
+            return None
+
+        move_rows(db_session, product_archive_table, product_table, [product_id])
+        # A fresh updated_at keeps the archiver from taking it straight back
+        db_session.execute(
+            update(product_table)
+            .where(product_table.c.id == product_id)
+            .values(updated_at=datetime.now(timezone.utc))
+        )
+        db_session.commit()
+        invalidate_product_caches()
+        record_write(user_id)
+        product = db_session.get(Product, product_id)
+        index_product(product)
+        return product
+    except IntegrityError:
+        db_session.rollback()
+        raise HTTPException(
+            status_code=409,
+            detail=f"A live product with ID {product_id} or the same name already exists.",
         )
+    except Exception as e:
+        db_session.rollback()
+        print(f"Error restoring product: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error restoring product: {str(e)}")
+
+
+def get_all_product_categories(db_session: Session) -> List[CategoryRow]:
+    """
+    Fetch all categories from the sqlite db category table as CategoryRow tuples.
+    """
+    try:
+        stmt = select(*[getattr(Category, field) for field in CategoryRow._fields])
         result = db_session.execute(stmt)
-        product = result.scalars().first()
-        return product is not None
+        categories = [CategoryRow._make(row) for row in result]
+        return categories
     except Exception as e:
-        print(f"Error checking product existence: {str(e)}")
+        print(f"Error fetching product categories: {str(e)}")
         raise HTTPException(
-            status_code=500, detail=f"Error checking product existence: {str(e)}"
+            status_code=500, detail=f"Error fetching product categories: {str(e)}"
         )
@@ -0,0 +1,276 @@
+"""
+Precomputed "similar products" for the product page.
+
+Each active product is described by three features: its category, its name
+tokens (hashed into a fixed-size, L2-normalized vector) and its price. The
+similarity of two products is
+
+    NAME_WEIGHT * cosine(name vectors)
+    + CATEGORY_WEIGHT * (same category)
+    + PRICE_WEIGHT * min(price) / max(price)
+
+computed with NumPy for a block of products against every product at once,
+so memory stays at block_size x products scores. The top-k of each product
+is stored in product_similarity.
+
+Runs are incremental. Only products whose updated_at differs from the one
+recorded in product_similarity_state are recomputed, plus the products whose
+lists a change can affect: those listing a changed or removed product, and
+those a changed product now beats the last entry of. Scores are symmetric, so
+the second set comes from the changed products' own score blocks.
+"""
+import threading
+import time
+import zlib
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Sequence, Set, Tuple
+
+import numpy as np
+from sqlalchemy import delete, insert, select
+from sqlalchemy.orm import Session
+
+from apps.common.metrics import register_metrics
+from apps.common.text import normalize_text
+from apps.product.models import Product, ProductSimilarity, ProductSimilarityState
+from config import SIMILAR_PRODUCTS_BLOCK_SIZE, SIMILAR_PRODUCTS_TOP_K
+
+NAME_WEIGHT = 0.5
+CATEGORY_WEIGHT = 0.3
+PRICE_WEIGHT = 0.2
+# Size of the hashed name token vectors
+NAME_DIMENSIONS = 256
+
+similarity_table = ProductSimilarity.__table__
+state_table = ProductSimilarityState.__table__
+
+
+class ProductFeatures:
+    """
+    Feature arrays of the active products, row i describing ids[i].
+    """
+
+    def __init__(self, rows: Sequence[Tuple[int, str, Optional[int], float]]):
+        self.ids = np.array([row[0] for row in rows], dtype=np.int64)
+        self.names = np.zeros((len(rows), NAME_DIMENSIONS), dtype=np.float32)
+        for i, (_, name, _, _) in enumerate(rows):
+            for token in normalize_text(name or "").split():
+                # crc32 rather than hash(), which differs between processes
+                self.names[i, zlib.crc32(token.encode()) % NAME_DIMENSIONS] = 1.0
+        norms = np.linalg.norm(self.names, axis=1, keepdims=True)
+        np.divide(self.names, norms, out=self.names, where=norms > 0)
+        self.categories = np.array(
+            [-1 if row[2] is None else row[2] for row in rows], dtype=np.int64
+        )
+        self.prices = np.maximum(
+            np.array([row[3] or 0.0 for row in rows], dtype=np.float32), 0.01
+        )
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def scores(self, rows: np.ndarray) -> np.ndarray:
+        """
+        Similarity of the products at `rows` to every product, one row each.
+        A product's similarity to itself is -inf.
+        """
+        scores = NAME_WEIGHT * (self.names[rows] @ self.names.T)
+        categories = self.categories[rows][:, None]
+        scores += CATEGORY_WEIGHT * (
+            (categories == self.categories[None, :]) & (categories >= 0)
+        )
+        prices = self.prices[rows][:, None]
+        scores += PRICE_WEIGHT * (
+            np.minimum(prices, self.prices) / np.maximum(prices, self.prices)
+        )
+        scores[np.arange(len(rows)), rows] = -np.inf
+        return scores
+
+
+def top_k(scores: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    (column indices, scores) of the k highest scores of each row, best first.
+    """
+    k = min(k, scores.shape[1] - 1)
+    if k <= 0:
+        empty = np.empty((scores.shape[0], 0))
+        return empty.astype(np.int64), empty
+    columns = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    best = np.take_along_axis(scores, columns, axis=1)
+    order = np.argsort(-best, axis=1, kind="stable")
+    return np.take_along_axis(columns, order, axis=1), np.take_along_axis(best, order, axis=1)
+
+
+def _blocks(rows: Sequence[int], block_size: int):
+    for start in range(0, len(rows), block_size):
+        yield np.array(rows[start : start + block_size], dtype=np.int64)
+
+
+def _delete_lists(db_session: Session, product_ids) -> None:
+    db_session.execute(
+        delete(similarity_table).where(similarity_table.c.product_id.in_(product_ids))
+    )
+    db_session.execute(delete(state_table).where(state_table.c.product_id.in_(product_ids)))
+
+
+def refresh_similar_products(
+    db_session: Session,
+    full: bool = False,
+    k: int = SIMILAR_PRODUCTS_TOP_K,
+    block_size: int = SIMILAR_PRODUCTS_BLOCK_SIZE,
+) -> dict:
+    """
+    Bring product_similarity up to date with the active products, recomputing
+    every list with `full`. Commits once per block of recomputed products.
+    Returns counts of what was done.
+    """
+    started = time.perf_counter()
+    products = db_session.execute(
+        select(Product.id, Product.name, Product.category_id, Product.price, Product.updated_at)
+        .where(Product.is_active.is_(True))
+        .order_by(Product.id)
+    ).all()
+    features = ProductFeatures([row[:4] for row in products])
+    position = {product_id: i for i, product_id in enumerate(features.ids.tolist())}
+
+    recorded = dict(
+        db_session.execute(
+            select(state_table.c.product_id, state_table.c.source_updated_at)
+        ).all()
+    )
+    lists: Dict[int, List[int]] = {}
+    last_scores: Dict[int, float] = {}
+    for product_id, similar_product_id, score in db_session.execute(
+        select(
+            similarity_table.c.product_id,
+            similarity_table.c.similar_product_id,
+            similarity_table.c.score,
+        ).order_by(similarity_table.c.product_id, similarity_table.c.rank)
+    ):
+        lists.setdefault(product_id, []).append(similar_product_id)
+        last_scores[product_id] = score
+
+    changed = [
+        position[row.id]
+        for row in products
+        if full or row.id not in recorded or recorded[row.id] != row.updated_at
+    ]
+    removed = set(recorded) - set(position)
+    dirty: Set[int] = set(changed)
+
+    touched = {int(features.ids[i]) for i in changed} | removed
+    for product_id, similar in lists.items():
+        if product_id in position and touched.intersection(similar):
+            dirty.add(position[product_id])
+
+    if changed and len(dirty) < len(features):
+        # The score a newcomer must beat to enter each list; short lists
+        # take anything
+        full_length = min(k, len(features) - 1)
+        thresholds = np.full(len(features), -np.inf, dtype=np.float32)
+        for product_id, i in position.items():
+            if len(lists.get(product_id, ())) >= full_length:
+                thresholds[i] = last_scores[product_id]
+        for rows in _blocks(changed, block_size):
+            best = features.scores(rows).max(axis=0)
+            dirty.update(np.nonzero(best > thresholds)[0].tolist())
+
+    if removed:
+        _delete_lists(db_session, removed)
+        db_session.commit()
+
+    for rows in _blocks(sorted(dirty), block_size):
+        columns, scores = top_k(features.scores(rows), k)
+        product_ids = features.ids[rows].tolist()
+        now = datetime.now(timezone.utc)
+        _delete_lists(db_session, product_ids)
+        entries = [
+            {
+                "product_id": product_id,
+                "rank": rank,
+                "similar_product_id": int(features.ids[column]),
+                "score": round(float(score), 4),
+            }
+            for product_id, product_columns, product_scores in zip(product_ids, columns, scores)
+            for rank, (column, score) in enumerate(zip(product_columns, product_scores))
+        ]
+        if entries:
+            db_session.execute(insert(similarity_table), entries)
+        db_session.execute(
+            insert(state_table),
+            [
+                {
+                    "product_id": product_id,
+                    "source_updated_at": products[i].updated_at,
+                    "computed_at": now,
+                }
+                for product_id, i in zip(product_ids, rows.tolist())
+            ],
+        )
+        db_session.commit()
+
+    return {
+        "products": len(features),
+        "changed": len(changed),
+        "recomputed": len(dirty),
+        "removed": len(removed),
+        "seconds": round(time.perf_counter() - started, 3),
+    }
+
+
+class SimilarProductsJob:
+    """
+    Runs refresh_similar_products periodically on a daemon thread and keeps
+    the last run's counts for /api/metrics.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.runs = 0
+        self.last_run: Optional[dict] = None
+        self.last_run_at: Optional[str] = None
+        self.last_error: Optional[str] = None
+
+    def run_once(self, session_factory, full: bool = False) -> Optional[dict]:
+        with self._lock:
+            db_session = session_factory()
+            try:
+                self.last_run = refresh_similar_products(db_session, full=full)
+            except Exception as e:
+                db_session.rollback()
+                print(f"Error computing similar products: {str(e)}")
+                self.last_error = str(e)
+                return None
+            finally:
+                db_session.close()
+            self.runs += 1
+            self.last_run_at = datetime.now(timezone.utc).isoformat()
+            return self.last_run
+
+    def start(self, session_factory, interval_seconds: float) -> Optional[threading.Thread]:
+        """
+        Run every `interval_seconds`, starting one interval from now
+        (0 disables).
+        """
+        if interval_seconds <= 0:
+            return None
+
+        def run_forever():
+            while True:
+                time.sleep(interval_seconds)
+                self.run_once(session_factory)
+
+        thread = threading.Thread(target=run_forever, name="similar-products", daemon=True)
+        thread.start()
+        return thread
+
+    def stats(self) -> dict:
+        return {
+            "runs": self.runs,
+            "last_run_at": self.last_run_at,
+            "last_run": self.last_run,
+            "last_error": self.last_error,
+        }
+
+
+similar_products_job = SimilarProductsJob()
+register_metrics("similar_products", similar_products_job.stats)
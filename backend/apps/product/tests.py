@@ -1,13 +1,35 @@
+import io
+import multiprocessing
+import os
+import time
+import numpy as np
 import pytest
 from fastapi.testclient import TestClient
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.pool import StaticPool
-from datetime import datetime, timezone
+from datetime import datetime, timedelta, timezone
 
 from main import app
 from apps.common.database import get_db, Base
 from apps.product.models import Product, Category
+from apps.product.cache import product_list_cache
+from apps.product import photos
+from apps.product.services import (
+    create_product,
+    get_all_products,
+    _product_listing_statements,
+    archive_inactive_products,
+    update_product,
+)
+from apps.product.similarity import ProductFeatures, refresh_similar_products, top_k
+from apps.product.models import ProductArchive
+from apps.common.archive import archive_scheduler
+from apps.common.writer import write_coordinator
+from apps.common.idempotency import idempotency_store
+from apps.product.rows import ProductRow
+from apps.common.replicas import configure_replicas, refresh_sqlite_replica
+from apps.user.services import create_access_token
 from apps.user.models import User, UserTypeEnum
 from config import PWD_CONTEXT
 
@@ -95,6 +117,25 @@ def test_user(setup_database):
         db.close()
 
 
+@pytest.fixture(scope="module")
+def other_user(setup_database):
+    """A second seller, owning none of the test products."""
+    db = TestingSessionLocal()
+    try:
+        user = User(
+            username="otherfarmer",
+            email="otherfarmer@example.com",
+            hashed_password=PWD_CONTEXT.hash("otherpassword123"),
+            user_type=UserTypeEnum.seller,
+        )
+        db.add(user)
+        db.commit()
+        db.refresh(user)
+        return user
+    finally:
+        db.close()
+
+
 @pytest.fixture
 def test_products(setup_database, test_category, test_user):
     """Create test products with different prices and names for sorting tests."""
@@ -107,6 +148,11 @@ def test_products(setup_database, test_category, test_user):
             {"name": "Dates", "price": 8.99, "description": "Sweet dates"},
             {"name": "Eggplant", "price": 4.99, "description": "Purple eggplant"},
         ]
+        # Names are unique per owner; replace the copies of earlier tests
+        db.query(Product).filter(
+            Product.product_owner_id == test_user.id,
+            Product.name.in_([product_data["name"] for product_data in products_data]),
+        ).delete(synchronize_session=False)
 
         products = []
         for i, product_data in enumerate(products_data):
@@ -310,6 +356,752 @@ class TestProductCategories:
         assert "description" in category
 
 
+class TestProductBatch:
+    """Test fetching products by id."""
+
+    def test_batch_preserves_order_and_lists_missing(self, test_products):
+        """Products come back in the requested order with their category."""
+        ids = [test_products[2].id, 999999, test_products[0].id, test_products[2].id]
+        response = client.get(
+            "/api/product/batch", params={"ids": ",".join(map(str, ids))}
+        )
+        assert response.status_code == 200
+        data = response.json()["data"]
+        assert [product["id"] for product in data["products"]] == [
+            test_products[2].id,
+            test_products[0].id,
+        ]
+        assert data["products"][0]["category"] == "Test Vegetables"
+        assert data["missing_ids"] == [999999]
+
+    def test_batch_post(self, test_products):
+        """Long id lists can be sent in the request body."""
+        ids = [product.id for product in reversed(test_products)]
+        response = client.post("/api/product/batch", json={"ids": ids})
+        assert response.status_code == 200
+        data = response.json()["data"]
+        assert [product["id"] for product in data["products"]] == ids
+        assert data["missing_ids"] == []
+
+    def test_batch_rejects_bad_ids(self, setup_database):
+        """Malformed and oversized id lists are rejected."""
+        assert client.get("/api/product/batch?ids=1,abc").status_code == 400
+        ids = list(range(1, 2000))
+        assert client.post("/api/product/batch", json={"ids": ids}).status_code == 400
+
+
+class TestSparseFieldsets:
+    """Test the fields= query parameter on product listings."""
+
+    def test_fields_narrow_products(self, test_products):
+        """Only the requested fields (plus id) are returned."""
+        response = client.get("/api/product?fields=price,name&sort_by=price")
+        assert response.status_code == 200
+        products = response.json()["data"]["products"]
+        assert {key: products[0][key] for key in ("name", "price")} == {
+            "name": "Bananas",
+            "price": 2.99,
+        }
+        assert all(set(product) == {"id", "name", "price"} for product in products)
+
+    def test_fields_category_and_dates(self, test_products):
+        """The category name is joined in and dates are ISO formatted."""
+        response = client.get("/api/product?fields=category,created_at,is_active")
+        product = response.json()["data"]["products"][0]
+        assert product["category"] == "Test Vegetables"
+        assert product["is_active"] is True
+        assert "T" in product["created_at"]
+
+    def test_unknown_field(self, setup_database):
+        """Unknown field names are rejected."""
+        response = client.get("/api/product?fields=name,secret")
+        assert response.status_code == 400
+        assert "secret" in response.json()["message"]
+
+
+class TestProductRows:
+    """Test that listings are read as row tuples, not ORM entities."""
+
+    def test_listing_returns_rows_without_orm_entities(self, test_products):
+        db = TestingSessionLocal()
+        try:
+            result = get_all_products(db, search="carrots")
+            assert result["data"]
+            assert all(isinstance(product, ProductRow) for product in result["data"])
+            assert result["data"][0].category == "Test Vegetables"
+            assert len(db.identity_map) == 0
+        finally:
+            db.close()
+
+
+class TestListingStatements:
+    """Test reuse of the prebuilt listing statements."""
+
+    def test_same_filter_shape_reuses_statement(self, test_products):
+        """Different filter values with the same shape share one statement."""
+        product_list_cache.clear()
+        client.get("/api/product?search=apples&min_price=1")
+        before = _product_listing_statements.cache_info()
+        response = client.get("/api/product?search=bananas&min_price=2")
+        after = _product_listing_statements.cache_info()
+
+        assert after.hits == before.hits + 1
+        assert after.misses == before.misses
+        names = [product["name"] for product in response.json()["data"]["products"]]
+        assert set(names) == {"Bananas"}
+
+
+class TestProductListCache:
+    """Test the response cache in front of the product listing."""
+
+    def test_repeated_listing_is_served_from_cache(self, test_products):
+        """Identical listing requests hit the cache after the first one."""
+        product_list_cache.clear()
+        first = client.get("/api/product?sort_by=price&limit=3")
+        second = client.get("/api/product?limit=3&sort_by=price&sort_order=asc")
+
+        assert first.status_code == 200
+        assert second.status_code == 200
+        assert first.headers["X-Cache"] == "MISS"
+        assert second.headers["X-Cache"] == "HIT"
+        assert first.json() == second.json()
+
+    def test_search_casing_shares_cache_entry(self, test_products):
+        """Searches differing only by case map to the same cache entry."""
+        product_list_cache.clear()
+        client.get("/api/product?search=Apple")
+        response = client.get("/api/product?search=apple")
+
+        assert response.headers["X-Cache"] == "HIT"
+
+    def test_create_product_invalidates_cache(self, test_products, test_user):
+        """Committing a product write makes the next listing a cache miss."""
+        product_list_cache.clear()
+        url = "/api/product?search=zucchini"
+        assert client.get(url).json()["data"]["products"] == []
+        assert client.get(url).headers["X-Cache"] == "HIT"
+
+        db = TestingSessionLocal()
+        try:
+            create_product(
+                db,
+                {
+                    "name": "Zucchini",
+                    "price": 1.99,
+                    "product_owner_id": test_user.id,
+                },
+            )
+        finally:
+            db.close()
+
+        response = client.get(url)
+        assert response.headers["X-Cache"] == "MISS"
+        names = [product["name"] for product in response.json()["data"]["products"]]
+        assert "Zucchini" in names
+
+    def test_metrics_require_token(self, monkeypatch):
+        """Cache counters are only served with the configured metrics token."""
+        monkeypatch.setattr("apps.common.metrics.METRICS_TOKEN", None)
+        assert client.get("/api/metrics").status_code == 404
+
+        monkeypatch.setattr("apps.common.metrics.METRICS_TOKEN", "metrics-secret")
+        assert client.get("/api/metrics").status_code == 401
+        assert client.get(
+            "/api/metrics", headers={"X-Metrics-Token": "wrong"}
+        ).status_code == 401
+
+        response = client.get("/api/metrics", headers={"X-Metrics-Token": "metrics-secret"})
+        assert response.status_code == 200
+        assert "product_list_cache" in response.json()
+
+
+def product_statements(send) -> tuple:
+    """
+    Call `send()` and return its response with the kinds of the statements
+    it ran against the product table.
+    """
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if " product" in statement:
+            statements.append(statement.split()[0])
+
+    event.listen(engine, "before_cursor_execute", record)
+    try:
+        response = send()
+    finally:
+        event.remove(engine, "before_cursor_execute", record)
+    return response, statements
+
+
+class TestSingleStatementWrites:
+    """Test that product creates and updates are one statement each."""
+
+    def test_duplicate_name_is_one_statement(self, test_products, test_user):
+        response, statements = product_statements(
+            lambda: client.post(
+                "/api/product",
+                json={"name": "Apples", "price": 1.0},
+                headers=auth_headers(test_user),
+            )
+        )
+        assert response.status_code == 400
+        assert response.json()["message"] == "Product with same name already exists"
+        assert statements == ["INSERT"]
+
+    def test_update_is_one_statement(self, test_products, test_user):
+        product_id = test_products[1].id
+        response, statements = product_statements(
+            lambda: client.patch(
+                f"/api/product/{product_id}",
+                json={"price": 3.25},
+                headers=auth_headers(test_user),
+            )
+        )
+        assert response.status_code == 200
+        product = response.json()["data"]["product"]
+        assert (product["name"], product["price"]) == ("Bananas", 3.25)
+        assert statements == ["UPDATE"]
+
+        response = client.patch(
+            f"/api/product/{product_id}",
+            json={"name": "Apples"},
+            headers=auth_headers(test_user),
+        )
+        assert response.status_code == 400
+
+    def test_update_of_other_users_product(self, test_products, other_user):
+        response = client.patch(
+            f"/api/product/{test_products[0].id}",
+            json={"price": 1.0},
+            headers=auth_headers(other_user),
+        )
+        assert response.status_code == 404
+
+
+class TestWriteCoordinator:
+    """Test product writes through the group-commit writer thread."""
+
+    def test_create_and_update_through_writer(self, test_products, test_user):
+        write_coordinator.start(TestingSessionLocal)
+        try:
+            units = write_coordinator.stats()["units"]
+            response = client.post(
+                "/api/product",
+                json={"name": "Parsnips", "price": 2.0},
+                headers=auth_headers(test_user),
+            )
+            assert response.status_code == 201
+            product_id = response.json()["data"]["product"]["id"]
+            response = client.patch(
+                f"/api/product/{product_id}",
+                json={"name": "Apples"},
+                headers=auth_headers(test_user),
+            )
+            assert response.status_code == 400
+            assert write_coordinator.stats()["units"] == units + 2
+        finally:
+            write_coordinator.stop()
+
+        db = TestingSessionLocal()
+        try:
+            assert db.get(Product, product_id).name == "Parsnips"
+        finally:
+            db.close()
+
+
+class TestIdempotentCreate:
+    """Test Idempotency-Key on POST /api/product."""
+
+    def test_retry_returns_original_product(self, test_products, test_user):
+        headers = {**auth_headers(test_user), "Idempotency-Key": "create-okra-1"}
+        payload = {"name": "Okra", "price": 2.5}
+
+        first = client.post("/api/product", json=payload, headers=headers)
+        retry = client.post("/api/product", json=payload, headers=headers)
+        assert first.status_code == 201
+        assert retry.status_code == 201
+        assert retry.headers["Idempotent-Replayed"] == "true"
+        assert retry.json() == first.json()
+
+        db = TestingSessionLocal()
+        try:
+            assert db.query(Product).filter(Product.name == "Okra").count() == 1
+        finally:
+            db.close()
+
+        other = client.post(
+            "/api/product", json={"name": "Okra", "price": 3.0}, headers=headers
+        )
+        assert other.status_code == 422
+
+    def test_retry_on_another_worker(self, test_products, test_user):
+        """A retry handled by a worker that never saw the key still replays."""
+        headers = {**auth_headers(test_user), "Idempotency-Key": "create-kale-1"}
+        payload = {"name": "Kale", "price": 1.5}
+
+        first = client.post("/api/product", json=payload, headers=headers)
+        idempotency_store.clear()
+        retry = client.post("/api/product", json=payload, headers=headers)
+        assert first.status_code == 201
+        assert retry.status_code == 201
+        assert retry.headers["Idempotent-Replayed"] == "true"
+        assert retry.json() == first.json()
+
+        db = TestingSessionLocal()
+        try:
+            assert db.query(Product).filter(Product.name == "Kale").count() == 1
+        finally:
+            db.close()
+
+
+class TestProductFacets:
+    """Test the product facets endpoint."""
+
+    def test_facet_counts_are_consistent(self, test_products):
+        """Every facet adds up to the total number of matching products."""
+        response = client.get("/api/product/facets?price_bucket_size=2")
+
+        assert response.status_code == 200
+        facets = response.json()["data"]["facets"]
+        total = facets["total"]
+        assert total > 0
+        assert sum(category["count"] for category in facets["categories"]) == total
+        assert sum(state["count"] for state in facets["is_active"]) == total
+        assert sum(bucket["count"] for bucket in facets["price_histogram"]) == total
+        for bucket in facets["price_histogram"]:
+            assert bucket["max"] - bucket["min"] == 2
+
+    def test_facets_apply_filters(self, test_products, test_category):
+        """Facets only count the products matching the filters."""
+        response = client.get("/api/product/facets?search=eggplant&price_bucket_size=5")
+
+        facets = response.json()["data"]["facets"]
+        assert facets["min_price"] == 4.99
+        assert facets["max_price"] == 4.99
+        assert [bucket["min"] for bucket in facets["price_histogram"]] == [0]
+        assert facets["categories"][0]["category"] == test_category.name
+
+    def test_facets_are_cached(self, test_products):
+        """Repeated facet requests are served from the cache."""
+        client.get("/api/product/facets?search=dates")
+        response = client.get("/api/product/facets?search=Dates")
+
+        assert response.headers["X-Cache"] == "HIT"
+
+    def test_invalid_bucket_size(self, setup_database):
+        """The price bucket size must be positive."""
+        response = client.get("/api/product/facets?price_bucket_size=0")
+
+        assert response.status_code == 422
+
+
+@pytest.fixture
+def sqlite_replica(setup_database):
+    """Route reads to a SQLite copy of the test database."""
+    replica_path = "./test_products_replica.db"
+    refresh_sqlite_replica(engine, replica_path)
+    configure_replicas([f"sqlite:///{replica_path}"])
+    product_list_cache.clear()
+    yield replica_path
+    configure_replicas([])
+    product_list_cache.clear()
+    os.remove(replica_path)
+
+
+class TestReadReplicas:
+    """Test read routing to replicas."""
+
+    def test_listing_reads_from_replica(self, sqlite_replica, test_user):
+        """Anonymous listings only see writes once the replica is refreshed."""
+        db = TestingSessionLocal()
+        try:
+            create_product(
+                db, {"name": "Kiwi", "price": 0.5, "product_owner_id": test_user.id}
+            )
+        finally:
+            db.close()
+
+        response = client.get("/api/product?search=kiwi")
+        assert response.json()["data"]["products"] == []
+
+        refresh_sqlite_replica(engine, sqlite_replica)
+        response = client.get("/api/product?search=kiwi")
+        names = [product["name"] for product in response.json()["data"]["products"]]
+        assert names == ["Kiwi"]
+
+    def test_lagging_replica_is_not_cached(self, sqlite_replica, test_user):
+        """A listing built on a lagging replica is never served from the cache."""
+        token = create_access_token(
+            {
+                "user_id": test_user.id,
+                "username": test_user.username,
+                "user_type": test_user.user_type.value,
+            }
+        )
+        headers = {"Authorization": f"Bearer {token}"}
+        response = client.post(
+            "/api/product", json={"name": "Mango", "price": 1.25}, headers=headers
+        )
+        assert response.status_code == 201
+
+        response = client.get("/api/product?search=mango")
+        assert response.json()["data"]["products"] == []
+
+        response = client.get("/api/product?search=mango", headers=headers)
+        names = [product["name"] for product in response.json()["data"]["products"]]
+        assert names == ["Mango"]
+
+    def test_seller_reads_own_writes(self, sqlite_replica, test_user):
+        """A seller who just wrote reads from the primary."""
+        db = TestingSessionLocal()
+        try:
+            create_product(
+                db, {"name": "Lychee", "price": 4.5, "product_owner_id": test_user.id}
+            )
+        finally:
+            db.close()
+
+        token = create_access_token(
+            {
+                "user_id": test_user.id,
+                "username": test_user.username,
+                "user_type": test_user.user_type.value,
+            }
+        )
+        response = client.get(
+            "/api/product/user-products?search=lychee",
+            headers={"Authorization": f"Bearer {token}"},
+        )
+        assert response.status_code == 200
+        names = [product["name"] for product in response.json()["data"]["products"]]
+        assert names == ["Lychee"]
+
+
+@pytest.fixture
+def media_root(tmp_path, monkeypatch):
+    """Store uploaded photos in a temporary directory."""
+    monkeypatch.setattr(photos, "MEDIA_ROOT", str(tmp_path))
+    return tmp_path
+
+
+def make_png(color="red", size=(800, 600)) -> bytes:
+    from PIL import Image
+
+    buffer = io.BytesIO()
+    Image.new("RGB", size, color).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def auth_headers(user) -> dict:
+    token = create_access_token(
+        {
+            "user_id": user.id,
+            "username": user.username,
+            "user_type": user.user_type.value,
+        }
+    )
+    return {"Authorization": f"Bearer {token}"}
+
+
+class TestProductPhotos:
+    """Test product photo upload and media serving."""
+
+    def test_upload_sets_photo_url_and_generates_thumbnails(
+        self, media_root, test_products, test_user
+    ):
+        """An upload stores the original and thumbnails appear in the background."""
+        product = test_products[0]
+        response = client.post(
+            f"/api/product/{product.id}/photo",
+            files={"photo": ("apples.png", make_png(), "image/png")},
+            headers=auth_headers(test_user),
+        )
+        assert response.status_code == 201
+        data = response.json()["data"]
+        photo_url = data["product"]["photo_url"]
+        assert photo_url == data["photo"]["variants"]["640"]
+
+        original = client.get(data["photo"]["original"])
+        assert original.status_code == 200
+        assert "immutable" in original.headers["cache-control"]
+
+        deadline = time.monotonic() + 30
+        thumbnail = client.get(photo_url)
+        while thumbnail.headers["content-type"] != "image/webp":
+            assert time.monotonic() < deadline, "thumbnail was not generated"
+            assert thumbnail.headers["cache-control"] == "no-cache"
+            time.sleep(0.2)
+            thumbnail = client.get(photo_url)
+        assert "immutable" in thumbnail.headers["cache-control"]
+
+        from PIL import Image
+
+        with Image.open(io.BytesIO(thumbnail.content)) as image:
+            assert max(image.size) == 640
+
+    def test_upload_rejects_non_images(self, media_root, test_products, test_user):
+        """Files that are not images are rejected before anything is stored."""
+        response = client.post(
+            f"/api/product/{test_products[0].id}/photo",
+            files={"photo": ("notes.png", b"not an image", "image/png")},
+            headers=auth_headers(test_user),
+        )
+        assert response.status_code == 400
+        assert list(media_root.iterdir()) == []
+
+    def test_upload_to_other_users_product(self, media_root, test_products, other_user):
+        """Only the owner can change a product photo."""
+        response = client.post(
+            f"/api/product/{test_products[0].id}/photo",
+            files={"photo": ("apples.png", make_png(), "image/png")},
+            headers=auth_headers(other_user),
+        )
+        assert response.status_code == 404
+        assert list(media_root.iterdir()) == []
+
+    def test_failed_write_keeps_photo_url(
+        self, media_root, test_products, test_user, monkeypatch
+    ):
+        """If the original cannot be stored, the product keeps its photo_url."""
+        product = test_products[0]
+
+        def disk_full(data, digest, extension):
+            raise OSError(28, "No space left on device")
+
+        monkeypatch.setattr(photos, "store_original", disk_full)
+        response = client.post(
+            f"/api/product/{product.id}/photo",
+            files={"photo": ("apples.png", make_png("green"), "image/png")},
+            headers=auth_headers(test_user),
+        )
+        assert response.status_code == 500
+
+        db = TestingSessionLocal()
+        try:
+            assert db.get(Product, product.id).photo_url == product.photo_url
+        finally:
+            db.close()
+
+    def test_unknown_media_is_not_found(self, media_root):
+        """Only content-hash file names under the known kinds are served."""
+        assert client.get("/api/media/originals/../../config.py").status_code == 404
+        assert client.get(f"/api/media/thumbs/{'0' * 64}_640.webp").status_code == 404
+
+    def test_shutdown_stops_thumbnail_workers(self, media_root):
+        """Queued thumbnails are finished and the worker processes exit."""
+        data = make_png("green")
+        digest = photos.content_digest(data)
+        photos.store_original(data, digest, "png")
+        future = photos.schedule_thumbnails(digest)
+
+        photos.shutdown_thumbnail_workers()
+
+        assert future.done() and future.exception() is None
+        assert multiprocessing.active_children() == []
+        assert os.path.exists(
+            photos.media_path("thumbs", photos.thumbnail_filename(digest, 640))
+        )
+
+
+@pytest.fixture
+def archived_product(test_products, test_category, test_user):
+    """An inactive product, untouched for a week, moved to the archive."""
+    db = TestingSessionLocal()
+    try:
+        db.query(Product).filter(
+            Product.product_owner_id == test_user.id,
+            Product.name == "Stale Turnips",
+        ).delete(synchronize_session=False)
+        week_ago = datetime.now(timezone.utc) - timedelta(days=7)
+        stale = Product(
+            name="Stale Turnips",
+            price=1.25,
+            category_id=test_category.id,
+            product_owner_id=test_user.id,
+            is_active=False,
+            created_at=week_ago,
+            updated_at=week_ago,
+        )
+        db.add(stale)
+        db.commit()
+        stale_id = stale.id
+
+        assert archive_inactive_products(db, older_than_days=1) >= 1
+        return stale_id
+    finally:
+        db.close()
+
+
+class TestProductArchive:
+    """Test archiving inactive products out of the live table."""
+
+    def test_archived_product_leaves_live_table(self, archived_product):
+        db = TestingSessionLocal()
+        try:
+            assert db.get(Product, archived_product) is None
+            archived = db.get(ProductArchive, archived_product)
+            assert archived.name == "Stale Turnips"
+            assert archived.archived_at is not None
+        finally:
+            db.close()
+
+    def test_listing_includes_archived_on_request(self, archived_product):
+        response = client.get("/api/product?search=turnips")
+        names = [product["name"] for product in response.json()["data"]["products"]]
+        assert "Stale Turnips" not in names
+
+        response = client.get("/api/product?search=turnips&include_archived=true")
+        names = [product["name"] for product in response.json()["data"]["products"]]
+        assert "Stale Turnips" in names
+
+    def test_archived_id_is_not_reused(self, archived_product, test_user):
+        """A product created after archiving never takes the archived id."""
+        db = TestingSessionLocal()
+        try:
+            product = create_product(
+                db, {"name": "Swede", "price": 0.9, "product_owner_id": test_user.id}
+            )
+            assert product.id > archived_product
+        finally:
+            db.close()
+
+    def test_restore_product(self, archived_product, test_user):
+        response = client.post(
+            f"/api/product/{archived_product}/restore",
+            headers=auth_headers(test_user),
+        )
+        assert response.status_code == 200
+
+        db = TestingSessionLocal()
+        try:
+            assert db.get(ProductArchive, archived_product) is None
+            assert db.get(Product, archived_product).name == "Stale Turnips"
+        finally:
+            db.close()
+
+        response = client.post(
+            f"/api/product/{archived_product}/restore",
+            headers=auth_headers(test_user),
+        )
+        assert response.status_code == 404
+
+    def test_scheduler_run_records_table_sizes(self, test_products):
+        archive_scheduler.run_once(TestingSessionLocal)
+        stats = archive_scheduler.stats()
+        assert stats["runs"] >= 1
+        assert "product_archive" in stats["table_rows"]
+        assert "bulk_request_archive" in stats["table_rows"]
+
+
+@pytest.fixture
+def tomato_products(setup_database, test_user):
+    """Products of a fresh category to compute similar products for."""
+    db = TestingSessionLocal()
+    try:
+        category = Category(name="Test Tomatoes")
+        db.add(category)
+        db.commit()
+        products = [
+            Product(
+                name=name,
+                price=price,
+                category_id=category_id,
+                product_owner_id=test_user.id,
+                is_active=True,
+            )
+            for name, price, category_id in [
+                ("Cherry Tomatoes", 3.0, category.id),
+                ("Plum Tomatoes", 3.2, category.id),
+                ("Oak Firewood", 80.0, None),
+            ]
+        ]
+        db.add_all(products)
+        db.commit()
+        return {product.name: product.id for product in products}
+    finally:
+        db.close()
+
+
+def similar_names(product_id: int) -> list:
+    response = client.get(f"/api/product/{product_id}/similar?limit=3")
+    assert response.status_code == 200
+    return [product["name"] for product in response.json()["data"]["products"]]
+
+
+class TestSimilarProducts:
+    """Test the precomputed similar products."""
+
+    def test_scores_and_top_k(self):
+        features = ProductFeatures(
+            [
+                (1, "Cherry Tomatoes", 1, 3.0),
+                (2, "Plum Tomatoes", 1, 3.0),
+                (3, "Cherry Tomatoes", None, 3.0),
+                (4, "Firewood", None, 30.0),
+            ]
+        )
+        scores = features.scores(np.array([0]))
+        # Same name and price without the category, or the reverse
+        assert scores[0, 2] == pytest.approx(0.7)
+        assert scores[0, 1] == pytest.approx(0.25 + 0.3 + 0.2)
+        assert scores[0, 0] == -np.inf
+
+        columns, best = top_k(scores, 2)
+        assert columns.tolist() == [[1, 2]]
+        assert top_k(scores, 10)[0].shape == (1, 3)
+
+    def test_endpoint_and_incremental_refresh(self, tomato_products, test_products, test_user):
+        db = TestingSessionLocal()
+        try:
+            refresh_similar_products(db, full=True, k=2)
+            cherry = tomato_products["Cherry Tomatoes"]
+            assert similar_names(cherry)[0] == "Plum Tomatoes"
+
+            # Only the renamed product is recomputed, and the lists it now
+            # enters with it
+            update_product(
+                db,
+                tomato_products["Oak Firewood"],
+                {
+                    "name": "Grape Tomatoes",
+                    "price": 3.0,
+                    "category_id": db.get(Product, cherry).category_id,
+                },
+                test_user.id,
+            )
+            result = refresh_similar_products(db, k=2)
+            assert result["changed"] == 1
+            assert result["recomputed"] < result["products"]
+            assert similar_names(cherry)[:2] == ["Grape Tomatoes", "Plum Tomatoes"]
+
+            update_product(
+                db, tomato_products["Plum Tomatoes"], {"is_active": False}, test_user.id
+            )
+            result = refresh_similar_products(db, k=2)
+            assert result["removed"] == 1
+            assert "Plum Tomatoes" not in similar_names(cherry)
+            assert refresh_similar_products(db, k=2)["recomputed"] == 0
+        finally:
+            db.close()
+
+        assert client.get("/api/product/999999/similar").status_code == 404
+
+
+class TestStartup:
+    """Test the application lifespan warm-up."""
+
+    def test_ready_after_warm_up(self, test_products):
+        """The lifespan warms up the app and reports it ready."""
+        with TestClient(app) as lifespan_client:
+            response = lifespan_client.get("/api/ready")
+
+        assert response.status_code == 200
+        phases = response.json()["data"]["phases_ms"]
+        assert "crypto" in phases
+        assert "warmup:product_list" in phases
+
+
 if __name__ == "__main__":
     # Run tests with pytest
     pytest.main([__file__, "-v"])
@@ -1,5 +1,8 @@
+import os
+from typing import Callable, List
 from fastapi.encoders import jsonable_encoder
-from fastapi import HTTPException
+from fastapi import HTTPException, UploadFile
+from fastapi.responses import Response, FileResponse
 from sqlalchemy.orm import Session
 from apps.product.services import (
     get_all_products,
@@ -7,10 +10,31 @@ from apps.product.services import (
     delete_product,
     update_product,
     get_all_product_categories,
-    product_exists_for_user,
+    get_product_facets,
+    set_product_photo,
+    get_products_by_ids,
+    get_similar_products,
+    restore_product,
 )
-from apps.product.schemas import ProductCreate, ProductListQueryParams, ProductUpdate
+from apps.product.schemas import (
+    ProductCreate,
+    ProductListQueryParams,
+    ProductUpdate,
+    ProductFacetQueryParams,
+)
+from apps.product.cache import product_list_cache, product_facets_cache
+from apps.product import photos
+from apps.common.cache import ResponseCache
 from apps.common.custom_response import CustomJSONResponse
+from apps.common.replicas import primary_session
+from apps.common.rows import serialize_row, serialize_rows
+from config import PHOTO_MAX_UPLOAD_BYTES, PRODUCT_BATCH_MAX_IDS
+
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+
+def _invalid_fields_response(error: ValueError) -> CustomJSONResponse:
+    return CustomJSONResponse(content={}, message=str(error), status_code=400)
 
 
 def get_user_products_view(
@@ -20,19 +44,27 @@ def get_user_products_view(
     Get all products for the authenticated user.
     Return JSON-serializable list of products.
     """
+    try:
+        fields = query_params.field_list()
+        sort_by, sort_order = query_params.sorting()
+    except ValueError as e:
+        return _invalid_fields_response(e)
     try:
         result = get_all_products(
             db_session=db,
             page=query_params.page,
             limit=query_params.limit,
             search=query_params.search,
+            search_mode=query_params.search_mode,
             category_id=query_params.category_id,
             is_active=query_params.is_active,
             min_price=query_params.min_price,
             max_price=query_params.max_price,
-            sort_by=query_params.sort_by,
-            sort_order=query_params.sort_order,
+            sort_by=sort_by,
+            sort_order=sort_order,
             user_id=user_id,
+            fields=fields,
+            include_archived=query_params.include_archived,
         )
 
         if not result["success"]:
@@ -56,28 +88,9 @@ def get_user_products_view(
                 message="No products found.",
                 status_code=200,
             )
-        serialized_products = [
-            {
-                "id": product.id,
-                "name": product.name,
-                "description": product.description,
-                "price": product.price,
-                "photo_url": product.photo_url,
-                "is_active": bool(product.is_active),
-                "category": product.category.name if product.category else None,
-                "category_id": product.category_id,
-                "created_at": product.created_at.isoformat()
-                if product.created_at
-                else None,
-                "updated_at": product.updated_at.isoformat()
-                if product.updated_at
-                else None,
-            }
-            for product in products
-        ]
         return CustomJSONResponse(
             content={
-                "products": jsonable_encoder(serialized_products),
+                "products": serialize_rows(products),
                 "pagination": pagination,
             },
             message="User Products",
@@ -92,23 +105,98 @@ def get_user_products_view(
 
 def get_all_product_view(
     query_params: ProductListQueryParams, db: Session
-) -> CustomJSONResponse:
+) -> Response:
     """
     Get all products with optional query parameters for filtering, sorting, and pagination.
-    Return JSON-serializable list of products.
+    `fields` narrows both the selected columns and the serialized products.
+    Served from the shared product list cache when possible.
+    """
+    try:
+        query_params.field_list()
+        query_params.sorting()
+    except ValueError as e:
+        return _invalid_fields_response(e)
+    return _serve_cached(
+        product_list_cache,
+        query_params.cache_key(),
+        lambda session: _build_product_list_response(query_params, session),
+        db,
+    )
+
+
+def _serve_cached(
+    cache: ResponseCache,
+    cache_key: tuple,
+    build: Callable[[Session], Response],
+    db: Session,
+) -> Response:
+    """
+    Return the cached response for `cache_key`, or build and cache it.
+    A stale entry is returned immediately while it is rebuilt in the background
+    on its own session, outside of the request.
+
+    Only responses built on the primary are cached: a replica may still lag
+    behind the write that bumped the cache version. A miss answered from a
+    replica rebuilds the entry on the primary in the background instead.
+    """
+    primary = primary_session(db)
+
+    def refresh_on_primary() -> None:
+        bind = primary.get_bind()
+
+        def refresh() -> Response:
+            session = Session(bind=bind, autoflush=False)
+            try:
+                return build(session)
+            finally:
+                session.close()
+
+        cache.refresh_in_background(cache_key, refresh)
+
+    cached = cache.get(cache_key)
+    if cached is not None:
+        entry, is_stale = cached
+        if is_stale:
+            refresh_on_primary()
+            return entry.to_response("STALE")
+        return entry.to_response("HIT")
+
+    if primary is not db:
+        response = build(db)
+        refresh_on_primary()
+        response.headers["X-Cache"] = "MISS"
+        return response
+
+    version = cache.version
+    response = build(db)
+    cache.set(cache_key, response, version)
+    response.headers["X-Cache"] = "MISS"
+    return response
+
+
+def _build_product_list_response(
+    query_params: ProductListQueryParams, db: Session
+) -> CustomJSONResponse:
+    """
+    Query and serialize one page of the product list.
     """
     try:
+        fields = query_params.field_list()
+        sort_by, sort_order = query_params.sorting()
         result = get_all_products(
             db_session=db,
             page=query_params.page,
             limit=query_params.limit,
             search=query_params.search,
+            search_mode=query_params.search_mode,
             category_id=query_params.category_id,
             is_active=query_params.is_active,
             min_price=query_params.min_price,
             max_price=query_params.max_price,
-            sort_by=query_params.sort_by,
-            sort_order=query_params.sort_order,
+            sort_by=sort_by,
+            sort_order=sort_order,
+            fields=fields,
+            include_archived=query_params.include_archived,
         )
 
         if not result["success"]:
@@ -129,42 +217,63 @@ def get_all_product_view(
                 status_code=200,
             )
 
-        serialized_products = [
-            {
-                "id": product.id,
-                "name": product.name,
-                "description": product.description,
-                "price": product.price,
-                "photo_url": product.photo_url,
-                "is_active": bool(product.is_active),
-                "category": product.category.name if product.category else None,
-                "category_id": product.category_id,
-                "created_at": product.created_at.isoformat()
-                if product.created_at
-                else None,
-                "updated_at": product.updated_at.isoformat()
-                if product.updated_at
-                else None,
-            }
-            for product in products
-        ]
-
         print(f"Products fetched: {products}")
         return CustomJSONResponse(
             content={
-                "products": jsonable_encoder(serialized_products),
+                "products": serialize_rows(products),
                 "pagination": pagination,
             },
             message="Product List",
             status_code=200,
         )
     except Exception as e:
-        print(f"Error in get_all_product_view: {str(e)}")
+        print(f"Error in _build_product_list_response: {str(e)}")
         raise HTTPException(
             status_code=500, detail=f"Error in get_all_product_view: {str(e)}"
         )
 
 
+def get_products_batch_view(product_ids: List[int], db: Session) -> CustomJSONResponse:
+    """
+    Get specific products by id in one query. Products come back in the
+    requested order (duplicates removed) and unknown ids are listed in
+    `missing_ids`.
+    """
+    product_ids = list(dict.fromkeys(product_ids))
+    if len(product_ids) > PRODUCT_BATCH_MAX_IDS:
+        return CustomJSONResponse(
+            content={},
+            message=f"At most {PRODUCT_BATCH_MAX_IDS} product ids can be requested at once.",
+            status_code=400,
+        )
+    try:
+        products_by_id = {
+            product.id: product
+            for product in get_products_by_ids(db_session=db, product_ids=product_ids)
+        }
+        serialized_products = serialize_rows(
+            products_by_id[product_id]
+            for product_id in product_ids
+            if product_id in products_by_id
+        )
+        missing_ids = [
+            product_id for product_id in product_ids if product_id not in products_by_id
+        ]
+        return CustomJSONResponse(
+            content={
+                "products": serialized_products,
+                "missing_ids": missing_ids,
+            },
+            message="Product Batch",
+            status_code=200,
+        )
+    except Exception as e:
+        print(f"Error in get_products_batch_view: {str(e)}")
+        raise HTTPException(
+            status_code=500, detail=f"Error in get_products_batch_view: {str(e)}"
+        )
+
+
 def create_product_view(
     product: ProductCreate, db: Session, product_owner_id: int
 ) -> CustomJSONResponse:
@@ -172,22 +281,17 @@ def create_product_view(
     Create a new product.
     """
     try:
-        # If Product with same name already exists for same owner return already exists
-        existing_product = product_exists_for_user(
-            db_session=db,
-            product_name=product.name,
-            user_id=product_owner_id,
-        )
-        if existing_product:
+        product_data = product.model_dump(by_alias=True)
+        product_data["product_owner_id"] = product_owner_id
+        print(f"Creating product with data: {product_data}")
+        new_product = create_product(db, product_data)
+        # The insert found a product with the same name for the same owner
+        if new_product is None:
             return CustomJSONResponse(
                 content={},
                 message="Product with same name already exists",
                 status_code=400,
             )
-        product_data = product.model_dump(by_alias=True)
-        product_data["product_owner_id"] = product_owner_id
-        print(f"Creating product with data: {product_data}")
-        new_product = create_product(db, product_data)
         product = jsonable_encoder(new_product)
         return CustomJSONResponse(
             content={"product": product},
@@ -263,6 +367,8 @@ def update_product_view(
             message=f"Product with ID {product_id} updated successfully.",
             status_code=200,
         )
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"Error in update_product_view: {str(e)}")
         raise HTTPException(
@@ -270,6 +376,62 @@ def update_product_view(
         )
 
 
+def restore_product_view(product_id: int, user_id: int, db: Session) -> CustomJSONResponse:
+    """
+    Move an archived product back into the live product table.
+    """
+    try:
+        product = restore_product(db_session=db, product_id=product_id, user_id=user_id)
+        if not product:
+            return CustomJSONResponse(
+                content={},
+                message=f"Archived product with ID {product_id} not found.",
+                status_code=404,
+            )
+        return CustomJSONResponse(
+            content={"product": jsonable_encoder(product)},
+            message=f"Product with ID {product_id} restored successfully.",
+            status_code=200,
+        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"Error in restore_product_view: {str(e)}")
+        raise HTTPException(
+            status_code=500, detail=f"Error in restore_product_view: {str(e)}"
+        )
+
+
+def get_similar_products_view(product_id: int, limit: int, db: Session) -> CustomJSONResponse:
+    """
+    The "similar items" of a product, from the precomputed product_similarity
+    table. Each product carries its similarity `score`.
+    """
+    try:
+        similar = get_similar_products(db_session=db, product_id=product_id, limit=limit)
+        if similar is None:
+            return CustomJSONResponse(
+                content={},
+                message=f"Product with ID {product_id} not found.",
+                status_code=404,
+            )
+        products = []
+        for product, score in similar:
+            serialized = serialize_row(product)
+            serialized["score"] = score
+            products.append(serialized)
+        return CustomJSONResponse(
+            content={"products": products},
+            message="Similar Products",
+            status_code=200,
+        )
+    except Exception as e:
+        print(f"Error in get_similar_products_view: {str(e)}")
+        raise HTTPException(
+            status_code=500, detail=f"Error in get_similar_products_view: {str(e)}"
+        )
+
+
 def get_all_product_categories_view(db: Session) -> CustomJSONResponse:
     """
     Get all categories.
@@ -283,17 +445,8 @@ def get_all_product_categories_view(db: Session) -> CustomJSONResponse:
                 message="No categories found.",
                 status_code=404,
             )
-        serialized_categories = [
-            {
-                "id": category.id,
-                "name": category.name,
-                "description": category.description,
-                "is_active": category.is_active,
-            }
-            for category in data
-        ]
         return CustomJSONResponse(
-            content={"categories": jsonable_encoder(serialized_categories)},
+            content={"categories": serialize_rows(data)},
             message="Product Categories List",
             status_code=200,
         )
@@ -302,3 +455,120 @@ def get_all_product_categories_view(db: Session) -> CustomJSONResponse:
         raise HTTPException(
             status_code=500, detail=f"Error in get_all_product_category_view: {str(e)}"
         )
+
+
+def get_product_facets_view(
+    query_params: ProductFacetQueryParams, db: Session
+) -> Response:
+    """
+    Get facet counts (category, active state, price histogram) for the products
+    matching the given filters. Cached per filter set.
+    """
+    return _serve_cached(
+        product_facets_cache,
+        query_params.cache_key(),
+        lambda session: _build_product_facets_response(query_params, session),
+        db,
+    )
+
+
+def _build_product_facets_response(
+    query_params: ProductFacetQueryParams, db: Session
+) -> CustomJSONResponse:
+    try:
+        facets = get_product_facets(
+            db_session=db,
+            search=query_params.search,
+            category_id=query_params.category_id,
+            is_active=query_params.is_active,
+            min_price=query_params.min_price,
+            max_price=query_params.max_price,
+            price_bucket_size=query_params.price_bucket_size,
+        )
+        return CustomJSONResponse(
+            content={"facets": jsonable_encoder(facets)},
+            message="Product Facets",
+            status_code=200,
+        )
+    except Exception as e:
+        print(f"Error in get_product_facets_view: {str(e)}")
+        raise HTTPException(
+            status_code=500, detail=f"Error in get_product_facets_view: {str(e)}"
+        )
+
+
+def upload_product_photo_view(
+    product_id: int, user_id: int, photo: UploadFile, db: Session
+) -> CustomJSONResponse:
+    """
+    Store an uploaded product photo and point the product's photo_url at its
+    default thumbnail. Thumbnails are generated in the background; until they
+    exist the media route serves the original.
+    """
+    data = photo.file.read(PHOTO_MAX_UPLOAD_BYTES + 1)
+    if len(data) > PHOTO_MAX_UPLOAD_BYTES:
+        return CustomJSONResponse(
+            content={},
+            message=f"Photo is larger than {PHOTO_MAX_UPLOAD_BYTES} bytes.",
+            status_code=400,
+        )
+    try:
+        extension = photos.detect_image_format(data)
+    except photos.InvalidPhotoError as e:
+        return CustomJSONResponse(content={}, message=str(e), status_code=400)
+
+    try:
+        digest = photos.content_digest(data)
+        product = set_product_photo(
+            db_session=db,
+            product_id=product_id,
+            user_id=user_id,
+            photo_url=photos.default_photo_url(digest),
+            store_photo=lambda: photos.store_original(data, digest, extension),
+        )
+        if not product:
+            return CustomJSONResponse(
+                content={},
+                message=f"Product with ID {product_id} not found.",
+                status_code=404,
+            )
+
+        photos.schedule_thumbnails(digest)
+        return CustomJSONResponse(
+            content={
+                "product": jsonable_encoder(product),
+                "photo": {
+                    "original": photos.media_url("originals", f"{digest}.{extension}"),
+                    "variants": photos.photo_variants(digest),
+                },
+            },
+            message="Product photo uploaded successfully",
+            status_code=201,
+        )
+    except Exception as e:
+        print(f"Error in upload_product_photo_view: {str(e)}")
+        raise HTTPException(
+            status_code=500, detail=f"Error in upload_product_photo_view: {str(e)}"
+        )
+
+
+def serve_media_view(kind: str, filename: str) -> Response:
+    """
+    Serve a stored original or thumbnail. File names are content hashes, so
+    a file never changes once written and can be cached forever. A thumbnail
+    that is not generated yet falls back to the original, uncached.
+    """
+    match = photos.MEDIA_FILENAME_PATTERN.match(filename)
+    if kind not in photos.MEDIA_KINDS or match is None:
+        raise HTTPException(status_code=404, detail="Not found")
+
+    path = photos.media_path(kind, filename)
+    if os.path.exists(path):
+        return FileResponse(path, headers={"Cache-Control": IMMUTABLE_CACHE_CONTROL})
+
+    if kind == "thumbs":
+        original_path = photos.find_original(match.group("digest"))
+        if original_path is not None:
+            return FileResponse(original_path, headers={"Cache-Control": "no-cache"})
+
+    raise HTTPException(status_code=404, detail="Not found")
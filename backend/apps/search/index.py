@@ -0,0 +1,208 @@
+import heapq
+import threading
+import time
+from bisect import bisect_left, insort
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from apps.common.text import normalize_text
+
+# (kind, normalized text), e.g. ("product", "green apples")
+Term = Tuple[str, str]
+# (kind, text) as contributed by a row, before normalization
+Entry = Tuple[str, str]
+# The index holds its rows by (source, id), e.g. ("product", 12)
+RowKey = Tuple[str, int]
+
+
+class PrefixIndex:
+    """
+    In-memory autocomplete index: a sorted array of (word suffix, kind, term)
+    keys searched with bisect, so "app" finds "Apples" and "Green Apples".
+
+    Rows contribute terms by (source, id); a term's weight is the number of
+    rows contributing it, so names shared by many live rows rank first.
+    Writes update the index in place. `version` tracks the shared version
+    counter the contents correspond to (see apps.search.services).
+    """
+
+    def __init__(self, memo_size: int = 4096):
+        self._lock = threading.RLock()
+        self._memo_size = memo_size
+        self._clear()
+        self.version: Optional[int] = None
+        self.built_at: Optional[float] = None
+        self.rebuilds = 0
+        self.queries = 0
+        self.query_seconds = 0.0
+
+    def _clear(self) -> None:
+        self._keys: List[Tuple[str, str, str]] = []
+        self._weights: Counter = Counter()
+        self._display: Dict[Term, str] = {}
+        self._rows: Dict[RowKey, Tuple[Term, ...]] = {}
+        # prefix -> {(limit, kinds): results}
+        self._memo: Dict[str, Dict[Tuple[int, Optional[Tuple[str, ...]]], list]] = {}
+
+    @staticmethod
+    def _suffixes(term: str) -> List[str]:
+        words = term.split()
+        return [" ".join(words[start:]) for start in range(len(words))]
+
+    @staticmethod
+    def _terms(entries: Iterable[Entry]) -> Dict[Term, str]:
+        terms = {}
+        for kind, text in entries:
+            normalized = normalize_text(text or "")
+            if normalized:
+                terms[(kind, normalized)] = text.strip()
+        return terms
+
+    def _forget(self, term: Term) -> None:
+        # Drop the memoized lookups whose prefix matches the term
+        for suffix in self._suffixes(term[1]):
+            for end in range(1, len(suffix) + 1):
+                self._memo.pop(suffix[:end], None)
+
+    def _add_term(self, term: Term, display: str) -> None:
+        self._weights[term] += 1
+        if self._weights[term] == 1:
+            self._display[term] = display
+            kind, text = term
+            for suffix in self._suffixes(text):
+                insort(self._keys, (suffix, kind, text))
+
+    def _remove_term(self, term: Term) -> None:
+        self._weights[term] -= 1
+        if self._weights[term] <= 0:
+            del self._weights[term]
+            del self._display[term]
+            kind, text = term
+            for suffix in self._suffixes(text):
+                position = bisect_left(self._keys, (suffix, kind, text))
+                if position < len(self._keys) and self._keys[position] == (suffix, kind, text):
+                    del self._keys[position]
+
+    def _set(self, row: RowKey, entries: Iterable[Entry]) -> None:
+        terms = self._terms(entries)
+        new = tuple(sorted(terms))
+        old = self._rows.get(row, ())
+        if new == old:
+            return
+        for term in old:
+            self._remove_term(term)
+            self._forget(term)
+        for term in new:
+            self._add_term(term, terms[term])
+            self._forget(term)
+        if new:
+            self._rows[row] = new
+        else:
+            self._rows.pop(row, None)
+
+    def set(self, row: RowKey, entries: Iterable[Entry]) -> None:
+        """
+        Replace the terms contributed by `row`; no entries removes the row.
+        """
+        with self._lock:
+            self._set(row, entries)
+
+    def remove(self, row: RowKey) -> None:
+        self.set(row, ())
+
+    def display(self, row: RowKey, kind: str) -> Optional[str]:
+        """
+        The text `row` contributes for `kind`, e.g. a category's name.
+        """
+        with self._lock:
+            for term in self._rows.get(row, ()):
+                if term[0] == kind:
+                    return self._display[term]
+        return None
+
+    def rebuild(self, rows: Iterable[Tuple[RowKey, Sequence[Entry]]], version: Optional[int]) -> None:
+        """
+        Replace the whole index. The new arrays are built outside the lock,
+        sorted once, and swapped in, so lookups keep answering from the old
+        contents meanwhile.
+        """
+        weights: Counter = Counter()
+        display: Dict[Term, str] = {}
+        row_terms: Dict[RowKey, Tuple[Term, ...]] = {}
+        for row, entries in rows:
+            terms = self._terms(entries)
+            if not terms:
+                continue
+            row_terms[row] = tuple(sorted(terms))
+            for term, text in terms.items():
+                weights[term] += 1
+                display.setdefault(term, text)
+        keys = sorted(
+            (suffix, kind, text)
+            for kind, text in weights
+            for suffix in self._suffixes(text)
+        )
+        with self._lock:
+            self._keys = keys
+            self._weights = weights
+            self._display = display
+            self._rows = row_terms
+            self._memo = {}
+            self.version = version
+            self.built_at = time.time()
+            self.rebuilds += 1
+
+    def complete(
+        self, prefix: str, limit: int = 10, kinds: Optional[Sequence[str]] = None
+    ) -> List[dict]:
+        """
+        The `limit` heaviest terms with a word starting with `prefix`.
+        """
+        started = time.perf_counter()
+        prefix = normalize_text(prefix)
+        kinds = tuple(sorted(kinds)) if kinds else None
+        with self._lock:
+            memo = self._memo.get(prefix)
+            results = memo.get((limit, kinds)) if memo else None
+            if results is None:
+                results = self._complete(prefix, limit, kinds)
+                if memo is None:
+                    if len(self._memo) >= self._memo_size:
+                        self._memo.clear()
+                    memo = self._memo[prefix] = {}
+                memo[(limit, kinds)] = results
+        self.queries += 1
+        self.query_seconds += time.perf_counter() - started
+        return [dict(result) for result in results]
+
+    def _complete(self, prefix: str, limit: int, kinds: Optional[Tuple[str, ...]]) -> list:
+        if not prefix:
+            return []
+        start = bisect_left(self._keys, (prefix,))
+        # Just past the last key starting with the prefix
+        end = bisect_left(self._keys, (prefix + "\uffff",), lo=start)
+        matches = {
+            (kind, text)
+            for _, kind, text in self._keys[start:end]
+            if kinds is None or kind in kinds
+        }
+        best = heapq.nsmallest(
+            limit, matches, key=lambda term: (-self._weights[term], term[1], term[0])
+        )
+        return [
+            {"text": self._display[term], "kind": term[0], "weight": self._weights[term]}
+            for term in best
+        ]
+
+    def stats(self) -> dict:
+        return {
+            "terms": len(self._weights),
+            "keys": len(self._keys),
+            "rows": len(self._rows),
+            "version": self.version,
+            "rebuilds": self.rebuilds,
+            "queries": self.queries,
+            "avg_query_us": round(self.query_seconds / self.queries * 1e6, 2)
+            if self.queries
+            else 0.0,
+        }
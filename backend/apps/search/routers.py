@@ -0,0 +1,30 @@
+from fastapi import APIRouter, Depends, HTTPException
+from apps.common.custom_response import CustomJSONResponse
+from apps.common.replicas import get_read_db
+from apps.common.profiling import ProfiledRoute
+from apps.search.schemas import AutocompleteQueryParams
+from apps.search.views import autocomplete_view
+
+router = APIRouter(
+    prefix="/search",
+    tags=["search"],
+    responses={404: {"description": "Not found"}},
+    route_class=ProfiledRoute,
+)
+
+
+@router.get("/autocomplete")
+def autocomplete_route(
+    query_params: AutocompleteQueryParams = Depends(),
+    db=Depends(get_read_db),
+) -> CustomJSONResponse:
+    """
+    Typeahead suggestions from product, category and bulk request names,
+    most popular first.
+    """
+    try:
+        return autocomplete_view(query_params, db)
+
+    except Exception as e:
+        print(f"Error in autocomplete_route: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
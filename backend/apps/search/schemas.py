@@ -0,0 +1,30 @@
+from typing import Annotated, Optional, Tuple
+from pydantic import BaseModel, Field
+from config import AUTOCOMPLETE_MAX_LIMIT
+
+AUTOCOMPLETE_KINDS = ("product", "category", "bulk_request")
+
+
+class AutocompleteQueryParams(BaseModel):
+    q: Annotated[str, Field(min_length=1, max_length=100)]
+    limit: Annotated[int, Field(gt=0, le=AUTOCOMPLETE_MAX_LIMIT)] = 10
+    kinds: Optional[str] = Field(
+        None,
+        description="Comma-separated suggestion kinds: product, category, bulk_request",
+    )
+
+    def kind_list(self) -> Optional[Tuple[str, ...]]:
+        """
+        The requested kinds, or None for all of them. Raises ValueError for
+        unknown kinds.
+        """
+        if self.kinds is None or not self.kinds.strip():
+            return None
+        kinds = {kind.strip() for kind in self.kinds.split(",") if kind.strip()}
+        unknown = kinds - set(AUTOCOMPLETE_KINDS)
+        if unknown:
+            raise ValueError(
+                f"Unknown kinds: {', '.join(sorted(unknown))}. "
+                f"Available kinds: {', '.join(AUTOCOMPLETE_KINDS)}"
+            )
+        return tuple(kind for kind in AUTOCOMPLETE_KINDS if kind in kinds)
@@ -0,0 +1,226 @@
+import threading
+import time
+from typing import Iterator, List, Optional, Sequence, Tuple
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session, sessionmaker
+
+from apps.bulk_request.models import BulkRequest, BulkRequestArchive, BulkRequestStatus
+from apps.common.metrics import register_metrics
+from apps.common.shared_state import shared_versions
+from apps.product.models import Category, Product, ProductArchive
+from apps.search.index import Entry, PrefixIndex, RowKey
+from apps.search.trigram import TrigramIndex
+from config import FUZZY_SEARCH_THRESHOLD, SEARCH_INDEX_REBUILD_INTERVAL_SECONDS
+
+# Shared version counters bumped by every write that changes indexed names
+AUTOCOMPLETE_VERSION = "autocomplete_index"
+FUZZY_VERSION = "fuzzy_index"
+
+# Bulk requests still taking pledges are suggested
+SUGGESTED_BULK_REQUEST_STATUSES = (
+    BulkRequestStatus.OPEN,
+    BulkRequestStatus.PARTIALLY_FILLED,
+)
+
+autocomplete_index = PrefixIndex()
+fuzzy_index = TrigramIndex()
+
+
+def _product_entries(name: str, category_name: Optional[str]) -> List[Entry]:
+    # A product also counts towards the popularity of its category
+    return [("product", name), ("category", category_name)]
+
+
+def _bulk_request_names(product_name: str, title: str) -> List[Entry]:
+    return [("product_name", product_name), ("title", title)]
+
+
+def _autocomplete_rows(db_session: Session) -> Iterator[Tuple[RowKey, Sequence[Entry]]]:
+    categories = {}
+    for category_id, name in db_session.execute(
+        select(Category.id, Category.name).where(Category.is_active.is_(True))
+    ):
+        categories[category_id] = name
+        yield ("category", category_id), [("category", name)]
+    for product_id, name, category_id in db_session.execute(
+        select(Product.id, Product.name, Product.category_id).where(
+            Product.is_active.is_(True)
+        )
+    ):
+        yield ("product", product_id), _product_entries(name, categories.get(category_id))
+    for bulk_request_id, product_name in db_session.execute(
+        select(BulkRequest.id, BulkRequest.product_name).where(
+            BulkRequest.status.in_(SUGGESTED_BULK_REQUEST_STATUSES)
+        )
+    ):
+        yield ("bulk_request", bulk_request_id), [("bulk_request", product_name)]
+
+
+def _fuzzy_rows(db_session: Session) -> Iterator[Tuple[RowKey, Sequence[Entry]]]:
+    # Archived rows too, for listings with include_archived
+    for model in (Product, ProductArchive):
+        for product_id, name in db_session.execute(select(model.id, model.name)):
+            yield ("product", product_id), [("name", name)]
+    for model in (BulkRequest, BulkRequestArchive):
+        for bulk_request_id, product_name, title in db_session.execute(
+            select(model.id, model.product_name, model.title)
+        ):
+            yield ("bulk_request", bulk_request_id), _bulk_request_names(product_name, title)
+
+
+class _SharedIndex:
+    """
+    Keeps this worker's copy of an in-memory index in step with the database.
+
+    Writes update the copy in place and bump the shared version counter
+    `version_name`. When another worker wrote, the copy is rebuilt from
+    `load_rows` in a background thread (at most one at a time and one per
+    SEARCH_INDEX_REBUILD_INTERVAL_SECONDS) while lookups keep answering from
+    the current contents.
+    """
+
+    def __init__(self, index, version_name: str, load_rows):
+        self.index = index
+        self.version_name = version_name
+        self.load_rows = load_rows
+        self._lock = threading.Lock()
+        self._running = False
+        self._last_started = 0.0
+        self._session_factory = None
+
+    def rebuild(self, db_session: Session) -> None:
+        """
+        Load every indexed row. The version is read first, so writes
+        committed while loading leave the index marked stale.
+        """
+        version = shared_versions.get(self.version_name)
+        self.index.rebuild(self.load_rows(db_session), version)
+
+    def _rebuild_in_background(self) -> None:
+        try:
+            db_session = self._session_factory()
+            try:
+                self.rebuild(db_session)
+            finally:
+                db_session.close()
+        except Exception as e:
+            print(f"Error rebuilding {self.version_name}: {str(e)}")
+        finally:
+            with self._lock:
+                self._running = False
+
+    def ensure_fresh(self, db_session: Session) -> None:
+        if self.index.version is None:
+            with self._lock:
+                if self.index.version is None:
+                    self.rebuild(db_session)
+                    self._session_factory = sessionmaker(bind=db_session.get_bind())
+                    self._last_started = time.monotonic()
+            return
+        if shared_versions.get(self.version_name) == self.index.version:
+            return
+        with self._lock:
+            now = time.monotonic()
+            if (
+                self._running
+                or now - self._last_started < SEARCH_INDEX_REBUILD_INTERVAL_SECONDS
+            ):
+                return
+            self._running = True
+            self._last_started = now
+        threading.Thread(
+            target=self._rebuild_in_background,
+            name=f"{self.version_name}-rebuild",
+            daemon=True,
+        ).start()
+
+    def apply_write(self, row: RowKey, entries: Sequence[Entry]) -> None:
+        """
+        Apply a committed write to this worker's copy and bump the shared
+        version for the others. The copy stays current unless another worker
+        wrote in between, in which case it is rebuilt on a later lookup.
+        """
+        previous = self.index.version
+        if previous is not None:
+            self.index.set(row, entries)
+        version = shared_versions.bump(self.version_name)
+        if previous is not None and version == previous + 1:
+            self.index.version = version
+
+
+_autocomplete = _SharedIndex(autocomplete_index, AUTOCOMPLETE_VERSION, _autocomplete_rows)
+_fuzzy = _SharedIndex(fuzzy_index, FUZZY_VERSION, _fuzzy_rows)
+
+
+def rebuild_autocomplete_index(db_session: Session) -> None:
+    _autocomplete.rebuild(db_session)
+
+
+def ensure_fresh_index(db_session: Session) -> None:
+    """
+    Build the search indexes on first use, and start a background rebuild of
+    those changed by another worker since.
+    """
+    _autocomplete.ensure_fresh(db_session)
+    _fuzzy.ensure_fresh(db_session)
+
+
+def index_product(product: Product) -> None:
+    """
+    Called after a committed product write.
+    """
+    entries = []
+    if product.is_active:
+        category_name = autocomplete_index.display(("category", product.category_id), "category")
+        entries = _product_entries(product.name, category_name)
+    _autocomplete.apply_write(("product", product.id), entries)
+    _fuzzy.apply_write(("product", product.id), [("name", product.name)])
+
+
+def unindex_product(product_id: int) -> None:
+    _autocomplete.apply_write(("product", product_id), [])
+    _fuzzy.apply_write(("product", product_id), [])
+
+
+def index_bulk_request(bulk_request: BulkRequest) -> None:
+    """
+    Called after a committed bulk request write.
+    """
+    entries = []
+    if bulk_request.status in SUGGESTED_BULK_REQUEST_STATUSES:
+        entries = [("bulk_request", bulk_request.product_name)]
+    _autocomplete.apply_write(("bulk_request", bulk_request.id), entries)
+    _fuzzy.apply_write(
+        ("bulk_request", bulk_request.id),
+        _bulk_request_names(bulk_request.product_name, bulk_request.title),
+    )
+
+
+def autocomplete(
+    db_session: Session, prefix: str, limit: int, kinds: Optional[Sequence[str]] = None
+) -> List[dict]:
+    _autocomplete.ensure_fresh(db_session)
+    return autocomplete_index.complete(prefix, limit, kinds)
+
+
+def fuzzy_search(
+    db_session: Session, source: str, query: str, limit: Optional[int] = None
+) -> List[Tuple[int, float]]:
+    """
+    (id, similarity) of the `source` rows ("product" or "bulk_request")
+    whose names are at least FUZZY_SEARCH_THRESHOLD similar to `query`, most
+    similar first. Listings take every match and leave scoping (owner,
+    category, price...) and paging to SQL, so no `limit` there.
+    """
+    _fuzzy.ensure_fresh(db_session)
+    return [
+        (row_id, score)
+        for (_, row_id), score in fuzzy_index.search(
+            query, FUZZY_SEARCH_THRESHOLD, limit, source
+        )
+    ]
+
+
+register_metrics("autocomplete", autocomplete_index.stats)
+register_metrics("fuzzy_search", fuzzy_index.stats)
@@ -0,0 +1,344 @@
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, select
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from main import app
+from apps.common.database import get_db, Base
+from apps.bulk_request.models import BulkRequest, BulkRequestStatus
+from apps.bulk_request.services import get_all_bulk_requests
+from apps.common.replicas import get_read_db
+from apps.common.shared_state import shared_versions
+from apps.product.models import Category, Product
+from apps.product.services import (
+    create_product,
+    delete_product,
+    get_all_products,
+    update_product,
+)
+from apps.search.index import PrefixIndex
+from apps.search import services as search_services
+from apps.search.services import (
+    AUTOCOMPLETE_VERSION,
+    autocomplete_index,
+    ensure_fresh_index,
+    fuzzy_index,
+    index_bulk_request,
+)
+from apps.search.trigram import TrigramIndex, similarity, trigrams
+from apps.user.models import User, UserTypeEnum
+
+SQLALCHEMY_DATABASE_URL = "sqlite:///./test_search.db"
+engine = create_engine(
+    SQLALCHEMY_DATABASE_URL,
+    connect_args={"check_same_thread": False},
+    poolclass=StaticPool,
+)
+TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+
+def override_get_db():
+    """Override database dependency for testing."""
+    try:
+        db = TestingSessionLocal()
+        yield db
+    finally:
+        db.close()
+
+
+app.dependency_overrides[get_db] = override_get_db
+app.dependency_overrides[get_read_db] = override_get_db
+
+client = TestClient(app)
+
+
+@pytest.fixture(scope="module")
+def seeded_database():
+    """Categories and products to suggest, with the index built from them."""
+    Base.metadata.create_all(bind=engine)
+    db = TestingSessionLocal()
+    try:
+        user = User(
+            username="searchfarmer",
+            email="searchfarmer@example.com",
+            hashed_password="x",
+            user_type=UserTypeEnum.seller,
+        )
+        # Names are unique per owner, so a second seller also sells Apples
+        other_user = User(
+            username="searchfarmer2",
+            email="searchfarmer2@example.com",
+            hashed_password="x",
+            user_type=UserTypeEnum.seller,
+        )
+        fruit = Category(name="Fruit")
+        db.add_all([user, other_user, fruit])
+        db.commit()
+        for name, owner in [
+            ("Apples", user),
+            ("Apples", other_user),
+            ("Green Apples", user),
+            ("Apricots", user),
+            ("Bananas", user),
+        ]:
+            db.add(
+                Product(
+                    name=name,
+                    price=1.0,
+                    category_id=fruit.id,
+                    product_owner_id=owner.id,
+                    is_active=True,
+                )
+            )
+        db.add(
+            Product(
+                name="Applesauce",
+                price=1.0,
+                product_owner_id=user.id,
+                is_active=False,
+            )
+        )
+        db.commit()
+        autocomplete_index.version = None
+        fuzzy_index.version = None
+        ensure_fresh_index(db)
+        yield user.id, fruit.id
+    finally:
+        db.close()
+        Base.metadata.drop_all(bind=engine)
+
+
+def suggest(query: str) -> list:
+    response = client.get(f"/api/search/autocomplete?{query}")
+    assert response.status_code == 200
+    return [
+        (suggestion["text"], suggestion["kind"], suggestion["weight"])
+        for suggestion in response.json()["data"]["suggestions"]
+    ]
+
+
+class TestPrefixIndex:
+    """Test the in-memory prefix index."""
+
+    def test_matches_word_prefixes_by_weight(self):
+        index = PrefixIndex()
+        index.set(("product", 1), [("product", "Green Apples")])
+        index.set(("product", 2), [("product", "Apples")])
+        index.set(("product", 3), [("product", "Apples")])
+        index.set(("category", 1), [("category", "Appliances")])
+
+        results = index.complete("APP", limit=10)
+        assert [(r["text"], r["weight"]) for r in results] == [
+            ("Apples", 2),
+            ("Appliances", 1),
+            ("Green Apples", 1),
+        ]
+        assert [r["text"] for r in index.complete("app", 10, ["category"])] == [
+            "Appliances"
+        ]
+        assert index.complete("pples", limit=10) == []
+
+    def test_incremental_updates(self):
+        index = PrefixIndex()
+        index.set(("product", 1), [("product", "Carrots")])
+        assert index.complete("car", 5)[0]["text"] == "Carrots"
+
+        index.set(("product", 1), [("product", "Cabbage")])
+        assert [r["text"] for r in index.complete("ca", 5)] == ["Cabbage"]
+
+        index.remove(("product", 1))
+        assert index.complete("ca", 5) == []
+        assert index.stats()["keys"] == 0
+
+
+class TestTrigramIndex:
+    """Test the in-memory trigram index."""
+
+    def test_trigrams_and_similarity(self):
+        assert trigrams("pea") == {"  p", " pe", "pea", "ea "}
+        assert similarity(trigrams("tomatos"), trigrams("tomatoes")) == pytest.approx(6 / 11)
+        assert similarity(trigrams("tomatos"), frozenset()) == 0.0
+
+    def test_search_tolerates_typos(self):
+        index = TrigramIndex()
+        index.set(("product", 1), [("name", "Cherry Tomatoes")])
+        index.set(("product", 2), [("name", "Tomatoes")])
+        index.set(("product", 3), [("name", "Broccoli")])
+        index.set(("bulk_request", 1), [("title", "Tomatoes for sauce")])
+
+        # A product name's words match on their own
+        assert index.search("tomatos", 0.3, 10, "product") == [
+            (("product", 1), 0.5455),
+            (("product", 2), 0.5455),
+        ]
+        assert [row for row, _ in index.search("brocoli", 0.3, 10)] == [("product", 3)]
+        assert index.search("potatoes", 0.6, 10) == []
+
+        index.remove(("product", 3))
+        assert index.search("brocoli", 0.3, 10) == []
+        assert index.stats()["rows"] == 3
+
+
+class TestAutocomplete:
+    """Test the autocomplete endpoint."""
+
+    def test_suggestions_ranked_by_popularity(self, seeded_database):
+        assert suggest("q=ap") == [
+            ("Apples", "product", 2),
+            ("Apricots", "product", 1),
+            ("Green Apples", "product", 1),
+        ]
+        # The category counts itself and its five products
+        assert suggest("q=fr&kinds=category") == [("Fruit", "category", 6)]
+
+    def test_invalid_kinds(self, seeded_database):
+        response = client.get("/api/search/autocomplete?q=ap&kinds=farmer")
+        assert response.status_code == 400
+
+    def test_writes_update_index(self, seeded_database):
+        user_id, category_id = seeded_database
+        db = TestingSessionLocal()
+        try:
+            product = create_product(
+                db,
+                {
+                    "name": "Blueberries",
+                    "price": 4.0,
+                    "category_id": category_id,
+                    "product_owner_id": user_id,
+                },
+            )
+            assert suggest("q=blue") == [("Blueberries", "product", 1)]
+            assert ("Fruit", "category", 7) in suggest("q=fruit")
+
+            update_product(db, product.id, {"name": "Blackberries"}, user_id)
+            assert suggest("q=blue") == []
+            assert suggest("q=black") == [("Blackberries", "product", 1)]
+
+            delete_product(db, product.id, user_id)
+            assert suggest("q=black") == []
+            assert autocomplete_index.version == shared_versions.get(AUTOCOMPLETE_VERSION)
+        finally:
+            db.close()
+
+    def test_rebuilds_after_write_in_another_worker(self, seeded_database, monkeypatch):
+        user_id, category_id = seeded_database
+        monkeypatch.setattr("apps.search.services.SEARCH_INDEX_REBUILD_INTERVAL_SECONDS", 0)
+        db = TestingSessionLocal()
+        try:
+            # Written without this worker's index seeing it
+            db.add(Product(name="Cherries", price=2.0, product_owner_id=user_id, is_active=True))
+            db.commit()
+            shared_versions.bump(AUTOCOMPLETE_VERSION)
+        finally:
+            db.close()
+
+        # Hold the background rebuild so the lookup deterministically answers
+        # from the current contents
+        release = threading.Event()
+        rebuild = search_services._autocomplete.rebuild
+
+        def held_rebuild(db_session):
+            release.wait(2)
+            rebuild(db_session)
+
+        monkeypatch.setattr(search_services._autocomplete, "rebuild", held_rebuild)
+        assert suggest("q=cher") == []
+        release.set()
+        for _ in range(100):
+            if autocomplete_index.version == shared_versions.get(AUTOCOMPLETE_VERSION):
+                break
+            time.sleep(0.01)
+        assert suggest("q=cher") == [("Cherries", "product", 1)]
+
+
+class TestFuzzyListing:
+    """Test search_mode=fuzzy on the product and bulk request listings."""
+
+    def test_products_ranked_by_similarity(self, seeded_database):
+        response = client.get("/api/product?search=aples&search_mode=fuzzy&is_active=true")
+        assert response.status_code == 200
+        products = response.json()["data"]["products"]
+        assert [product["name"] for product in products] == [
+            "Apples",
+            "Apples",
+            "Green Apples",
+        ]
+
+        response = client.get("/api/product?search=aples&is_active=true")
+        assert response.json()["data"]["products"] == []
+
+        response = client.get("/api/product?search=aples&sort_by=relevance")
+        assert response.status_code == 400
+
+    def test_filters_apply_to_every_match(self, seeded_database):
+        """A seller's weak match is listed however many better matches others have."""
+        user_id, _ = seeded_database
+        db = TestingSessionLocal()
+        try:
+            other_user_id = db.execute(
+                select(User.id).where(User.username == "searchfarmer2")
+            ).scalar_one()
+            db.add_all(
+                Product(name=f"Plum {i}", price=2.0, product_owner_id=other_user_id)
+                for i in range(100, 400)
+            )
+            db.add(Product(name="Plum tart", price=2.0, product_owner_id=user_id))
+            db.commit()
+            fuzzy_index.version = None
+            ensure_fresh_index(db)
+
+            result = get_all_products(
+                db, search="plums", search_mode="fuzzy", user_id=user_id
+            )
+            assert [row.name for row in result["data"]] == ["Plum tart"]
+            assert result["pagination"]["total"] == 1
+
+            result = get_all_products(
+                db, search="plums", search_mode="fuzzy", sort_by="relevance", page=31
+            )
+            assert [row.name for row in result["data"]] == ["Plum tart"]
+            assert result["pagination"]["total"] == 301
+        finally:
+            db.query(Product).filter(Product.name.like("Plum%")).delete(
+                synchronize_session=False
+            )
+            db.commit()
+            fuzzy_index.version = None
+            ensure_fresh_index(db)
+            db.close()
+
+    def test_bulk_requests(self, seeded_database):
+        user_id, _ = seeded_database
+        db = TestingSessionLocal()
+        try:
+            bulk_request = BulkRequest(
+                title="Broccoli for the canteen",
+                product_name="Broccoli",
+                quantity_needed=50,
+                unit="kg",
+                delivery_deadline=datetime.now(timezone.utc) + timedelta(days=7),
+                delivery_location="Cork",
+                status=BulkRequestStatus.CLOSED,
+                buyer_id=user_id,
+            )
+            db.add(bulk_request)
+            db.commit()
+            index_bulk_request(bulk_request)
+
+            result = get_all_bulk_requests(db, search="brocoli", search_mode="fuzzy")
+            assert [row.title for row in result["bulk_requests"]] == [
+                "Broccoli for the canteen"
+            ]
+            assert get_all_bulk_requests(db, search="brocoli")["bulk_requests"] == []
+        finally:
+            db.close()
+
+
+if __name__ == "__main__":
+    # Run tests with pytest
+    pytest.main([__file__, "-v"])
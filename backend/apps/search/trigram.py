@@ -0,0 +1,184 @@
+import math
+import threading
+import time
+from collections import defaultdict
+from typing import Dict, FrozenSet, Iterable, List, Optional, Sequence, Set, Tuple
+
+from apps.common.text import normalize_text
+from apps.search.index import Entry, RowKey
+
+
+def trigrams(text: str) -> FrozenSet[str]:
+    """
+    The trigrams of normalized `text`, each word padded like pg_trgm does
+    ("apple" -> "  a", " ap", "app", "ppl", "ple", "le ").
+    """
+    grams = set()
+    for word in text.split():
+        padded = f"  {word} "
+        grams.update(padded[i : i + 3] for i in range(len(padded) - 2))
+    return frozenset(grams)
+
+
+def similarity(a: FrozenSet[str], b: FrozenSet[str]) -> float:
+    """
+    Share of trigrams in common (Jaccard similarity), 0.0 to 1.0.
+    """
+    if not a or not b:
+        return 0.0
+    shared = len(a & b)
+    return shared / (len(a) + len(b) - shared)
+
+
+class TrigramIndex:
+    """
+    In-memory trigram inverted index for typo-tolerant name search, so
+    "tomatos" finds "Cherry Tomatoes".
+
+    Every normalized name and each of its words is indexed as a string with
+    its trigram set; postings map a trigram to the strings containing it.
+    A query only visits the postings of its rarest trigrams: a string at
+    least `threshold` similar must share ceil(threshold * n) of the query's
+    n trigrams, so it contains at least one of any n - ceil(threshold * n) + 1
+    of them. The candidates are then scored exactly, and a row scores as its
+    best matching string.
+
+    Rows contribute names by (source, id), as in PrefixIndex; `version`
+    tracks the shared version counter (see apps.search.services).
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._strings: Dict[str, Set[RowKey]] = {}
+        self._grams: Dict[str, FrozenSet[str]] = {}
+        self._postings: Dict[str, Set[str]] = defaultdict(set)
+        self._rows: Dict[RowKey, Tuple[str, ...]] = {}
+        self.version: Optional[int] = None
+        self.built_at: Optional[float] = None
+        self.rebuilds = 0
+        self.queries = 0
+        self.candidates = 0
+        self.query_seconds = 0.0
+
+    @staticmethod
+    def _strings_of(entries: Iterable[Entry]) -> Tuple[str, ...]:
+        strings = set()
+        for _, text in entries:
+            normalized = normalize_text(text or "")
+            if normalized:
+                strings.add(normalized)
+                strings.update(normalized.split())
+        return tuple(sorted(strings))
+
+    def _add_string(self, string: str, row: RowKey) -> None:
+        rows = self._strings.get(string)
+        if rows is None:
+            rows = self._strings[string] = set()
+            grams = self._grams[string] = trigrams(string)
+            for gram in grams:
+                self._postings[gram].add(string)
+        rows.add(row)
+
+    def _remove_string(self, string: str, row: RowKey) -> None:
+        rows = self._strings.get(string)
+        if rows is None:
+            return
+        rows.discard(row)
+        if not rows:
+            del self._strings[string]
+            for gram in self._grams.pop(string):
+                postings = self._postings[gram]
+                postings.discard(string)
+                if not postings:
+                    del self._postings[gram]
+
+    def set(self, row: RowKey, entries: Iterable[Entry]) -> None:
+        """
+        Replace the names contributed by `row`; no entries removes the row.
+        """
+        new = self._strings_of(entries)
+        with self._lock:
+            old = self._rows.get(row, ())
+            if new == old:
+                return
+            for string in set(old) - set(new):
+                self._remove_string(string, row)
+            for string in set(new) - set(old):
+                self._add_string(string, row)
+            if new:
+                self._rows[row] = new
+            else:
+                self._rows.pop(row, None)
+
+    def remove(self, row: RowKey) -> None:
+        self.set(row, ())
+
+    def rebuild(self, rows: Iterable[Tuple[RowKey, Sequence[Entry]]], version: Optional[int]) -> None:
+        """
+        Replace the whole index with one built outside the lock.
+        """
+        fresh = TrigramIndex()
+        for row, entries in rows:
+            strings = fresh._strings_of(entries)
+            if strings:
+                fresh._rows[row] = strings
+                for string in strings:
+                    fresh._add_string(string, row)
+        with self._lock:
+            self._strings = fresh._strings
+            self._grams = fresh._grams
+            self._postings = fresh._postings
+            self._rows = fresh._rows
+            self.version = version
+            self.built_at = time.time()
+            self.rebuilds += 1
+
+    def search(
+        self,
+        query: str,
+        threshold: float,
+        limit: Optional[int] = None,
+        source: Optional[str] = None,
+    ) -> List[Tuple[RowKey, float]]:
+        """
+        The rows (of `source`, or any; up to `limit` if given) with a name at
+        least `threshold` similar to `query`, most similar first.
+        """
+        started = time.perf_counter()
+        query_grams = trigrams(normalize_text(query))
+        if not query_grams:
+            return []
+        needed = max(1, math.ceil(threshold * len(query_grams) - 1e-9))
+        with self._lock:
+            rarest = sorted(query_grams, key=lambda gram: len(self._postings.get(gram, ())))
+            candidates = set()
+            for gram in rarest[: len(query_grams) - needed + 1]:
+                candidates.update(self._postings.get(gram, ()))
+
+            scores: Dict[RowKey, float] = {}
+            for string in candidates:
+                score = similarity(query_grams, self._grams[string])
+                if score < threshold:
+                    continue
+                for row in self._strings[string]:
+                    if (source is None or row[0] == source) and score > scores.get(row, 0.0):
+                        scores[row] = score
+        best = sorted(scores.items(), key=lambda item: (-item[1], item[0]))[:limit]
+        self.queries += 1
+        self.candidates += len(candidates)
+        self.query_seconds += time.perf_counter() - started
+        return [(row, round(score, 4)) for row, score in best]
+
+    def stats(self) -> dict:
+        return {
+            "strings": len(self._strings),
+            "trigrams": len(self._postings),
+            "rows": len(self._rows),
+            "version": self.version,
+            "rebuilds": self.rebuilds,
+            "queries": self.queries,
+            "avg_candidates": round(self.candidates / self.queries, 1) if self.queries else 0.0,
+            "avg_query_us": round(self.query_seconds / self.queries * 1e6, 2)
+            if self.queries
+            else 0.0,
+        }
@@ -0,0 +1,26 @@
+from sqlalchemy.orm import Session
+from apps.common.custom_response import CustomJSONResponse
+from apps.search.schemas import AutocompleteQueryParams
+from apps.search.services import autocomplete
+
+
+def autocomplete_view(
+    query_params: AutocompleteQueryParams, db: Session
+) -> CustomJSONResponse:
+    """
+    Suggestions for a search box, answered from the in-memory prefix index.
+    """
+    try:
+        kinds = query_params.kind_list()
+    except ValueError as e:
+        return CustomJSONResponse(content={}, message=str(e), status_code=400)
+    try:
+        suggestions = autocomplete(db, query_params.q, query_params.limit, kinds)
+        return CustomJSONResponse(
+            content={"suggestions": suggestions},
+            message="Autocomplete suggestions",
+            status_code=200,
+        )
+    except Exception as e:
+        print(f"Error in autocomplete_view: {str(e)}")
+        return CustomJSONResponse(content={}, message=str(e), status_code=500)
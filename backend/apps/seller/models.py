@@ -0,0 +1,124 @@
+from sqlalchemy import Boolean, DDL, Float, Integer, String, event
+from sqlalchemy.orm import Mapped, mapped_column
+from apps.bulk_request.models import BulkRequestPledge, BulkRequestPledgeArchive
+from apps.common.models import BaseDatabaseModel
+from apps.product.models import Product, ProductArchive
+
+# Width of the price buckets in seller_product_rollup. Baked into the
+# triggers below, so changing it needs a migration that rebuilds the rollup.
+PRICE_BUCKET_WIDTH = 5
+
+
+class SellerProductRollup(BaseDatabaseModel):
+    """
+    Product counts per seller, creation day, category, active state and price
+    bucket, kept up to date by triggers on product and product_archive. A
+    seller's catalog is the sum over all periods.
+
+    `period` is a day (YYYY-MM-DD), or a month (YYYY-MM) once compacted.
+    `category_id` is 0 for uncategorized products.
+    """
+
+    __tablename__ = "seller_product_rollup"
+
+    seller_id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=False)
+    period: Mapped[str] = mapped_column(String(10), primary_key=True)
+    category_id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=False)
+    is_active: Mapped[bool] = mapped_column(Boolean, primary_key=True)
+    price_bucket: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=False)
+    product_count: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+
+
+class SellerPledgeRollup(BaseDatabaseModel):
+    """
+    Pledge count, quantity and amount (quantity x price per unit) per farmer,
+    pledge day and status, kept up to date by triggers on
+    bulk_request_pledge and its archive. `period` is as in
+    SellerProductRollup.
+    """
+
+    __tablename__ = "seller_pledge_rollup"
+
+    seller_id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=False)
+    period: Mapped[str] = mapped_column(String(10), primary_key=True)
+    status: Mapped[str] = mapped_column(String(20), primary_key=True)
+    pledge_count: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    quantity: Mapped[float] = mapped_column(Float, nullable=False, default=0.0)
+    amount: Mapped[float] = mapped_column(Float, nullable=False, default=0.0)
+
+
+def _add_product(row: str, sign: int) -> str:
+    return f"""
+        INSERT INTO seller_product_rollup
+            (seller_id, period, category_id, is_active, price_bucket, product_count)
+        SELECT {row}.product_owner_id,
+               date(coalesce({row}.created_at, '1970-01-01')),
+               coalesce({row}.category_id, 0),
+               {row}.is_active,
+               CAST({row}.price / {PRICE_BUCKET_WIDTH} AS INTEGER),
+               {sign}
+        WHERE {row}.product_owner_id IS NOT NULL
+        ON CONFLICT (seller_id, period, category_id, is_active, price_bucket)
+        DO UPDATE SET product_count = product_count + excluded.product_count;
+    """
+
+
+def _add_pledge(row: str, sign: int) -> str:
+    return f"""
+        INSERT INTO seller_pledge_rollup
+            (seller_id, period, status, pledge_count, quantity, amount)
+        VALUES ({row}.farmer_id,
+                date({row}.created_at),
+                {row}.status,
+                {sign},
+                {sign} * {row}.quantity_pledged,
+                {sign} * {row}.quantity_pledged * {row}.price_per_unit)
+        ON CONFLICT (seller_id, period, status)
+        DO UPDATE SET pledge_count = pledge_count + excluded.pledge_count,
+                      quantity = quantity + excluded.quantity,
+                      amount = amount + excluded.amount;
+    """
+
+
+def rollup_triggers(table_name: str, add, columns: str) -> list:
+    """
+    CREATE TRIGGER statements applying every insert, delete and update (of
+    `columns`) on `table_name` to a rollup, through `add(row, sign)`. Moves
+    between a live table and its archive cancel out.
+    """
+    return [
+        f"""
+        CREATE TRIGGER IF NOT EXISTS {table_name}_rollup_insert
+        AFTER INSERT ON {table_name}
+        BEGIN {add("new", 1)} END
+        """,
+        f"""
+        CREATE TRIGGER IF NOT EXISTS {table_name}_rollup_update
+        AFTER UPDATE OF {columns} ON {table_name}
+        BEGIN {add("old", -1)} {add("new", 1)} END
+        """,
+        f"""
+        CREATE TRIGGER IF NOT EXISTS {table_name}_rollup_delete
+        AFTER DELETE ON {table_name}
+        BEGIN {add("old", -1)} END
+        """,
+    ]
+
+
+PRODUCT_COLUMNS = "product_owner_id, created_at, category_id, is_active, price"
+PLEDGE_COLUMNS = "farmer_id, created_at, status, quantity_pledged, price_per_unit"
+
+ROLLUP_TRIGGERS = {
+    Product.__table__: rollup_triggers("product", _add_product, PRODUCT_COLUMNS),
+    ProductArchive.__table__: rollup_triggers("product_archive", _add_product, PRODUCT_COLUMNS),
+    BulkRequestPledge.__table__: rollup_triggers(
+        "bulk_request_pledge", _add_pledge, PLEDGE_COLUMNS
+    ),
+    BulkRequestPledgeArchive.__table__: rollup_triggers(
+        "bulk_request_pledge_archive", _add_pledge, PLEDGE_COLUMNS
+    ),
+}
+
+for _table, _statements in ROLLUP_TRIGGERS.items():
+    for _statement in _statements:
+        event.listen(_table, "after_create", DDL(_statement).execute_if(dialect="sqlite"))
@@ -0,0 +1,37 @@
+from fastapi import APIRouter, Depends, HTTPException, Request
+from apps.common.auth import is_authenticated
+from apps.common.custom_response import CustomJSONResponse
+from apps.common.replicas import get_read_db
+from apps.common.profiling import ProfiledRoute
+from apps.seller.schemas import SellerAnalyticsQueryParams
+from apps.seller.views import get_seller_analytics_view
+from apps.user.models import UserTypeEnum
+
+router = APIRouter(
+    prefix="/seller",
+    tags=["seller"],
+    responses={404: {"description": "Not found"}},
+    route_class=ProfiledRoute,
+)
+
+
+@router.get("/analytics")
+def get_seller_analytics_route(
+    request: Request,
+    query_params: SellerAnalyticsQueryParams = Depends(),
+    db=Depends(get_read_db),
+    is_authenticated=Depends(is_authenticated),
+) -> CustomJSONResponse:
+    """
+    Dashboard figures of the authenticated seller, read from rollup tables.
+    """
+    if request.state.user_type != UserTypeEnum.seller.value:
+        raise HTTPException(
+            status_code=403, detail="You are not authorized to view this resource"
+        )
+    try:
+        return get_seller_analytics_view(db, request.state.user_id, query_params)
+
+    except Exception as e:
+        print(f"Error in get_seller_analytics_route: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
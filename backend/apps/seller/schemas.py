@@ -0,0 +1,15 @@
+from typing import Literal
+from pydantic import BaseModel, Field
+from config import SELLER_ANALYTICS_DAILY_DAYS
+
+
+class SellerAnalyticsQueryParams(BaseModel):
+    days: int = Field(
+        30,
+        gt=0,
+        le=SELLER_ANALYTICS_DAILY_DAYS,
+        description="Days covered by the daily pledge series",
+    )
+    granularity: Literal["day", "month"] = Field(
+        "day", description="month sums the pledge series per month over all time"
+    )
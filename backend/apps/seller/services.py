@@ -0,0 +1,214 @@
+from datetime import date, timedelta
+from typing import Dict, Optional
+from fastapi import HTTPException
+from sqlalchemy import case, delete, func, select
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.orm import Session
+from apps.bulk_request.models import PledgeStatus
+from apps.common.archive import archive_scheduler
+from apps.product.models import Category
+from apps.seller.models import PRICE_BUCKET_WIDTH, SellerPledgeRollup, SellerProductRollup
+from config import SELLER_ANALYTICS_DAILY_DAYS
+
+product_rollup = SellerProductRollup.__table__
+pledge_rollup = SellerPledgeRollup.__table__
+
+# Pledges counted towards pledged volume, and those counted as revenue
+PLEDGED_STATUSES = (PledgeStatus.PENDING, PledgeStatus.ACCEPTED, PledgeStatus.FULFILLED)
+REVENUE_STATUSES = (PledgeStatus.ACCEPTED, PledgeStatus.FULFILLED)
+
+# Keys and summed measures of each rollup table
+ROLLUPS = (
+    (
+        product_rollup,
+        ("category_id", "is_active", "price_bucket"),
+        ("product_count",),
+        "product_count",
+    ),
+    (
+        pledge_rollup,
+        ("status",),
+        ("pledge_count", "quantity", "amount"),
+        "pledge_count",
+    ),
+)
+
+
+def _catalog(db_session: Session, seller_id: int) -> dict:
+    rows = db_session.execute(
+        select(
+            product_rollup.c.category_id,
+            product_rollup.c.is_active,
+            product_rollup.c.price_bucket,
+            func.sum(product_rollup.c.product_count).label("products"),
+        )
+        .where(product_rollup.c.seller_id == seller_id)
+        .group_by(
+            product_rollup.c.category_id,
+            product_rollup.c.is_active,
+            product_rollup.c.price_bucket,
+        )
+        .having(func.sum(product_rollup.c.product_count) != 0)
+    ).all()
+
+    by_category: Dict[int, dict] = {}
+    price_buckets: Dict[int, int] = {}
+    active = inactive = 0
+    for category_id, is_active, price_bucket, products in rows:
+        category = by_category.setdefault(
+            category_id, {"category_id": category_id or None, "count": 0, "active": 0}
+        )
+        category["count"] += products
+        if is_active:
+            category["active"] += products
+            active += products
+        else:
+            inactive += products
+        price_buckets[price_bucket] = price_buckets.get(price_bucket, 0) + products
+
+    names = dict(
+        db_session.execute(
+            select(Category.id, Category.name).where(Category.id.in_(list(by_category)))
+        ).all()
+    )
+    for category in by_category.values():
+        category["category"] = names.get(category["category_id"])
+    return {
+        "total": active + inactive,
+        "active": active,
+        "inactive": inactive,
+        "by_category": sorted(by_category.values(), key=lambda c: -c["count"]),
+        "price_distribution": [
+            {
+                "min": bucket * PRICE_BUCKET_WIDTH,
+                "max": (bucket + 1) * PRICE_BUCKET_WIDTH,
+                "count": price_buckets[bucket],
+            }
+            for bucket in sorted(price_buckets)
+        ],
+    }
+
+
+def _pledges(db_session: Session, seller_id: int, days: int, granularity: str) -> dict:
+    pledged = pledge_rollup.c.status.in_([status.name for status in PLEDGED_STATUSES])
+    revenue = pledge_rollup.c.status.in_([status.name for status in REVENUE_STATUSES])
+    by_status = db_session.execute(
+        select(
+            pledge_rollup.c.status,
+            func.sum(pledge_rollup.c.pledge_count),
+            func.sum(pledge_rollup.c.quantity),
+            func.sum(pledge_rollup.c.amount),
+        )
+        .where(pledge_rollup.c.seller_id == seller_id)
+        .group_by(pledge_rollup.c.status)
+        .having(func.sum(pledge_rollup.c.pledge_count) != 0)
+    ).all()
+
+    if granularity == "month":
+        period = func.substr(pledge_rollup.c.period, 1, 7)
+        window = []
+    else:
+        # Daily rows are kept for SELLER_ANALYTICS_DAILY_DAYS
+        period = pledge_rollup.c.period
+        since = (date.today() - timedelta(days=days - 1)).isoformat()
+        window = [func.length(pledge_rollup.c.period) == 10, pledge_rollup.c.period >= since]
+    series = db_session.execute(
+        select(
+            period.label("period"),
+            func.sum(case((pledged, pledge_rollup.c.pledge_count), else_=0)),
+            func.sum(case((pledged, pledge_rollup.c.quantity), else_=0.0)),
+            func.sum(case((pledged, pledge_rollup.c.amount), else_=0.0)),
+            func.sum(case((revenue, pledge_rollup.c.amount), else_=0.0)),
+        )
+        .where(pledge_rollup.c.seller_id == seller_id, *window)
+        .group_by(period)
+        .order_by(period)
+    ).all()
+
+    return {
+        "by_status": [
+            {
+                "status": PledgeStatus[status].value,
+                "count": count,
+                "quantity": round(quantity, 3),
+                "amount": round(amount, 2),
+            }
+            for status, count, quantity, amount in by_status
+        ],
+        "series": [
+            {
+                "period": period,
+                "pledges": count,
+                "quantity": round(quantity, 3),
+                "amount": round(amount, 2),
+                "revenue": round(revenue_amount, 2),
+            }
+            for period, count, quantity, amount, revenue_amount in series
+            if count or revenue_amount
+        ],
+    }
+
+
+def get_seller_analytics(
+    db_session: Session, seller_id: int, days: int = 30, granularity: str = "day"
+) -> dict:
+    """
+    Catalog and pledge figures of a seller, read only from the rollup
+    tables. The pledge series covers the last `days` days per day, or every
+    month with granularity="month".
+    """
+    try:
+        return {
+            "catalog": _catalog(db_session, seller_id),
+            "pledges": _pledges(db_session, seller_id, days, granularity),
+        }
+    except Exception as e:
+        print(f"Error fetching seller analytics: {str(e)}")
+        raise HTTPException(
+            status_code=500, detail=f"Error fetching seller analytics: {str(e)}"
+        )
+
+
+def compact_seller_rollups(
+    db_session: Session, older_than_days: Optional[float] = None
+) -> int:
+    """
+    Fold the daily rollup rows older than `older_than_days` (default
+    SELLER_ANALYTICS_DAILY_DAYS) into monthly rows and drop rows that sum to
+    nothing. Triggers keep adding daily rows for old days when old products
+    or pledges change; later runs fold those too. Returns the rows removed.
+    """
+    if older_than_days is None:
+        older_than_days = SELLER_ANALYTICS_DAILY_DAYS
+    cutoff = (date.today() - timedelta(days=older_than_days)).isoformat()
+    removed = 0
+    try:
+        for table, keys, measures, count_column in ROLLUPS:
+            old_days = [func.length(table.c.period) == 10, table.c.period < cutoff]
+            month = func.substr(table.c.period, 1, 7)
+            key_columns = [table.c.seller_id, month, *[table.c[key] for key in keys]]
+            fold = insert(table).from_select(
+                ["seller_id", "period", *keys, *measures],
+                select(*key_columns, *[func.sum(table.c[m]) for m in measures])
+                .where(*old_days)
+                .group_by(*key_columns),
+            )
+            fold = fold.on_conflict_do_update(
+                index_elements=["seller_id", "period", *keys],
+                set_={m: table.c[m] + fold.excluded[m] for m in measures},
+            )
+            db_session.execute(fold)
+            removed += db_session.execute(delete(table).where(*old_days)).rowcount
+            removed += db_session.execute(
+                delete(table).where(table.c[count_column] == 0)
+            ).rowcount
+        db_session.commit()
+        return removed
+    except Exception:
+        db_session.rollback()
+        raise
+
+
+archive_scheduler.register(
+    "seller_rollups", compact_seller_rollups, [product_rollup, pledge_rollup]
+)
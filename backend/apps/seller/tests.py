@@ -0,0 +1,221 @@
+from datetime import datetime, timedelta, timezone
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, select
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from main import app
+from apps.bulk_request.models import BulkRequest, BulkRequestPledge, PledgeStatus
+from apps.common.database import get_db, Base
+from apps.common.replicas import get_read_db
+from apps.product.models import Category, Product
+from apps.seller.models import SellerPledgeRollup
+from apps.seller.services import compact_seller_rollups
+from apps.user.models import User, UserTypeEnum
+from apps.user.services import create_access_token
+
+SQLALCHEMY_DATABASE_URL = "sqlite:///./test_seller.db"
+engine = create_engine(
+    SQLALCHEMY_DATABASE_URL,
+    connect_args={"check_same_thread": False},
+    poolclass=StaticPool,
+)
+TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+
+def override_get_db():
+    """Override database dependency for testing."""
+    try:
+        db = TestingSessionLocal()
+        yield db
+    finally:
+        db.close()
+
+
+app.dependency_overrides[get_db] = override_get_db
+app.dependency_overrides[get_read_db] = override_get_db
+
+client = TestClient(app)
+
+
+def auth_headers(user) -> dict:
+    token = create_access_token(
+        {
+            "user_id": user.id,
+            "username": user.username,
+            "user_type": user.user_type.value,
+        }
+    )
+    return {"Authorization": f"Bearer {token}"}
+
+
+@pytest.fixture(scope="module")
+def seeded_database():
+    """A seller with a small catalog and a buyer with a bulk request."""
+    Base.metadata.create_all(bind=engine)
+    db = TestingSessionLocal()
+    try:
+        seller = User(
+            username="rollupfarmer",
+            email="rollupfarmer@example.com",
+            hashed_password="x",
+            user_type=UserTypeEnum.seller,
+        )
+        buyer = User(
+            username="rollupbuyer",
+            email="rollupbuyer@example.com",
+            hashed_password="x",
+            user_type=UserTypeEnum.business,
+        )
+        greens = Category(name="Greens")
+        db.add_all([seller, buyer, greens])
+        db.commit()
+        for name, price, category_id, is_active in [
+            ("Kale", 3.0, greens.id, True),
+            ("Chard", 4.5, greens.id, True),
+            ("Spinach", 6.0, greens.id, False),
+            ("Honey", 12.0, None, True),
+        ]:
+            db.add(
+                Product(
+                    name=name,
+                    price=price,
+                    category_id=category_id,
+                    product_owner_id=seller.id,
+                    is_active=is_active,
+                )
+            )
+        bulk_request = BulkRequest(
+            title="Greens for the canteen",
+            product_name="Kale",
+            quantity_needed=100,
+            unit="kg",
+            delivery_deadline=datetime.now(timezone.utc) + timedelta(days=30),
+            delivery_location="Cork",
+            buyer_id=buyer.id,
+        )
+        db.add(bulk_request)
+        db.commit()
+        db.refresh(seller)
+        db.refresh(buyer)
+        yield seller, buyer, bulk_request.id
+    finally:
+        db.close()
+        Base.metadata.drop_all(bind=engine)
+
+
+def add_pledge(bulk_request_id, seller_id, quantity, price, status, created_at=None):
+    db = TestingSessionLocal()
+    try:
+        pledge = BulkRequestPledge(
+            quantity_pledged=quantity,
+            price_per_unit=price,
+            estimated_delivery_date=datetime.now(timezone.utc) + timedelta(days=7),
+            status=status,
+            bulk_request_id=bulk_request_id,
+            farmer_id=seller_id,
+            created_at=created_at or datetime.now(timezone.utc),
+        )
+        db.add(pledge)
+        db.commit()
+        return pledge.id
+    finally:
+        db.close()
+
+
+def analytics(seller, query: str = "") -> dict:
+    response = client.get(f"/api/seller/analytics?{query}", headers=auth_headers(seller))
+    assert response.status_code == 200
+    return response.json()["data"]
+
+
+class TestSellerAnalytics:
+    """Test the seller analytics rollups and endpoint."""
+
+    def test_catalog(self, seeded_database):
+        seller, _, _ = seeded_database
+        catalog = analytics(seller)["catalog"]
+        assert (catalog["total"], catalog["active"], catalog["inactive"]) == (4, 3, 1)
+        assert [
+            (category["category"], category["count"], category["active"])
+            for category in catalog["by_category"]
+        ] == [("Greens", 3, 2), (None, 1, 1)]
+        assert [
+            (bucket["min"], bucket["count"]) for bucket in catalog["price_distribution"]
+        ] == [(0, 2), (5, 1), (10, 1)]
+
+        # Updates move the product between rollup rows
+        db = TestingSessionLocal()
+        try:
+            kale = db.execute(select(Product).where(Product.name == "Kale")).scalar_one()
+            kale.is_active = False
+            db.commit()
+        finally:
+            db.close()
+        catalog = analytics(seller)["catalog"]
+        assert (catalog["total"], catalog["active"], catalog["inactive"]) == (4, 2, 2)
+
+    def test_pledges_over_time(self, seeded_database):
+        seller, _, bulk_request_id = seeded_database
+        pledge_id = add_pledge(bulk_request_id, seller.id, 10, 2.5, PledgeStatus.PENDING)
+        add_pledge(bulk_request_id, seller.id, 4, 3.0, PledgeStatus.REJECTED)
+
+        db = TestingSessionLocal()
+        try:
+            db.get(BulkRequestPledge, pledge_id).status = PledgeStatus.ACCEPTED
+            db.commit()
+        finally:
+            db.close()
+
+        pledges = analytics(seller)["pledges"]
+        assert sorted(
+            (status["status"], status["count"], status["amount"])
+            for status in pledges["by_status"]
+        ) == [("accepted", 1, 25.0), ("rejected", 1, 12.0)]
+        # Rejected pledges count towards neither volume nor revenue
+        assert [(p["pledges"], p["quantity"], p["revenue"]) for p in pledges["series"]] == [
+            (1, 10.0, 25.0)
+        ]
+
+    def test_compaction_folds_old_days_into_months(self, seeded_database):
+        seller, _, bulk_request_id = seeded_database
+        long_ago = datetime.now(timezone.utc) - timedelta(days=400)
+        add_pledge(bulk_request_id, seller.id, 5, 2.0, PledgeStatus.FULFILLED, long_ago)
+        add_pledge(bulk_request_id, seller.id, 5, 2.0, PledgeStatus.FULFILLED, long_ago)
+        before = analytics(seller, "granularity=month")["pledges"]
+
+        db = TestingSessionLocal()
+        try:
+            assert compact_seller_rollups(db) >= 1
+            periods = (
+                db.execute(
+                    select(SellerPledgeRollup.period).where(
+                        SellerPledgeRollup.seller_id == seller.id
+                    )
+                )
+                .scalars()
+                .all()
+            )
+        finally:
+            db.close()
+        assert long_ago.strftime("%Y-%m") in periods
+        assert long_ago.strftime("%Y-%m-%d") not in periods
+        assert analytics(seller, "granularity=month")["pledges"] == before
+        assert before["series"][0] == {
+            "period": long_ago.strftime("%Y-%m"),
+            "pledges": 2,
+            "quantity": 10.0,
+            "amount": 20.0,
+            "revenue": 20.0,
+        }
+
+    def test_sellers_only(self, seeded_database):
+        _, buyer, _ = seeded_database
+        response = client.get("/api/seller/analytics", headers=auth_headers(buyer))
+        assert response.status_code == 403
+
+
+if __name__ == "__main__":
+    # Run tests with pytest
+    pytest.main([__file__, "-v"])
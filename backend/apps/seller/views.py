@@ -0,0 +1,28 @@
+from sqlalchemy.orm import Session
+from apps.common.custom_response import CustomJSONResponse
+from apps.seller.schemas import SellerAnalyticsQueryParams
+from apps.seller.services import get_seller_analytics
+
+
+def get_seller_analytics_view(
+    db: Session, seller_id: int, query_params: SellerAnalyticsQueryParams
+) -> CustomJSONResponse:
+    """
+    Catalog counts by category, active state and price, and pledged volume
+    and revenue over time, for the seller's dashboard.
+    """
+    try:
+        analytics = get_seller_analytics(
+            db_session=db,
+            seller_id=seller_id,
+            days=query_params.days,
+            granularity=query_params.granularity,
+        )
+        return CustomJSONResponse(
+            content=analytics,
+            message="Seller Analytics",
+            status_code=200,
+        )
+    except Exception as e:
+        print(f"Error in get_seller_analytics_view: {str(e)}")
+        return CustomJSONResponse(content={}, message=str(e), status_code=500)
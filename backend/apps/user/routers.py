@@ -2,11 +2,15 @@ from fastapi import APIRouter, HTTPException
 from fastapi import Depends
 from sqlalchemy.orm import Session
 from apps.common.database import get_db
+from apps.common.profiling import ProfiledRoute
 from apps.user.schemas import CreateUser, LoginRequest
 from apps.user.views import register_user_view, login_view
 
 router = APIRouter(
-    prefix="/user", tags=["user"], responses={404: {"description": "Not found"}}
+    prefix="/user",
+    tags=["user"],
+    responses={404: {"description": "Not found"}},
+    route_class=ProfiledRoute,
 )
 
 
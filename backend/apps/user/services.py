@@ -2,11 +2,11 @@ from datetime import datetime, timedelta, timezone
 from typing import Optional
 
 from sqlalchemy.orm import Session
-from jose import JWTError, jwt
 from fastapi import HTTPException, status
+from apps.common.writer import execute_write
 from apps.user.models import User
 from apps.user.schemas import CreateUser, TokenData
-from config import PWD_CONTEXT, SECRET_KEY, ALGORITHM, ACCESS_TOKEN_EXPIRE_MINUTES
+from config import get_pwd_context, SECRET_KEY, ALGORITHM, ACCESS_TOKEN_EXPIRE_MINUTES
 
 
 def get_user_by_username(db: Session, username: str):
@@ -14,18 +14,24 @@ def get_user_by_username(db: Session, username: str):
 
 
 def create_user(db: Session, user: CreateUser):
-    hashed_password = PWD_CONTEXT.hash(user.password)
-    db_user = User(
-        username=user.username,
-        email=user.email,
-        hashed_password=hashed_password,
-        user_type=user.user_type,
-        created_at=datetime.now(timezone.utc),
-        updated_at=datetime.now(timezone.utc),
-    )
-    db.add(db_user)
-    db.commit()
-    return True
+    # Hashed here, on the request thread, not inside the write unit
+    hashed_password = get_pwd_context().hash(user.password)
+
+    def insert_user(session: Session) -> bool:
+        session.add(
+            User(
+                username=user.username,
+                email=user.email,
+                hashed_password=hashed_password,
+                user_type=user.user_type,
+                created_at=datetime.now(timezone.utc),
+                updated_at=datetime.now(timezone.utc),
+            )
+        )
+        session.flush()
+        return True
+
+    return execute_write(db, insert_user)
 
 
 def authenticate_user(db: Session, username: str, password: str) -> Optional[User]:
@@ -37,7 +43,7 @@ def authenticate_user(db: Session, username: str, password: str) -> Optional[Use
     if not user:
         return None
 
-    if not PWD_CONTEXT.verify(password, user.hashed_password):
+    if not get_pwd_context().verify(password, user.hashed_password):
         return None
 
     return user
@@ -47,6 +53,8 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -
     """
     Create JWT access token with user data.
     """
+    from jose import jwt
+
     to_encode = data.copy()
 
     if expires_delta:
@@ -66,6 +74,8 @@ def verify_token(token: str) -> TokenData:
     Verify JWT token and extract user data.
     Raises HTTPException if token is invalid.
     """
+    from jose import JWTError, jwt
+
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -0,0 +1,139 @@
+"""
+Microbenchmark for the cached listing statements.
+
+    python -m benchmarks.listing_statements [--calls 2000]
+
+Runs the product and bulk request listing queries against an in-memory
+SQLite database twice: once with the statement cache cleared before every
+call (the statements are rebuilt from scratch, as before) and once with the
+cache warm. The database work is the same in both runs, so the difference is
+the per-call Python overhead of building the statements.
+"""
+import argparse
+import contextlib
+import io
+import time
+from datetime import datetime, timezone
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+from sqlalchemy.pool import StaticPool
+
+from apps.common.database import Base
+from apps.user.models import User, UserTypeEnum
+from apps.product.models import Category, Product
+from apps.product import services as product_services
+from apps.bulk_request.models import BulkRequest
+from apps.bulk_request import services as bulk_request_services
+
+
+def make_session() -> Session:
+    engine = create_engine(
+        "sqlite://",
+        connect_args={"check_same_thread": False},
+        poolclass=StaticPool,
+    )
+    Base.metadata.create_all(engine)
+    session = Session(engine)
+    now = datetime.now(timezone.utc)
+    user = User(
+        username="bench",
+        email="bench@example.com",
+        hashed_password="x",
+        user_type=UserTypeEnum.seller,
+    )
+    category = Category(name="Bench")
+    session.add_all([user, category])
+    session.flush()
+    for i in range(50):
+        session.add(
+            Product(
+                name=f"Product {i}",
+                description="Benchmark product",
+                price=float(i),
+                category_id=category.id,
+                product_owner_id=user.id,
+                is_active=True,
+                created_at=now,
+                updated_at=now,
+            )
+        )
+        session.add(
+            BulkRequest(
+                title=f"Request {i}",
+                product_name="Product",
+                quantity_needed=float(i + 1),
+                unit="kg",
+                delivery_deadline=now,
+                delivery_location="Farm",
+                buyer_id=user.id,
+            )
+        )
+    session.commit()
+    return session
+
+
+def list_products(session: Session) -> None:
+    product_services._query_products(
+        session,
+        page=2,
+        limit=10,
+        search="product",
+        search_mode="substring",
+        category_id=None,
+        is_active=True,
+        min_price=5.0,
+        max_price=None,
+        sort_by="price",
+        sort_order="desc",
+        user_id=None,
+    )
+
+
+def list_bulk_requests(session: Session) -> None:
+    bulk_request_services.get_all_bulk_requests(
+        session, page=2, limit=10, search="request", min_quantity=5.0
+    )
+
+
+def measure(calls: int, fn, session: Session, clear_cache=None) -> float:
+    """
+    Average microseconds per call.
+    """
+    fn(session)
+    start = time.perf_counter()
+    for _ in range(calls):
+        if clear_cache is not None:
+            clear_cache()
+        fn(session)
+    return (time.perf_counter() - start) / calls * 1e6
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--calls", type=int, default=2000)
+    args = parser.parse_args(argv)
+
+    session = make_session()
+    cases = [
+        ("products", list_products, product_services._product_listing_statements),
+        (
+            "bulk requests",
+            list_bulk_requests,
+            bulk_request_services._bulk_request_listing_statements,
+        ),
+    ]
+    for name, fn, statements in cases:
+        # The bulk request listing prints its status filter on every call
+        with contextlib.redirect_stdout(io.StringIO()):
+            rebuilt = measure(args.calls, fn, session, statements.cache_clear)
+            cached = measure(args.calls, fn, session)
+        print(
+            f"{name:<14} rebuilt: {rebuilt:8.1f} us/call   "
+            f"cached: {cached:8.1f} us/call   "
+            f"saved: {rebuilt - cached:6.1f} us ({(1 - cached / rebuilt) * 100:.0f}%)"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,7 @@
 import os
 import importlib
+from functools import lru_cache
 from dotenv import load_dotenv
-from passlib.context import CryptContext
 
 
 load_dotenv()
@@ -9,6 +9,138 @@ load_dotenv()
 SECRET_KEY=str(os.getenv("SECRET_KEY"))
 ALGORITHM=str(os.getenv("ALGORITHM", "HS256"))
 ACCESS_TOKEN_EXPIRE_MINUTES=float(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", 30))
-PWD_CONTEXT = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
 
+@lru_cache(maxsize=None)
+def get_pwd_context():
+    """
+    Build the password hashing context on first use, so importing config does
+    not load passlib and its bcrypt backend.
+    """
+    from passlib.context import CryptContext
+
+    return CryptContext(schemes=["bcrypt"], deprecated="auto")
+
+
+def __getattr__(name):
+    # Keeps `from config import PWD_CONTEXT` working while building it lazily
+    if name == "PWD_CONTEXT":
+        return get_pwd_context()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+PRODUCT_LIST_CACHE_MAX_BYTES=int(os.getenv("PRODUCT_LIST_CACHE_MAX_BYTES", 16 * 1024 * 1024))
+PRODUCT_LIST_CACHE_TTL_SECONDS=float(os.getenv("PRODUCT_LIST_CACHE_TTL_SECONDS", 30))
+PRODUCT_LIST_CACHE_STALE_SECONDS=float(os.getenv("PRODUCT_LIST_CACHE_STALE_SECONDS", 120))
+# Most product ids accepted by one /api/product/batch call
+PRODUCT_BATCH_MAX_IDS=int(os.getenv("PRODUCT_BATCH_MAX_IDS", 500))
+# Idempotency-Key support on creates: completed keys remembered, for how
+# long, how long a duplicate waits for the request holding its key, and how
+# long that request's lease on the key lasts unless renewed
+IDEMPOTENCY_MAX_KEYS=int(os.getenv("IDEMPOTENCY_MAX_KEYS", 10000))
+IDEMPOTENCY_TTL_SECONDS=float(os.getenv("IDEMPOTENCY_TTL_SECONDS", 24 * 60 * 60))
+IDEMPOTENCY_WAIT_SECONDS=float(os.getenv("IDEMPOTENCY_WAIT_SECONDS", 30))
+IDEMPOTENCY_LEASE_SECONDS=float(os.getenv("IDEMPOTENCY_LEASE_SECONDS", 15))
+
+# Comma separated SQLAlchemy URLs of read replicas used by get_read_db
+READ_REPLICA_URLS=[url.strip() for url in os.getenv("READ_REPLICA_URLS", "").split(",") if url.strip()]
+REPLICA_HEALTH_CHECK_SECONDS=float(os.getenv("REPLICA_HEALTH_CHECK_SECONDS", 10))
+READ_YOUR_WRITES_SECONDS=float(os.getenv("READ_YOUR_WRITES_SECONDS", 5))
+# Refresh file-based SQLite replicas from the primary every N seconds (0 disables)
+SQLITE_REPLICA_REFRESH_SECONDS=float(os.getenv("SQLITE_REPLICA_REFRESH_SECONDS", 0))
+
+RATE_LIMIT_ENABLED=os.getenv("RATE_LIMIT_ENABLED", "true").lower() == "true"
+# (method, path) -> token buckets per client IP and per authenticated user
+# (burst size and refill rate in requests/second) and max concurrent requests
+RATE_LIMIT_RULES={
+    ("POST", "/api/user/login"): {
+        "ip_burst": float(os.getenv("LOGIN_RATE_LIMIT_BURST", 10)),
+        "ip_rate": float(os.getenv("LOGIN_RATE_LIMIT_PER_SECOND", 0.5)),
+        "concurrency": int(os.getenv("LOGIN_MAX_CONCURRENCY", 8)),
+    },
+    ("GET", "/api/product"): {
+        "ip_burst": float(os.getenv("PRODUCT_LIST_RATE_LIMIT_BURST", 120)),
+        "ip_rate": float(os.getenv("PRODUCT_LIST_RATE_LIMIT_PER_SECOND", 30)),
+        "user_burst": float(os.getenv("PRODUCT_LIST_USER_RATE_LIMIT_BURST", 120)),
+        "user_rate": float(os.getenv("PRODUCT_LIST_USER_RATE_LIMIT_PER_SECOND", 30)),
+        "concurrency": int(os.getenv("PRODUCT_LIST_MAX_CONCURRENCY", 32)),
+    },
+}
+
+# Warm-up run by the app lifespan before the worker is reported ready
+STARTUP_WARMUP=os.getenv("STARTUP_WARMUP", "true").lower() == "true"
+
+# Memory-mapped file holding cache version counters shared by all workers.
+# Set by serve.py before the workers are forked; unset means process-local.
+SHARED_STATE_PATH=os.getenv("FARMDIRECT_SHARED_STATE_PATH") or None
+# Per-connection SQLite settings applied by get_engine
+SQLITE_JOURNAL_MODE=os.getenv("SQLITE_JOURNAL_MODE", "WAL")
+SQLITE_BUSY_TIMEOUT_MS=int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", 5000))
+# Route creates and updates through one writer thread per worker that
+# group-commits them (see apps/common/writer.py); off by default
+WRITE_COORDINATOR_ENABLED=os.getenv("WRITE_COORDINATOR_ENABLED", "false").lower() == "true"
+WRITE_COORDINATOR_MAX_BATCH=int(os.getenv("WRITE_COORDINATOR_MAX_BATCH", 64))
+WRITE_COORDINATOR_TIMEOUT_SECONDS=float(os.getenv("WRITE_COORDINATOR_TIMEOUT_SECONDS", 30))
+
+# /api/metrics is only served to requests sending "X-Metrics-Token: <METRICS_TOKEN>";
+# unset disables the endpoint
+METRICS_TOKEN=os.getenv("METRICS_TOKEN") or None
+
+# Request profiling (see apps/common/profiling.py): requests sending
+# "X-Profile: <PROFILING_TOKEN>", or picked at PROFILING_SAMPLE_RATE, get a
+# sampled flame-graph profile written to PROFILING_DIR. Off unless one is set.
+PROFILING_TOKEN=os.getenv("PROFILING_TOKEN") or None
+PROFILING_SAMPLE_RATE=float(os.getenv("PROFILING_SAMPLE_RATE", 0))
+PROFILING_DIR=os.getenv("PROFILING_DIR", "./profiles")
+PROFILING_INTERVAL_MS=float(os.getenv("PROFILING_INTERVAL_MS", 5))
+PROFILING_MAX_PROFILES=int(os.getenv("PROFILING_MAX_PROFILES", 200))
+
+# Uploaded product photos: content-addressed originals and WebP thumbnails
+MEDIA_ROOT=os.getenv("MEDIA_ROOT", "./media")
+MEDIA_URL_PREFIX=os.getenv("MEDIA_URL_PREFIX", "/api/media")
+PHOTO_MAX_UPLOAD_BYTES=int(os.getenv("PHOTO_MAX_UPLOAD_BYTES", 10 * 1024 * 1024))
+PHOTO_THUMBNAIL_SIZES=[int(size) for size in os.getenv("PHOTO_THUMBNAIL_SIZES", "160,320,640").split(",")]
+# Variant stored in Product.photo_url, one of PHOTO_THUMBNAIL_SIZES
+PHOTO_DEFAULT_SIZE=int(os.getenv("PHOTO_DEFAULT_SIZE", 640))
+if PHOTO_DEFAULT_SIZE not in PHOTO_THUMBNAIL_SIZES:
+    raise ValueError(
+        f"PHOTO_DEFAULT_SIZE={PHOTO_DEFAULT_SIZE} is not one of "
+        f"PHOTO_THUMBNAIL_SIZES={PHOTO_THUMBNAIL_SIZES}"
+    )
+PHOTO_THUMBNAIL_WORKERS=int(os.getenv("PHOTO_THUMBNAIL_WORKERS", 2))
+
+# Archival of cold rows (inactive products, finished bulk requests) into
+# archive tables. 0 disables the periodic run.
+ARCHIVE_INTERVAL_SECONDS=float(os.getenv("ARCHIVE_INTERVAL_SECONDS", 3600))
+ARCHIVE_BATCH_SIZE=int(os.getenv("ARCHIVE_BATCH_SIZE", 500))
+PRODUCT_ARCHIVE_AFTER_DAYS=float(os.getenv("PRODUCT_ARCHIVE_AFTER_DAYS", 30))
+BULK_REQUEST_ARCHIVE_AFTER_DAYS=float(os.getenv("BULK_REQUEST_ARCHIVE_AFTER_DAYS", 30))
+
+# Batched data backfills in Alembic revisions (apps/common/migrations.py).
+# With BACKFILL_DRY_RUN the upgrade only prints a timing estimate and aborts.
+BACKFILL_BATCH_SIZE=int(os.getenv("BACKFILL_BATCH_SIZE", 1000))
+BACKFILL_SLEEP_SECONDS=float(os.getenv("BACKFILL_SLEEP_SECONDS", 0.1))
+BACKFILL_DRY_RUN=os.getenv("BACKFILL_DRY_RUN", "false").lower() == "true"
+
+# Offline geocoding of bulk request delivery locations (name,lat,lon CSV)
+GAZETTEER_PATH=os.getenv("GAZETTEER_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "apps", "common", "data", "gazetteer.csv"))
+BULK_REQUEST_MAX_RADIUS_KM=float(os.getenv("BULK_REQUEST_MAX_RADIUS_KM", 500))
+
+# In-memory search indexes (apps/search). Workers rebuild their copy in the
+# background after writes made by other workers, at most this often.
+SEARCH_INDEX_REBUILD_INTERVAL_SECONDS=float(os.getenv("SEARCH_INDEX_REBUILD_INTERVAL_SECONDS", 2))
+AUTOCOMPLETE_MAX_LIMIT=int(os.getenv("AUTOCOMPLETE_MAX_LIMIT", 20))
+# search_mode=fuzzy listings: minimum trigram similarity (0-1) of a name to
+# the search
+FUZZY_SEARCH_THRESHOLD=float(os.getenv("FUZZY_SEARCH_THRESHOLD", 0.3))
+
+# Precomputed "similar products" (apps/product/similarity.py): list length,
+# products scored per NumPy block, and how often changed products are
+# recomputed (0 disables the job)
+SIMILAR_PRODUCTS_TOP_K=int(os.getenv("SIMILAR_PRODUCTS_TOP_K", 10))
+SIMILAR_PRODUCTS_BLOCK_SIZE=int(os.getenv("SIMILAR_PRODUCTS_BLOCK_SIZE", 256))
+SIMILAR_PRODUCTS_INTERVAL_SECONDS=float(os.getenv("SIMILAR_PRODUCTS_INTERVAL_SECONDS", 300))
+
+# Seller analytics rollups (apps/seller): daily rows older than this are
+# folded into monthly rows by the archiver's periodic run
+SELLER_ANALYTICS_DAILY_DAYS=int(os.getenv("SELLER_ANALYTICS_DAILY_DAYS", 90))
@@ -1,24 +1,173 @@
-from fastapi import FastAPI
+from contextlib import asynccontextmanager
+from fastapi import Depends, FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from apps.product.routers import router as product_router
-from apps.user.routers import router as user_router
-from apps.bulk_request.routers import router as bulk_request_router
-
-app = FastAPI()
-
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],  # I will have to update this on production for security
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+from starlette.concurrency import run_in_threadpool
+from apps.common.startup import StartupProfiler, FirstRequestTimer
+
 API_PREFIX = "/api"
-app.include_router(product_router, prefix=API_PREFIX)
-app.include_router(user_router, prefix=API_PREFIX)
-app.include_router(bulk_request_router, prefix=API_PREFIX)
 
 
-@app.get("/")
-def health_check():
-    return "Service is running!"
+def warm_up(app: FastAPI) -> None:
+    """
+    Initialize the engine and bcrypt backend, render the default product
+    listing once and build the search indexes, so the first real requests
+    do not pay for it.
+    Runs inside the lifespan, before the worker reports itself ready.
+    """
+    from sqlalchemy import text
+    from apps.common.database import get_db, get_engine
+    from apps.product.schemas import ProductListQueryParams
+    from apps.product.views import get_all_product_view
+    from apps.search.services import ensure_fresh_index
+    from config import get_pwd_context
+
+    startup = app.state.startup
+    with startup.phase("engine"):
+        get_engine()
+    with startup.phase("crypto"):
+        get_pwd_context().dummy_verify()
+
+    db_dependency = app.dependency_overrides.get(get_db, get_db)
+    db_generator = db_dependency()
+    db = next(db_generator)
+    try:
+        with startup.phase("warmup:database"):
+            db.execute(text("SELECT 1"))
+        with startup.phase("warmup:product_list"):
+            get_all_product_view(ProductListQueryParams(), db)
+        with startup.phase("warmup:search_indexes"):
+            ensure_fresh_index(db)
+    except Exception as e:
+        print(f"Error during warm-up: {str(e)}")
+    finally:
+        db_generator.close()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    from apps.common.archive import archive_scheduler
+    from apps.common.database import SessionLocal, get_engine
+    from apps.common.replicas import start_sqlite_replica_refresher
+    from apps.common.shared_state import leader_lock
+    from apps.common.writer import write_coordinator
+    from apps.product.photos import shutdown_thumbnail_workers
+    from apps.product.similarity import similar_products_job
+    from config import (
+        ARCHIVE_INTERVAL_SECONDS,
+        SIMILAR_PRODUCTS_INTERVAL_SECONDS,
+        SQLITE_REPLICA_REFRESH_SECONDS,
+        STARTUP_WARMUP,
+        WRITE_COORDINATOR_ENABLED,
+    )
+
+    startup = app.state.startup
+    if STARTUP_WARMUP:
+        await run_in_threadpool(warm_up, app)
+
+    def start_background_jobs():
+        start_sqlite_replica_refresher(get_engine(), SQLITE_REPLICA_REFRESH_SECONDS)
+        # Jobs are registered by the product and bulk request services, which
+        # the routers imported in create_app
+        archive_scheduler.start(SessionLocal, ARCHIVE_INTERVAL_SECONDS)
+        similar_products_job.start(SessionLocal, SIMILAR_PRODUCTS_INTERVAL_SECONDS)
+
+    # Only one worker runs them; the write coordinator serves this worker's
+    # own requests, so every worker starts one
+    leader_lock.run_when_leader(start_background_jobs)
+    if WRITE_COORDINATOR_ENABLED:
+        write_coordinator.start(SessionLocal)
+    startup.mark_ready()
+    print(f"Startup report: {startup.report()}")
+    yield
+    write_coordinator.stop()
+    shutdown_thumbnail_workers()
+
+
+def create_app() -> FastAPI:
+    """
+    Build the FastAPI application. Routers (and the models and services they
+    pull in) are imported here and timed, instead of at module import.
+    """
+    startup = StartupProfiler()
+
+    with startup.phase("import:config"):
+        from config import (
+            PROFILING_SAMPLE_RATE,
+            PROFILING_TOKEN,
+            RATE_LIMIT_ENABLED,
+            RATE_LIMIT_RULES,
+        )
+    with startup.phase("import:apps.common"):
+        from apps.common.custom_response import CustomJSONResponse
+        from apps.common.metrics import (
+            collect_metrics,
+            register_metrics,
+            require_metrics_token,
+        )
+        from apps.common.profiling import ProfilingMiddleware
+        from apps.common.rate_limit import RateLimitMiddleware
+    with startup.phase("import:apps.product.routers"):
+        from apps.product.routers import router as product_router, media_router
+    with startup.phase("import:apps.user.routers"):
+        from apps.user.routers import router as user_router
+    with startup.phase("import:apps.bulk_request.routers"):
+        from apps.bulk_request.routers import router as bulk_request_router
+    with startup.phase("import:apps.search.routers"):
+        from apps.search.routers import router as search_router
+    with startup.phase("import:apps.seller.routers"):
+        from apps.seller.routers import router as seller_router
+
+    app = FastAPI(lifespan=lifespan)
+    app.state.startup = startup
+    register_metrics("startup", startup.report)
+
+    # Innermost, so profiles cover routing and the handler only
+    if PROFILING_TOKEN or PROFILING_SAMPLE_RATE > 0:
+        app.add_middleware(ProfilingMiddleware)
+    # Added before CORS so that 429 responses still carry the CORS headers
+    app.add_middleware(
+        RateLimitMiddleware, rules=RATE_LIMIT_RULES, enabled=RATE_LIMIT_ENABLED
+    )
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=["*"],  # I will have to update this on production for security
+        allow_credentials=True,
+        allow_methods=["*"],
+        allow_headers=["*"],
+    )
+    app.add_middleware(FirstRequestTimer, profiler=startup)
+    app.include_router(product_router, prefix=API_PREFIX)
+    app.include_router(media_router, prefix=API_PREFIX)
+    app.include_router(user_router, prefix=API_PREFIX)
+    app.include_router(bulk_request_router, prefix=API_PREFIX)
+    app.include_router(search_router, prefix=API_PREFIX)
+    app.include_router(seller_router, prefix=API_PREFIX)
+
+    @app.get("/")
+    def health_check():
+        return "Service is running!"
+
+    @app.get(f"{API_PREFIX}/ready")
+    def readiness_check():
+        if not startup.is_ready:
+            return CustomJSONResponse(
+                content={}, message="Service is starting", status_code=503
+            )
+        return CustomJSONResponse(
+            content=startup.report(), message="Service is ready", status_code=200
+        )
+
+    @app.get(f"{API_PREFIX}/metrics", dependencies=[Depends(require_metrics_token)])
+    def metrics():
+        return collect_metrics()
+
+    return app
+
+
+def __getattr__(name):
+    # `uvicorn main:app` and `from main import app` build the app on first access
+    if name == "app":
+        global app
+        app = create_app()
+        return app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
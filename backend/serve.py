@@ -0,0 +1,232 @@
+"""
+Multi-worker production launcher.
+
+    python serve.py --host 0.0.0.0 --port 8000 --workers auto
+
+The parent process binds the listening socket once, optionally imports the
+application (--preload, the default) and forks N uvicorn workers that all
+accept on that socket. Each worker drops any database connections inherited
+from the parent and opens its own SQLite connections (WAL, busy timeout).
+
+Cache versions and read-your-writes deadlines live in a memory-mapped file
+created here and shared by all workers (see apps.common.shared_state), so a
+product write in one worker invalidates the response caches of every worker,
+and its author's next reads go to the primary whichever worker serves them.
+The periodic background jobs (archiving, similar products, replica refresh)
+run in one worker only, elected with an flock next to that file; when it
+exits another worker takes them over.
+
+Signals sent to the parent:
+- SIGHUP: graceful reload. A new set of workers is started, then the old
+  ones are asked to finish their in-flight requests and exit. With
+  --preload the new workers are forked from the already imported code, so
+  use --no-preload to pick up code changes on reload.
+- SIGTERM / SIGINT: graceful shutdown of every worker.
+Workers that die unexpectedly are replaced.
+"""
+import argparse
+import os
+import signal
+import socket
+import sys
+import tempfile
+import time
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Run the FarmDirect API with several workers")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument(
+        "--workers",
+        default="auto",
+        help="Number of worker processes, or 'auto' for one per CPU core",
+    )
+    parser.add_argument(
+        "--preload",
+        action=argparse.BooleanOptionalAction,
+        default=True,
+        help="Import the application in the parent before forking workers",
+    )
+    parser.add_argument("--log-level", default="info")
+    parser.add_argument(
+        "--graceful-timeout",
+        type=float,
+        default=30.0,
+        help="Seconds old workers get to finish in-flight requests",
+    )
+    return parser.parse_args(argv)
+
+
+def worker_count(value: str) -> int:
+    if value == "auto":
+        return max(1, os.cpu_count() or 1)
+    return max(1, int(value))
+
+
+def create_shared_state_file() -> str:
+    """
+    Create the file backing the shared cache version counters, in /dev/shm
+    when available so it never touches the disk.
+    """
+    directory = "/dev/shm" if os.path.isdir("/dev/shm") else None
+    handle, path = tempfile.mkstemp(prefix="farmdirect-state-", dir=directory)
+    os.close(handle)
+    return path
+
+
+def bind_socket(host: str, port: int) -> socket.socket:
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    return sock
+
+
+def run_worker(sock: socket.socket, app, log_level: str) -> None:
+    """
+    Body of a forked worker process. Never returns.
+    """
+    for signum in (signal.SIGHUP, signal.SIGTERM, signal.SIGINT, signal.SIGCHLD):
+        signal.signal(signum, signal.SIG_DFL)
+
+    exit_code = 0
+    try:
+        import uvicorn
+        from apps.common.database import dispose_engine_after_fork
+
+        dispose_engine_after_fork()
+        if app is None:
+            from main import app
+        config = uvicorn.Config(app, log_level=log_level, lifespan="on")
+        uvicorn.Server(config).run(sockets=[sock])
+    except Exception as e:
+        print(f"Worker {os.getpid()} failed: {str(e)}")
+        exit_code = 1
+    finally:
+        os._exit(exit_code)
+
+
+class Arbiter:
+    """
+    Keeps `workers` uvicorn processes running on a shared socket.
+    """
+
+    def __init__(self, sock, app, workers: int, log_level: str, graceful_timeout: float):
+        self.sock = sock
+        self.app = app
+        self.workers = workers
+        self.log_level = log_level
+        self.graceful_timeout = graceful_timeout
+        self.pids = set()
+        self.retiring = {}
+        self.reload_requested = False
+        self.stopping = False
+
+    def spawn(self) -> int:
+        pid = os.fork()
+        if pid == 0:
+            run_worker(self.sock, self.app, self.log_level)
+        self.pids.add(pid)
+        print(f"Started worker {pid}")
+        return pid
+
+    def retire(self, pids) -> None:
+        deadline = time.monotonic() + self.graceful_timeout
+        for pid in pids:
+            self.pids.discard(pid)
+            self.retiring[pid] = deadline
+            self._signal(pid, signal.SIGTERM)
+
+    def reload(self) -> None:
+        print("Reloading workers")
+        old_pids = list(self.pids)
+        for _ in range(self.workers):
+            self.spawn()
+        # Give the new workers a moment to run their lifespan warm-up
+        time.sleep(1.0)
+        self.retire(old_pids)
+
+    def reap(self) -> None:
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            self.retiring.pop(pid, None)
+            if pid in self.pids:
+                self.pids.discard(pid)
+                if not self.stopping:
+                    print(f"Worker {pid} exited with status {status}, replacing it")
+                    self.spawn()
+
+    def kill_overdue(self) -> None:
+        now = time.monotonic()
+        for pid, deadline in list(self.retiring.items()):
+            if now > deadline:
+                self._signal(pid, signal.SIGKILL)
+
+    def run(self) -> None:
+        signal.signal(signal.SIGHUP, self._on_reload)
+        signal.signal(signal.SIGTERM, self._on_stop)
+        signal.signal(signal.SIGINT, self._on_stop)
+
+        for _ in range(self.workers):
+            self.spawn()
+
+        while not self.stopping:
+            if self.reload_requested:
+                self.reload_requested = False
+                self.reload()
+            self.reap()
+            self.kill_overdue()
+            time.sleep(0.2)
+
+        self.retire(list(self.pids))
+        while self.retiring:
+            self.reap()
+            self.kill_overdue()
+            time.sleep(0.1)
+
+    def _on_reload(self, signum, frame):
+        self.reload_requested = True
+
+    def _on_stop(self, signum, frame):
+        self.stopping = True
+
+    @staticmethod
+    def _signal(pid: int, signum: int) -> None:
+        try:
+            os.kill(pid, signum)
+        except ProcessLookupError:
+            pass
+
+
+def main(argv=None) -> None:
+    args = parse_args(argv)
+    shared_state_path = create_shared_state_file()
+    # Must be set before the app (and apps.common.shared_state) is imported
+    os.environ["FARMDIRECT_SHARED_STATE_PATH"] = shared_state_path
+
+    sock = bind_socket(args.host, args.port)
+    app = None
+    if args.preload:
+        from main import app
+
+    workers = worker_count(args.workers)
+    print(f"Serving on {args.host}:{args.port} with {workers} workers")
+    try:
+        Arbiter(sock, app, workers, args.log_level, args.graceful_timeout).run()
+    finally:
+        sock.close()
+        os.remove(shared_state_path)
+        if os.path.exists(f"{shared_state_path}.leader"):
+            os.remove(f"{shared_state_path}.leader")
+
+
+if __name__ == "__main__":
+    sys.exit(main())